@@ -0,0 +1,156 @@
+"""Benchmark: thread-pool database access vs the asyncio engine (NbExchange.db_async)
+
+Runs the exchange in-process against a seeded SQLite file, then fires concurrent
+`GET /assignments` and `GET /collections` requests at it - first with queries run on
+the thread pool (the default), then with the asyncio engine - and reports throughput
+and latency for each.
+
+Run with:
+
+    python benchmarks/async_db.py --requests 500 --concurrency 50 --assignments 20 --students 20
+
+Needs `aiosqlite` installed (`pip install nbexchange[async]`). Note that aiosqlite runs
+SQLite on its own thread, so the asyncio engine pays off most with a networked database.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# NbExchange.db_url defaults to $NBEX_DB_URL, read on import, so point it at the database first
+db_dir = tempfile.mkdtemp(prefix="nbexchange-benchmark-")
+DB_URL = f"sqlite:///{db_dir}/benchmark.sqlite"
+os.environ["NBEX_DB_URL"] = DB_URL
+os.environ.setdefault("NBEX_BASE_STORE", db_dir)
+
+from tornado.httpclient import AsyncHTTPClient  # noqa: E402
+from traitlets.config import Config  # noqa: E402
+
+from nbexchange import database, dbutil  # noqa: E402
+from nbexchange.app import NbExchange  # noqa: E402
+from nbexchange.handlers import base  # noqa: E402
+from nbexchange.handlers.auth.user_handler import BaseUserHandler  # noqa: E402
+from nbexchange.models.actions import Action, AssignmentActions  # noqa: E402
+from nbexchange.models.assignments import Assignment  # noqa: E402
+from nbexchange.models.courses import Course  # noqa: E402
+from nbexchange.models.users import User  # noqa: E402
+
+COURSE = "benchmark_course"
+
+
+class HeaderUserHandler(BaseUserHandler):
+    """Everyone is an instructor on the benchmark course; the username comes from a header"""
+
+    def get_current_user(self, request):
+        return {
+            "name": request.request.headers.get("X-User", "instructor"),
+            "course_id": COURSE,
+            "course_title": "Benchmark course",
+            "course_role": "Instructor",
+            "org_id": 1,
+        }
+
+
+def seed(assignments, students):
+    """Give the course `assignments` assignments, each released then submitted by every student"""
+    dbutil.setup_db(DB_URL, log=logging.getLogger("benchmark"))
+    with database.scoped_session() as session:
+        course = Course(course_code=COURSE, org_id=1, course_title="Benchmark course")
+        users = [User(name=f"1-student{i}", org_id=1) for i in range(students)]
+        session.add_all([course] + users)
+        session.flush()
+        for a in range(assignments):
+            assignment = Assignment(assignment_code=f"assignment_{a}", course_id=course.id, active=True)
+            session.add(assignment)
+            session.flush()
+            session.add(
+                Action(
+                    user_id=users[0].id,
+                    assignment_id=assignment.id,
+                    action=AssignmentActions.released,
+                    location=f"{db_dir}/released_{a}.gz",
+                )
+            )
+            for user in users:
+                session.add(
+                    Action(
+                        user_id=user.id,
+                        assignment_id=assignment.id,
+                        action=AssignmentActions.submitted,
+                        location=f"{db_dir}/{user.name}_{a}.gz",
+                    )
+                )
+
+
+async def hammer(url, requests, concurrency):
+    client = AsyncHTTPClient(max_clients=concurrency)
+    paths = [f"/assignments?course_id={COURSE}", f"/collections?course_id={COURSE}&assignment_id=assignment_0"]
+    latencies = []
+    pending = iter(range(requests))
+
+    async def worker(n):
+        for i in pending:
+            start = time.perf_counter()
+            r = await client.fetch(url + paths[i % len(paths)], headers={"X-User": f"instructor{n}"})
+            assert r.code == 200, r.code
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(n) for n in range(concurrency)])
+    return time.perf_counter() - start, latencies
+
+
+def run(db_async, args):
+    config = Config()
+    config.NbExchange.user_plugin_class = HeaderUserHandler
+    config.NbExchange.db_async = db_async
+    config.NbExchange.port = args.port
+    config.NbExchange.log_level = "WARN"
+    # Make every request resolve its user from the database
+    config.NbExchange.user_cache_size = 0
+
+    async def _run():
+        app = NbExchange.instance(config=config)
+        app.initialize([])
+        app.start(run_loop=False)
+        try:
+            url = f"http://127.0.0.1:{args.port}{app.base_url}".rstrip("/")
+            return await hammer(url, args.requests, args.concurrency)
+        finally:
+            app.stop()
+            NbExchange.clear_instance()
+            base.user_cache.clear()
+            if database.async_engine is not None:
+                await database.async_engine.dispose()
+                database.async_engine = database.AsyncSession = None
+
+    return asyncio.run(_run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500, help="number of requests per mode")
+    parser.add_argument("--concurrency", type=int, default=50, help="number of requests in flight")
+    parser.add_argument("--assignments", type=int, default=20, help="number of assignments on the course")
+    parser.add_argument("--students", type=int, default=20, help="number of students submitting each assignment")
+    parser.add_argument("--port", type=int, default=9123, help="port to run the exchange on")
+    args = parser.parse_args()
+
+    seed(args.assignments, args.students)
+    print(f"{args.requests} requests, {args.concurrency} concurrent, {args.assignments}x{args.students} submissions")
+    print(f"{'mode':<12} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for mode, db_async in [("thread-pool", False), ("asyncio", True)]:
+        elapsed, latencies = run(db_async, args)
+        latencies.sort()
+        p50 = statistics.median(latencies) * 1000
+        p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+        print(f"{mode:<12} {args.requests / elapsed:>8.1f} {p50:>8.1f} {p95:>8.1f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
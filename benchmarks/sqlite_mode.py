@@ -0,0 +1,184 @@
+"""Benchmark: SQLite with and without NbExchange.sqlite_performance_mode
+
+Runs the exchange in-process against a fresh SQLite file, releases some assignments, then has
+concurrent students list (`GET /assignments`), fetch (`GET /assignment`) and submit
+(`POST /submission`) at once - first with SQLite's defaults (a rollback journal, so every
+write locks out every read), then with `sqlite_performance_mode` (WAL and friends) - and
+reports throughput and latency for each, overall and per kind of request.
+
+Run with:
+
+    python benchmarks/sqlite_mode.py --requests 1000 --concurrency 50 --assignments 10
+
+Put `--dir` on the disk the exchange would really use: WAL (and the rollback journal) behave
+very differently on a RAM disk.
+"""
+
+import argparse
+import asyncio
+import io
+import logging
+import statistics
+import sys
+import tarfile
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+
+from tornado.httpclient import AsyncHTTPClient
+from traitlets.config import Config
+
+from nbexchange.app import NbExchange
+from nbexchange.handlers import base
+from nbexchange.handlers.auth.user_handler import BaseUserHandler
+
+COURSE = "benchmark_course"
+
+# How the traffic is mixed: most requests are listings, fewer fetch, fewer still submit
+MIX = ["list"] * 6 + ["fetch"] * 3 + ["submit"]
+
+
+class HeaderUserHandler(BaseUserHandler):
+    """Everyone is on the benchmark course; the username and role come from headers"""
+
+    def get_current_user(self, request):
+        return {
+            "name": request.request.headers.get("X-User", "instructor"),
+            "course_id": COURSE,
+            "course_title": "Benchmark course",
+            "course_role": request.request.headers.get("X-Role", "Instructor"),
+            "org_id": 1,
+        }
+
+
+def upload(field="assignment"):
+    """A multipart/form-data body holding a small .tar.gz, and its headers"""
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w:gz") as tar:
+        notebook = b'{"cells": [], "metadata": {}, "nbformat": 4, "nbformat_minor": 5}'
+        info = tarfile.TarInfo("notebook.ipynb")
+        info.size = len(notebook)
+        tar.addfile(info, io.BytesIO(notebook))
+    boundary = uuid.uuid4().hex
+    body = b"".join(
+        [
+            f"--{boundary}\r\n".encode(),
+            f'Content-Disposition: form-data; name="{field}"; filename="{field}.tar.gz"\r\n'.encode(),
+            b"Content-Type: application/gzip\r\n\r\n",
+            data.getvalue(),
+            f"\r\n--{boundary}--\r\n".encode(),
+        ]
+    )
+    return body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+async def release(client, url, assignments):
+    body, headers = upload()
+    for a in range(assignments):
+        r = await client.fetch(
+            f"{url}/assignment?course_id={COURSE}&assignment_id=assignment_{a}",
+            method="POST",
+            body=body,
+            headers=headers,
+        )
+        assert r.code == 200, r.code
+
+
+async def hammer(client, url, requests, concurrency, assignments):
+    body, upload_headers = upload()
+    latencies = defaultdict(list)
+    failures = defaultdict(int)
+    pending = iter(range(requests))
+
+    async def worker(n):
+        headers = {"X-User": f"student{n}", "X-Role": "Student"}
+        for i in pending:
+            kind = MIX[i % len(MIX)]
+            assignment = f"assignment_{i % assignments}"
+            if kind == "list":
+                request = {"request": f"{url}/assignments?course_id={COURSE}", "headers": headers}
+            elif kind == "fetch":
+                request = {
+                    "request": f"{url}/assignment?course_id={COURSE}&assignment_id={assignment}",
+                    "headers": headers,
+                }
+            else:
+                request = {
+                    "request": f"{url}/submission?course_id={COURSE}&assignment_id={assignment}",
+                    "headers": dict(headers, **upload_headers),
+                    "method": "POST",
+                    "body": body,
+                }
+            start = time.perf_counter()
+            r = await client.fetch(raise_error=False, **request)
+            latencies[kind].append(time.perf_counter() - start)
+            # eg "database is locked"
+            if r.code != 200 or (kind != "fetch" and not r.body.startswith(b'{"success": true')):
+                failures[kind] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(n) for n in range(concurrency)])
+    return time.perf_counter() - start, latencies, failures
+
+
+def run(performance_mode, args):
+    db_dir = tempfile.mkdtemp(prefix="nbexchange-benchmark-", dir=args.dir)
+    config = Config()
+    config.NbExchange.user_plugin_class = HeaderUserHandler
+    config.NbExchange.db_url = f"sqlite:///{db_dir}/benchmark.sqlite"
+    config.NbExchange.sqlite_performance_mode = performance_mode
+    config.NbExchange.port = args.port
+    config.NbExchange.log_level = "WARN"
+
+    async def _run():
+        app = NbExchange.instance(config=config)
+        # (not a configurable setting)
+        app.base_storage_location = db_dir
+        app.initialize([])
+        app.start(run_loop=False)
+        client = AsyncHTTPClient(max_clients=args.concurrency)
+        try:
+            url = f"http://127.0.0.1:{args.port}{app.base_url}".rstrip("/")
+            await release(client, url, args.assignments)
+            return await hammer(client, url, args.requests, args.concurrency, args.assignments)
+        finally:
+            app.stop()
+            NbExchange.clear_instance()
+            base.user_cache.clear()
+
+    return asyncio.run(_run())
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return statistics.median(latencies) * 1000, latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="number of requests per mode")
+    parser.add_argument("--concurrency", type=int, default=50, help="number of requests in flight")
+    parser.add_argument("--assignments", type=int, default=10, help="number of assignments on the course")
+    parser.add_argument("--dir", default=None, help="where to put the database and files (default: $TMPDIR)")
+    parser.add_argument("--port", type=int, default=9123, help="port to run the exchange on")
+    args = parser.parse_args()
+    logging.getLogger("tornado.access").setLevel(logging.ERROR)
+
+    print(f"{args.requests} requests, {args.concurrency} concurrent, mixed {'/'.join(sorted(set(MIX)))}")
+    print(f"{'mode':<12} {'request':<8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'failed':>7}")
+    for mode, performance_mode in [("default", False), ("performance", True)]:
+        elapsed, latencies, failures = run(performance_mode, args)
+        p50, p95 = percentiles([latency for kind in latencies.values() for latency in kind])
+        print(
+            f"{mode:<12} {'all':<8} {args.requests / elapsed:>8.1f} {p50:>8.1f} {p95:>8.1f} {sum(failures.values()):>7}"
+        )
+        for kind in sorted(latencies):
+            p50, p95 = percentiles(latencies[kind])
+            print(
+                f"{'':<12} {kind:<8} {len(latencies[kind]) / elapsed:>8.1f} {p50:>8.1f} {p95:>8.1f} {failures[kind]:>7}"
+            )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
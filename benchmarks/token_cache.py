@@ -0,0 +1,98 @@
+"""Micro-benchmark: how many JWT decodes does each request pay for?
+
+Every authenticated request resolves the user twice: once in the `authenticated`
+decorator (`self.current_user`) and once in `BaseHandler.nbex_user`. This compares:
+
+    uncached:  both look-ups decode the token (the previous behaviour)
+    memoised:  the request memoises the user, but every request still decodes once
+    cached:    memoised, and verified tokens are cached across requests
+
+Run with:
+
+    python benchmarks/token_cache.py --requests 10000 --users 100
+"""
+
+import argparse
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import jwt
+
+from nbexchange.handlers.auth.naas_user_handler import NaasUserHandler
+
+SECRET = "benchmark-secret"
+
+
+class FakeRequestHandler:
+    """Just enough of a tornado RequestHandler, including the `current_user` memoisation"""
+
+    def __init__(self, plugin, token):
+        self.plugin = plugin
+        self.cookies = {"noteable_auth": token}
+        self.request = SimpleNamespace(cookies=self.cookies)
+
+    def get_cookie(self, name, default=None):
+        return self.cookies.get(name, default)
+
+    @property
+    def current_user(self):
+        if not hasattr(self, "_current_user"):
+            self._current_user = self.plugin.get_current_user(self)
+        return self._current_user
+
+
+def make_tokens(users):
+    tokens = []
+    for i in range(users):
+        claims = {
+            "username": f"1_user{i}",
+            "n_fn": f"User {i}",
+            "n_cid": "course_1",
+            "n_cnm": "A course",
+            "n_rl": "Student",
+            "n_oid": 1,
+            "n_cust_id": 1,
+            "exp": int(time.time()) + 3600,
+        }
+        token = jwt.encode(claims, SECRET, algorithm="HS256")
+        tokens.append(token.decode("utf-8") if isinstance(token, bytes) else token)
+    return tokens
+
+
+def run(mode, tokens, requests):
+    plugin = NaasUserHandler()
+    if mode in ["uncached", "memoised"]:
+        plugin.token_cache.configure(maxsize=0, ttl=0)
+
+    with mock.patch.object(NaasUserHandler, "jwt_key", SECRET):
+        with mock.patch("nbexchange.handlers.auth.naas_user_handler.jwt.decode", wraps=jwt.decode) as decode:
+            start = time.perf_counter()
+            for i in range(requests):
+                handler = FakeRequestHandler(plugin, tokens[i % len(tokens)])
+                if mode == "uncached":
+                    plugin.get_current_user(handler)  # authenticated
+                    plugin.get_current_user(handler)  # nbex_user
+                else:
+                    handler.current_user  # authenticated
+                    handler.current_user  # nbex_user
+            elapsed = time.perf_counter() - start
+    return decode.call_count, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=10000, help="number of simulated requests")
+    parser.add_argument("--users", type=int, default=100, help="number of distinct users (tokens)")
+    args = parser.parse_args()
+
+    tokens = make_tokens(args.users)
+    print(f"{args.requests} requests from {args.users} users")
+    print(f"{'mode':<10} {'decodes':>8} {'decodes/request':>16} {'us/request':>11}")
+    for mode in ["uncached", "memoised", "cached"]:
+        decodes, elapsed = run(mode, tokens, args.requests)
+        print(f"{mode:<10} {decodes:>8} {decodes / args.requests:>16.3f} {elapsed / args.requests * 1e6:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+"""Add an (assignment_id, id) index to action
+
+Revision ID: 3c1d0a5e7b92
+Revises: 2540572282f2
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3c1d0a5e7b92"
+down_revision = "2540572282f2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_action_assignment_id_id", "action", ["assignment_id", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_action_assignment_id_id", table_name="action")
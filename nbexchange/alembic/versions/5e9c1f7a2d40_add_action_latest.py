@@ -0,0 +1,57 @@
+"""Add the action_latest summary table
+
+Revision ID: 5e9c1f7a2d40
+Revises: 8d4f2b6a1c37
+Create Date: 2026-10-18 15:12:37.402991
+
+"""
+
+from enum import Enum
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "5e9c1f7a2d40"
+down_revision = "8d4f2b6a1c37"
+branch_labels = None
+depends_on = None
+
+
+class AssignmentActions(Enum):
+    released = "released"
+    fetched = "fetched"
+    submitted = "submitted"
+    removed = "removed"
+    collected = "collected"
+    feedback_released = "feedback_released"
+    feedback_fetched = "feedback_fetched"
+
+
+def upgrade():
+    op.create_table(
+        "action_latest",
+        sa.Column("assignment_id", sa.Integer, sa.ForeignKey("assignment.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column(
+            "action",
+            # postgres already has the type, from the action table
+            sa.Enum(AssignmentActions, name="assignmentactions").with_variant(
+                postgresql.ENUM(AssignmentActions, name="assignmentactions", create_type=False), "postgresql"
+            ),
+            primary_key=True,
+        ),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("user.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("action_id", sa.Integer, sa.ForeignKey("action.id", ondelete="CASCADE"), nullable=False),
+    )
+    # Backfill: the latest of everything recorded so far
+    op.execute(
+        "INSERT INTO action_latest (assignment_id, action, user_id, action_id) "
+        "SELECT assignment_id, action, user_id, max(id) FROM action "
+        "WHERE user_id IS NOT NULL AND assignment_id IS NOT NULL "
+        "GROUP BY assignment_id, action, user_id"
+    )
+
+
+def downgrade():
+    op.drop_table("action_latest")
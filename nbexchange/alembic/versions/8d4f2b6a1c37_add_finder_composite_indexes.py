@@ -0,0 +1,27 @@
+"""Add composite indexes for the most-used finders
+
+Revision ID: 8d4f2b6a1c37
+Revises: 3c1d0a5e7b92
+Create Date: 2026-10-18 14:41:09.118402
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8d4f2b6a1c37"
+down_revision = "3c1d0a5e7b92"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_action_assignment_id_action_id", "action", ["assignment_id", "action", "id"])
+    op.create_index("ix_action_assignment_id_location", "action", ["assignment_id", "location"])
+    op.create_index("ix_feedback_2_notebook_id_student_id_id", "feedback_2", ["notebook_id", "student_id", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_feedback_2_notebook_id_student_id_id", table_name="feedback_2")
+    op.drop_index("ix_action_assignment_id_location", table_name="action")
+    op.drop_index("ix_action_assignment_id_action_id", table_name="action")
@@ -1,6 +1,8 @@
 import logging
 import os
+import signal
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from getpass import getuser
 
@@ -11,17 +13,21 @@ from sentry_sdk.integrations.tornado import TornadoIntegration
 from sqlalchemy.exc import OperationalError
 from tornado import web
 from tornado.httpserver import HTTPServer
-from tornado.ioloop import IOLoop
+from tornado.ioloop import IOLoop, PeriodicCallback
 from tornado.log import LogFormatter, access_log, app_log, gen_log
-from tornado_prometheus import MetricsHandler, PrometheusMixIn
-from traitlets import Bool, Dict, Integer, Type, Unicode, default
+from tornado.netutil import bind_sockets
+from tornado.process import fork_processes
+from tornado_prometheus import PrometheusMixIn
+from traitlets import Bool, Dict, Float, Integer, List, Type, Unicode, default
 from traitlets.config import Application, catch_config_error
 
 import nbexchange.dbutil
-from nbexchange import dbutil, handlers
+from nbexchange import database, dbutil, handlers, metrics, replicas
 from nbexchange.handlers import base
 from nbexchange.handlers.auth.naas_user_handler import NaasUserHandler
 from nbexchange.handlers.auth.user_handler import BaseUserHandler
+from nbexchange.recorder import ActionRecorder
+from nbexchange.storage import LocalStorage, StorageBackend
 
 ROOT = os.path.dirname(__file__)
 STATIC_FILES_DIR = os.path.join(ROOT, "static")
@@ -71,12 +77,34 @@ class NbExchange(PrometheusMixIn, Application):
         help="The class to use for handling users",
     ).tag(config=True)
 
+    storage_class = Type(
+        LocalStorage,
+        klass=StorageBackend,
+        help="""The class to use for storing uploaded files.
+
+        `nbexchange.storage.LocalStorage` (the default) stores them under `base_storage_location`;
+        `nbexchange.storage.s3.S3Storage` stores them in an S3-compatible object store.
+        """,
+    ).tag(config=True)
+
     debug = bool(int(os.environ.get("DEBUG", 0)))
 
     ip = Unicode("0.0.0.0").tag(config=True)
 
     port = Integer(9000).tag(config=True)
 
+    num_processes = Integer(
+        1,
+        help="""The number of worker processes to serve requests with (0 for one per CPU).
+
+        The workers are forked once the database is set up, and share the port. Each has its own
+        database connections and `thread_pool_size` threads. Needs a database they can all reach
+        (not an in-memory SQLite database), and `PROMETHEUS_MULTIPROC_DIR` set to an empty directory,
+        for `/metrics` to add up the metrics of every worker (see nbexchange.metrics). Can't be used
+        with `db_replica_urls`: who has just written is only known to the worker that did the writing.
+        """,
+    ).tag(config=True)
+
     sentry_dsn = os.environ.get("SENTRY_DSN", "")
 
     tornado_settings = Dict()
@@ -134,14 +162,86 @@ class NbExchange(PrometheusMixIn, Application):
         stdout_handler = logging.StreamHandler(sys.stdout)
         access_log.addHandler(stdout_handler)
 
-    db_url = os.environ.get("NBEX_DB_URL", "sqlite:///:memory:")  # nbexchange2.sqlite")
+    db_url = Unicode(
+        os.environ.get("NBEX_DB_URL", "sqlite:///:memory:"),
+        help="The SQLAlchemy url of the database (defaults to $NBEX_DB_URL, or an in-memory SQLite database)",
+    ).tag(config=True)
 
     db_kwargs = Dict(
         help="""Include any kwargs to pass to the database connection.
-        See sqlalchemy.create_engine for details.
+        See sqlalchemy.create_engine for details. These take priority over the `db_pool_*` settings.
         """
     ).tag(config=True)
 
+    db_pool_size = Integer(
+        5,
+        help="""The number of database connections kept open.
+
+        Each thread in the pool (`thread_pool_size`) uses one connection at a time, so more than
+        `thread_pool_size` + `db_pool_max_overflow` is never needed.
+        (Not used for in-memory SQLite databases, which only have one connection.)
+        """,
+    ).tag(config=True)
+    db_pool_max_overflow = Integer(
+        10, help="How many connections can be opened, beyond `db_pool_size`, when they are all in use"
+    ).tag(config=True)
+    db_pool_timeout = Float(
+        30, help="How long, in seconds, to wait for a connection when they are all in use, before failing"
+    ).tag(config=True)
+    db_pool_recycle = Integer(
+        None,
+        allow_none=True,
+        help="""Replace connections older than this many seconds (for databases, or firewalls, that drop
+        idle connections). Defaults to 60 seconds for MySQL, and never otherwise.
+        """,
+    ).tag(config=True)
+    db_pool_pre_ping = Bool(
+        True, help="Check connections are still alive as they are taken from the pool (a `SELECT 1`)"
+    ).tag(config=True)
+
+    sqlite_performance_mode = Bool(
+        False,
+        help="""Tune a SQLite database for many concurrent users (see dbutil.SQLITE_PERFORMANCE_PRAGMAS).
+
+        Switches the database to write-ahead logging (WAL), so reads no longer wait for writes, and sets
+        `synchronous=NORMAL`, a 10 second `busy_timeout`, memory-mapped reads and a larger page cache.
+        WAL needs the database on a local disk (not a network filesystem), and, once set, stays set
+        on the database file.
+        """,
+    ).tag(config=True)
+
+    db_async = Bool(
+        False,
+        help="""Use an asyncio database driver, rather than running queries on the thread pool.
+
+        Needs the asyncio driver for the database installed: `aiosqlite` for SQLite,
+        `asyncpg` for Postgres (`pip install nbexchange[async]`).
+        Not available for in-memory SQLite databases.
+        """,
+    ).tag(config=True)
+
+    db_replica_urls = List(
+        Unicode(),
+        help="""Read replicas of the database (eg Postgres streaming replicas), used round-robin for
+        the read-only listings: `/assignments`, `/collections` & `/feedback?manifest=true`.
+
+        Replicas are health-checked every `db_replica_check_interval` seconds; one that fails is
+        left out until it passes again. With none healthy, everything reads from `db_url`.
+        `db_kwargs` are used for the replicas too.
+        """,
+    ).tag(config=True)
+    db_replica_check_interval = Float(10.0, help="How often, in seconds, the read replicas are health-checked").tag(
+        config=True
+    )
+    db_replica_lag = Float(
+        10.0,
+        help="""How long, in seconds, after a user writes to the database their reads stay on the primary.
+
+        Replicas are a little behind the primary: this is long enough for them to catch up, so users
+        always see what they've just done (eg a submission, in the listing straight after).
+        """,
+    ).tag(config=True)
+
     upgrade_db = Bool(
         False,
         help="""Upgrade the database automatically on start.
@@ -157,6 +257,50 @@ class NbExchange(PrometheusMixIn, Application):
         config=True
     )
 
+    thread_pool_size = Integer(
+        8,
+        help="""The number of threads used to run database queries and file storage.
+
+        Handlers hand their blocking work to this pool, so one slow query or disk write
+        does not stall every other request.
+        """,
+    ).tag(config=True)
+
+    user_cache_size = Integer(
+        1024, help="The number of resolved users to keep in the in-memory identity cache (0 disables the cache)"
+    ).tag(config=True)
+    user_cache_ttl = Integer(
+        60,
+        help="""How long, in seconds, a resolved user is kept in the identity cache (0 disables the cache).
+
+        Changes made through this process (and its workers) drop the entries they affect; changes made
+        anywhere else (another exchange on the same database) are only seen once the entry expires.""",
+    ).tag(config=True)
+
+    action_queue_size = Integer(
+        0,
+        help="""Record the actions of downloads (fetched, collected, feedback_fetched) write-behind:
+        queued (up to this many), and written in batches in the background, so downloads don't wait for a
+        database write. 0 (the default) records them as part of the request.
+
+        Queued actions are written when the exchange stops; they are lost if the process dies.
+        If the queue is full, actions are recorded as part of their request.
+
+        Until they are written (up to action_flush_interval later), queued actions are missing from
+        assignment listings, and from polls with `since`: a student who has just fetched an assignment
+        can still see it listed as released.
+        """,
+    ).tag(config=True)
+    action_batch_size = Integer(500, help="The most queued actions written in one transaction").tag(config=True)
+    action_flush_interval = Float(1.0, help="How often, in seconds, queued actions are written").tag(config=True)
+    action_max_retries = Integer(
+        60,
+        help="""How many flushes queued actions are put back for while the database can't be reached (or is
+        locked), before they are dropped. Actions that can never be written (eg their assignment has been
+        deleted) are dropped straight away.
+        """,
+    ).tag(config=True)
+
     def _check_db_path(self, path):
         """More informative log messages for failed filesystem access"""
         path = os.path.abspath(path)
@@ -169,19 +313,37 @@ class NbExchange(PrometheusMixIn, Application):
         if os.path.exists(path) and not os.access(path, os.W_OK):
             self.log.error(f"{user} cannot edit {path}")
 
-    def init_db(self):
-        """Initialize the nbexchange database"""
+    def engine_kwargs(self):
+        """The database engine settings (see dbutil.engine_kwargs): the `db_pool_*` settings, then `db_kwargs`"""
+        kwargs = {
+            "echo": self.debug_db,
+            "pool_size": self.db_pool_size,
+            "max_overflow": self.db_pool_max_overflow,
+            "pool_timeout": self.db_pool_timeout,
+            "pool_recycle": self.db_pool_recycle,
+            "pool_pre_ping": self.db_pool_pre_ping,
+        }
+        kwargs.update(self.db_kwargs)
+        return kwargs
+
+    def init_db(self, worker=False):
+        """Initialize the nbexchange database
+
+        In a forked worker (see num_processes), the database has already been upgraded (and reset):
+        this only sets up the worker's own engines
+        """
         self.log.debug(f"db_url = {self.db_url}")
-        if self.upgrade_db:
+        if self.upgrade_db and not worker:
             dbutil.upgrade_if_needed(self.db_url, log=self.log)
 
         try:
+            # This is the engine the handlers use
             nbexchange.dbutil.setup_db(
                 self.db_url,
-                reset=self.reset_db,
-                echo=self.debug_db,
+                reset=self.reset_db and not worker,
                 log=self.log,
-                **self.db_kwargs,
+                sqlite_performance_mode=self.sqlite_performance_mode,
+                **self.engine_kwargs(),
             )
         except OperationalError as e:
             self.log.error(f"Failed to connect to db: {self.db_url}")
@@ -201,6 +363,28 @@ class NbExchange(PrometheusMixIn, Application):
         except nbexchange.dbutil.DatabaseSchemaMismatch as e:
             self.exit(e)
 
+        if self.db_async:
+            try:
+                engine = database.init_async_engine(
+                    self.db_url, **dbutil.engine_kwargs(self.db_url, asyncio=True, **self.engine_kwargs())
+                )
+            except (ImportError, ValueError) as e:
+                self.log.critical(f"Cannot use an asyncio database engine for {self.db_url}: {e}")
+                self.exit(1)
+            if self.db_url.startswith("sqlite"):
+                dbutil.register_foreign_keys(engine.sync_engine)
+                if self.sqlite_performance_mode:
+                    dbutil.register_sqlite_performance_mode(engine.sync_engine)
+
+    def init_caches(self):
+        """(Re)configure the in-process caches"""
+        base.user_cache.configure(maxsize=self.user_cache_size, ttl=self.user_cache_ttl)
+        # Only needed with replicas: an entry for every user who has written in the last db_replica_lag seconds
+        if self.db_replica_urls:
+            replicas.recent_writers.configure(maxsize=100000, ttl=self.db_replica_lag)
+        else:
+            replicas.recent_writers.configure(maxsize=0, ttl=0)
+
     def init_tornado_settings(self):
         """Initialize tornado config"""
 
@@ -220,16 +404,43 @@ class NbExchange(PrometheusMixIn, Application):
             base_storage_location=self.base_storage_location,
             # naas_url=self.naas_url,
             max_buffer_size=self.max_buffer_size,
+            db_async=self.db_async,
             user_plugin=self.user_plugin_class(),
             version_hash=version_hash,
             xsrf_cookies=False,
             debug=self.debug,
+            **self.process_settings(),
         )
         # allow configured settings to have priority
         settings.update(self.tornado_settings)
         self.log.info(settings)
         self.tornado_settings = settings
 
+    def process_settings(self):
+        """The settings that can't be shared across a fork (see num_processes): the thread pool, and
+        what uses it, the storage's clients, and the read replicas' connections"""
+        executor = ThreadPoolExecutor(max_workers=self.thread_pool_size, thread_name_prefix="nbexchange")
+        action_recorder = None
+        if self.action_queue_size:
+            action_recorder = ActionRecorder(
+                maxsize=self.action_queue_size,
+                batch_size=self.action_batch_size,
+                max_retries=self.action_max_retries,
+                executor=executor,
+                log=self.log,
+            )
+
+        db_replicas = None
+        if self.db_replica_urls:
+            db_replicas = replicas.ReplicaSet(self.db_replica_urls, **self.engine_kwargs())
+
+        return dict(
+            storage=self.storage_class(parent=self, log=self.log),
+            db_replicas=db_replicas,
+            executor=executor,
+            action_recorder=action_recorder,
+        )
+
     def init_handlers(self):
         """Load nbexchange's tornado request handlers"""
         self.handlers = []
@@ -238,7 +449,7 @@ class NbExchange(PrometheusMixIn, Application):
             for url in handler.urls:
                 self.handlers.append((ujoin(self.base_url, url), handler))
 
-        self.handlers.append((r"/metrics", MetricsHandler))
+        self.handlers.append((r"/metrics", metrics.MetricsHandler))
 
         self.handlers.append((r".*", base.Template404))
         self.log.debug("##### ALL HANDLERS" + str(self.handlers))
@@ -260,24 +471,109 @@ class NbExchange(PrometheusMixIn, Application):
         if self.subapp:
             return
         self.init_db()
+        self.init_caches()
         self.init_tornado_settings()
         self.init_handlers()
         self.init_tornado_application()
 
+    _action_flusher = None
+    _replica_checker = None
+
+    def flush_actions(self):
+        """Write any queued actions (see action_queue_size)"""
+        if self._action_flusher is not None:
+            self._action_flusher.stop()
+            self._action_flusher = None
+        action_recorder = self.tornado_settings.get("action_recorder")
+        if action_recorder is not None:
+            written = action_recorder.flush()
+            self.log.info(f"Wrote {written} queued actions")
+
+    async def check_replicas(self):
+        """Health-check the read replicas, on the executor"""
+        db_replicas = self.tornado_settings.get("db_replicas")
+        if db_replicas is not None:
+            await IOLoop.current().run_in_executor(self.tornado_settings["executor"], db_replicas.check)
+
     def stop(self):
         self.http_server.stop()
+        self.flush_actions()
+        if self._replica_checker is not None:
+            self._replica_checker.stop()
+            self._replica_checker = None
+        self.tornado_settings["executor"].shutdown(wait=False)
+        if self.tornado_settings.get("db_replicas") is not None:
+            self.tornado_settings["db_replicas"].dispose()
+
+    def fork_workers(self):
+        """Bind the port, and fork `num_processes` workers to serve it. Returns the listening sockets, in each
+        worker: the parent process stays in `fork_processes`, restarting any worker that dies, until they
+        have all stopped
+        """
+        if self.db_url.endswith(":memory:"):
+            self.log.critical("An in-memory database can't be shared by worker processes: set db_url")
+            self.exit(1)
+        if not metrics.multiprocess_dir():
+            self.log.critical(
+                "Set PROMETHEUS_MULTIPROC_DIR to an empty directory, for /metrics to cover every worker process"
+            )
+            self.exit(1)
+        if self.db_replica_urls:
+            # Who has just written (so reads from the primary) is only known to the worker that did the writing,
+            # and the exchange's clients don't keep cookies to carry it to the others
+            self.log.critical("Read replicas can't be used with worker processes: they'd serve users stale reads")
+            self.exit(1)
+
+        sockets = bind_sockets(self.port, address=self.ip)
+        metrics.clear_multiprocess_dir()
+        # A change to a user's subscriptions, seen by one worker, empties every worker's cache of users
+        base.user_cache.share()
+        # Nothing holding connections or threads can cross the fork: each worker makes its own
+        database.engine.dispose()
+        if self.tornado_settings.get("db_replicas") is not None:
+            self.tornado_settings["db_replicas"].dispose()
+        self.tornado_settings["executor"].shutdown()
+
+        task_id = fork_processes(self.num_processes)
+        self.log.info(f"Worker {task_id} started (pid {os.getpid()})")
+        self.init_db(worker=True)
+        self.tornado_settings.update(self.process_settings())
+        self.init_tornado_application()
+        return sockets
 
     def start(self, run_loop=True):
         if self.subapp:
             self.subapp.start()
             return
 
+        sockets = self.fork_workers() if self.num_processes != 1 else None
+
         # *NOT* adding 'max_buffer_size=self.max_buffer_size' here, as we handle the
         # size-checks in code (both plugin & exchange side)
         self.http_server = HTTPServer(self.tornado_application, xheaders=True)
-        self.http_server.listen(self.port, address=self.ip)
+        if sockets:
+            self.http_server.add_sockets(sockets)
+        else:
+            self.http_server.listen(self.port, address=self.ip)
+
+        action_recorder = self.tornado_settings.get("action_recorder")
+        if action_recorder is not None:
+            self._action_flusher = PeriodicCallback(action_recorder.flush_async, self.action_flush_interval * 1000)
+            self._action_flusher.start()
+
+        if self.tornado_settings.get("db_replicas") is not None:
+            self._replica_checker = PeriodicCallback(self.check_replicas, self.db_replica_check_interval * 1000)
+            self._replica_checker.start()
+
         if run_loop:
-            IOLoop.current().start()
+            loop = IOLoop.current()
+            # stop cleanly (writing any queued actions) when asked to
+            loop.asyncio_loop.add_signal_handler(signal.SIGTERM, loop.stop)
+            try:
+                loop.start()
+            finally:
+                self.flush_actions()
+                metrics.mark_process_dead()
 
 
 if __name__ == "__main__":
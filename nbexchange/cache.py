@@ -0,0 +1,157 @@
+"""Small in-process caches used by the exchange.
+
+These are deliberately simple: a bounded, thread-safe LRU with an optional
+time-to-live. They live for the lifetime of the process, so anything cached
+here must be safe to serve slightly stale (bounded by the ttl), or must be
+invalidated explicitly when the underlying data changes.
+
+With worker processes (see NbExchange.num_processes), a cache that is `share`d
+before the fork passes its invalidations on to the other workers. Invalidations go
+no further than that: other processes using the same data rely on the ttl.
+"""
+
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A bounded least-recently-used cache, with a per-entry time-to-live
+
+    cache = LRUCache(maxsize=1024, ttl=60)
+    cache.set(key, value)
+    value = cache.get(key)  # None if missing or expired
+
+    A `maxsize` or `ttl` of 0 disables the cache: nothing is stored.
+
+    A value read from elsewhere while something invalidates it would be stale, so
+    take the `generation` before reading it, and pass it to `set`:
+
+    generation = cache.generation
+    value = read_it()
+    cache.set(key, value, generation=generation)  # not stored if invalidated since
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Counts invalidations, in this process or (once synced) in the others
+        self._invalidations = 0
+        # (see `share`)
+        self._shared_generation = None
+        self._generation = 0
+
+    @property
+    def enabled(self):
+        return bool(self.maxsize and self.ttl)
+
+    @property
+    def generation(self):
+        """Changes with every invalidation (see `set`)"""
+        with self._lock:
+            self._sync()
+            return self._invalidations
+
+    @property
+    def shared(self):
+        return self._shared_generation is not None
+
+    def share(self):
+        """Share invalidations (`pop`, `discard_where`, `clear`) with the processes forked after this
+
+        Each process keeps its own entries. They can't see which of them another process's invalidation
+        affects, so it empties the cache in every other process (the next time it is used there).
+        """
+        self._shared_generation = multiprocessing.Value("Q", 0)
+        self._generation = 0
+
+    def _sync(self):
+        """Empty the cache if another process has invalidated it. With the lock held"""
+        if self.shared and self._shared_generation.value != self._generation:
+            self._data.clear()
+            self._generation = self._shared_generation.value
+            self._invalidations += 1
+
+    def _invalidated(self):
+        """Tell the other processes about an invalidation. With the lock held"""
+        self._invalidations += 1
+        if not self.shared:
+            return
+        with self._shared_generation.get_lock():
+            # (one we haven't seen yet, from another process, may cover entries this didn't remove)
+            if self._shared_generation.value != self._generation:
+                self._data.clear()
+            self._shared_generation.value += 1
+            self._generation = self._shared_generation.value
+
+    def configure(self, maxsize, ttl):
+        """Change the size/ttl of the cache. This empties the cache."""
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._data.clear()
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._sync()
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, generation=None):
+        """Store a value.
+
+        'ttl' overrides the cache-wide time-to-live for this entry, but can
+        only shorten it.
+
+        With 'generation' (see `generation`), the value isn't stored if the cache
+        has been invalidated since.
+        """
+        if not self.enabled:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._sync()
+            if generation is not None and generation != self._invalidations:
+                return
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            self._invalidated()
+        return default if entry is None else entry[1]
+
+    def discard_where(self, predicate):
+        """Remove every entry whose value matches `predicate(value)`"""
+        with self._lock:
+            for key in [key for key, (_, value) in self._data.items() if predicate(value)]:
+                del self._data[key]
+            self._invalidated()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._invalidated()
+
+    def __len__(self):
+        return len(self._data)
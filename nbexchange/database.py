@@ -5,21 +5,59 @@ Notes:
      best practice to ensure the session gets closed
      and reduces noise in code by not having to manually
      commit or rollback the db if a exception occurs.
+
+     The optional asyncio engine (see `init_async_engine`) has
+     the matching `async_scoped_session` contextmanager.
 """
 
-import os
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.orm import sessionmaker
 
-from nbexchange.models import Base
+from nbexchange import metrics
+
+# The engine, and the sessions on it, are set up by `init_engine` (via dbutil.setup_db, from
+# NbExchange.init_db): nothing can use the database until then
+engine = None
+Session = sessionmaker()
+
+
+def init_engine(url, **kwargs):
+    """Create the engine for the database at `url`, and bind `Session` (so `scoped_session`) to it
+
+    `kwargs` are passed to `create_engine`. The previous engine, if any, is disposed of - except that
+    an in-memory SQLite database only exists inside its engine: asking for the same in-memory database
+    again keeps the existing engine, and one that is replaced is left as it is (disposing of it would
+    destroy the database).
+    """
+    global engine
+
+    if engine is not None:
+        if str(engine.url).endswith(":memory:"):
+            if str(engine.url) == url:
+                return engine
+        else:
+            engine.dispose()
+    engine = create_engine(url, **kwargs)
+    _publish_pool_metrics(engine)
+    Session.configure(bind=engine)
+    return engine
+
 
-engine = create_engine(os.environ.get("NBEX_DB_URL", "sqlite:///:memory:"))
-Base.metadata.create_all(engine)
+def _publish_pool_metrics(engine):
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        metrics.DB_POOL_CONNECTIONS.inc()
 
-# Session to be used throughout app.
-Session = sessionmaker(bind=engine)
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.DB_POOL_CHECKOUTS.inc()
+        metrics.DB_POOL_CHECKED_OUT.inc()
+
+    @event.listens_for(engine, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        metrics.DB_POOL_CHECKED_OUT.dec()
 
 
 @contextmanager
@@ -28,8 +66,66 @@ def scoped_session():
     try:
         yield session
         session.commit()
-    except Exception:
+    except Exception as e:
+        if isinstance(e, exc.TimeoutError):
+            # every connection in the pool was in use for NbExchange.db_pool_timeout seconds
+            metrics.DB_POOL_TIMEOUTS.inc()
         session.rollback()
         raise
     finally:
         session.close()
+
+
+# The asyncio engine, and its sessions, only exist if NbExchange.db_async is set
+async_engine = None
+AsyncSession = None
+
+# The asyncio drivers used for each database
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def async_db_url(url):
+    """Convert a (sync) database url into the equivalent asyncio url
+
+    async_db_url("sqlite:///nbexchange.sqlite") == "sqlite+aiosqlite:///nbexchange.sqlite"
+    """
+    scheme, rest = url.split("://", 1)
+    dialect = scheme.split("+", 1)[0]
+    if dialect not in ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver known for {dialect} databases")
+    return f"{ASYNC_DRIVERS[dialect]}://{rest}"
+
+
+def init_async_engine(url, **kwargs):
+    """Create the asyncio engine for the database at `url` (a normal, sync, url)
+
+    Needs the optional driver for the database installed (aiosqlite, asyncpg, or aiomysql)
+    """
+    from sqlalchemy.ext.asyncio import AsyncSession as _AsyncSession
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    global async_engine, AsyncSession
+
+    if url.endswith(":memory:"):
+        raise ValueError("The asyncio engine cannot share an in-memory database")
+    async_engine = create_async_engine(async_db_url(url), **kwargs)
+    AsyncSession = sessionmaker(bind=async_engine, class_=_AsyncSession, expire_on_commit=False)
+    return async_engine
+
+
+@asynccontextmanager
+async def async_scoped_session():
+    session = AsyncSession()
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
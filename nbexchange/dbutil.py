@@ -14,9 +14,10 @@ import alembic.config
 from alembic.script import ScriptDirectory
 from sqlalchemy import create_engine, event, exc, inspect, select
 from sqlalchemy.orm import Session, interfaces, object_session
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
 
-from nbexchange.models import Base
+from nbexchange import database
+from nbexchange.models import Action, ActionLatest, Base, Feedback
 
 _here = os.path.abspath(os.path.dirname(__file__))
 
@@ -142,12 +143,98 @@ def _alembic(args):
         check_call(["alembic", "-c", alembic_ini] + args)
 
 
+def backfill_action_latest(db_url, log=None):
+    """(Re)build the action_latest summary table from the action table
+
+    The summary is kept up to date as actions are recorded, so this is only needed to repair it
+    (eg after actions have been restored, or edited by hand). Returns the number of summary rows.
+
+    Raises DatabaseSchemaMismatch if the database hasn't been upgraded to have the summary table.
+    """
+    engine = create_engine(db_url)
+    try:
+        if ActionLatest.__tablename__ not in inspect(engine).get_table_names():
+            raise DatabaseSchemaMismatch(
+                f"No {ActionLatest.__tablename__} table in {engine.url!r}. "
+                "Backup your database and run `nbexchange --upgrade-db` first."
+            )
+        with Session(bind=engine) as session, session.begin():
+            return ActionLatest.rebuild(session, log=log)
+    finally:
+        engine.dispose()
+
+
+def _backfill_latest(args):
+    """Rebuild the action_latest summary, in the configured database"""
+    from nbexchange.app import NbExchange
+
+    hub = NbExchange()
+    hub.load_config_file(hub.config_file)
+    try:
+        rows = backfill_action_latest(hub.db_url)
+    except DatabaseSchemaMismatch as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"action_latest rebuilt: {rows} rows")
+
+
+def sweep_blobs(db_url, storage, older_than=24 * 60 * 60, dry_run=False, log=None):
+    """Remove the stored files nothing in the database refers to
+
+    Files are stored by their contents, and shared, so one isn't removed when an upload of it fails
+    to be recorded (it's rejected, or the client goes away): this removes them afterwards. Files stored
+    in the last `older_than` seconds are left alone, as their uploads may still be being recorded.
+    Returns the locations removed (or, with `dry_run`, that would be).
+    """
+    engine = create_engine(db_url)
+    try:
+        with Session(bind=engine) as session:
+            referenced = {location for (location,) in session.query(Action.location).distinct()}
+            referenced.update(location for (location,) in session.query(Feedback.location).distinct())
+    finally:
+        engine.dispose()
+
+    cutoff = datetime.now().timestamp() - older_than
+    removed = []
+    for location, stored in storage.locations():
+        if location in referenced or stored.modified > cutoff:
+            continue
+        if log:
+            log.info(f"Removing unused stored file {location}")
+        if not dry_run:
+            storage.delete(location)
+        removed.append(location)
+    return removed
+
+
+def _sweep_blobs(args):
+    """Remove the unused stored files, from the configured storage"""
+    import argparse
+
+    from nbexchange.app import NbExchange
+
+    parser = argparse.ArgumentParser(prog="python -m nbexchange.dbutil sweep-blobs", description=sweep_blobs.__doc__)
+    parser.add_argument(
+        "--older-than", type=float, default=24, help="only remove files stored over this many hours ago (default 24)"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="list the files, but don't remove them")
+    options = parser.parse_args(args)
+
+    hub = NbExchange()
+    hub.load_config_file(hub.config_file)
+    storage = hub.storage_class(parent=hub, log=hub.log)
+    removed = sweep_blobs(hub.db_url, storage, older_than=options.older_than * 60 * 60, dry_run=options.dry_run)
+    for location in removed:
+        print(location)
+    print(f"{'Would remove' if options.dry_run else 'Removed'} {len(removed)} unused stored files")
+
+
 def main(args=None):
     if args is None:
         args = sys.argv[1:]
     # dumb option parsing, since we want to pass things through
     # to subcommands
-    choices = ["alembic"]
+    choices = ["alembic", "backfill-latest", "sweep-blobs"]
     if not args or args[0] not in choices:
         print("Select a command from: %s" % ", ".join(choices))
         return 1
@@ -155,6 +242,10 @@ def main(args=None):
 
     if cmd == "alembic":
         _alembic(args)
+    elif cmd == "backfill-latest":
+        return _backfill_latest(args)
+    elif cmd == "sweep-blobs":
+        _sweep_blobs(args)
 
 
 if __name__ == "__main__":
@@ -199,6 +290,32 @@ def register_foreign_keys(engine):
         cursor.close()
 
 
+# The PRAGMAs set on every connection by NbExchange.sqlite_performance_mode
+SQLITE_PERFORMANCE_PRAGMAS = {
+    # Write-ahead log: readers don't wait for the writer, nor the writer for readers
+    "journal_mode": "WAL",
+    # In WAL mode, only sync at checkpoints: a power cut can lose the last commits, but can't corrupt the database
+    "synchronous": "NORMAL",
+    # Wait up to 10s for the write lock, rather than failing with "database is locked"
+    "busy_timeout": 10000,
+    # Read the database through up to 256MB of memory-mapped I/O
+    "mmap_size": 268435456,
+    # 64MB page cache per connection (negative: in KiB)
+    "cache_size": -65536,
+}
+
+
+def register_sqlite_performance_mode(engine):
+    """register SQLITE_PERFORMANCE_PRAGMAS on connection"""
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_con, con_record):
+        cursor = dbapi_con.cursor()
+        for pragma, value in SQLITE_PERFORMANCE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+        cursor.close()
+
+
 @event.listens_for(Session, "persistent_to_deleted")
 def _notify_deleted_relationships(session, obj):
     """Expire relationships when an object becomes deleted
@@ -335,26 +452,52 @@ def add_row_format(base):
         t.dialect_kwargs["mysql_ROW_FORMAT"] = "DYNAMIC"
 
 
-def setup_db(url="sqlite:///:memory:", reset=False, log=None, **kwargs):
-    """Check database revision and create all models"""
+def engine_kwargs(
+    url, pool_size=5, max_overflow=10, pool_timeout=30, pool_recycle=None, pool_pre_ping=True, asyncio=False, **kwargs
+):
+    """The `create_engine` (with `asyncio`, `create_async_engine`) arguments for the database at `url`:
+    the pool settings, then `kwargs`
 
-    log.info(f"dbutil.setup_db: db_url:{url}, reset:{reset}")
+    An in-memory SQLite database has just the one connection, so no pool to tune. Other SQLite
+    databases get a (tunable) QueuePool, like every other database.
+    """
+    kwargs = dict(kwargs)
     if url.startswith("sqlite"):
+        # Sessions are used from the handlers' thread pool
         kwargs.setdefault("connect_args", {"check_same_thread": False})
-
-    elif url.startswith("mysql"):
-        kwargs.setdefault("pool_recycle", 60)
-
     if url.endswith(":memory:"):
-        # If we're using an in-memory database, ensure that only one connection
-        # is ever created.
+        # ... and every thread must see the same in-memory database
         kwargs.setdefault("poolclass", StaticPool)
+        return kwargs
+    if url.startswith("sqlite"):
+        kwargs.setdefault("poolclass", AsyncAdaptedQueuePool if asyncio else QueuePool)
+    if pool_recycle is None and url.startswith("mysql"):
+        # MySQL drops idle connections
+        pool_recycle = 60
+    pool = {"pool_recycle": -1 if pool_recycle is None else pool_recycle, "pool_pre_ping": pool_pre_ping}
+    if issubclass(kwargs.get("poolclass", QueuePool), QueuePool):
+        # (a NullPool, say, has no size to set)
+        pool.update(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout)
+    return dict(pool, **kwargs)
 
-    # From sqlalchemy 2.0, testing pools is now built in
-    engine = create_engine(url, pool_pre_ping=True, **kwargs)
 
-    if url.startswith("sqlite"):
+def setup_db(url="sqlite:///:memory:", reset=False, log=None, sqlite_performance_mode=False, **kwargs):
+    """Create the engine (see `database.init_engine`), check the database revision, and create all models
+
+    `kwargs` are passed to `engine_kwargs`. Returns the engine
+    """
+
+    log.info(f"dbutil.setup_db: db_url:{url}, reset:{reset}")
+    previous = database.engine
+    engine = database.init_engine(url, **engine_kwargs(url, **kwargs))
+
+    if url.startswith("sqlite") and engine is not previous:
         register_foreign_keys(engine)
+        if sqlite_performance_mode:
+            if url.endswith(":memory:"):
+                log.warning("sqlite_performance_mode has no effect on an in-memory database")
+            else:
+                register_sqlite_performance_mode(engine)
 
     # not needed: https://docs.sqlalchemy.org/en/20/core/pooling.html#disconnect-handling-pessimistic
     # # enable pessimistic disconnect handling
@@ -366,6 +509,9 @@ def setup_db(url="sqlite:///:memory:", reset=False, log=None, **kwargs):
     if mysql_large_prefix_check(engine):  # if mysql is allows large indexes
         add_row_format(Base)  # set format on the tables
     # check the db revision (will raise, pointing to `upgrade-db` if version doesn't match)
-    check_db_revision(engine, log)
+    # An in-memory database is created at the current revision, and alembic can't see into it
+    if not url.endswith(":memory:"):
+        check_db_revision(engine, log)
 
     Base.metadata.create_all(engine)
+    return engine
@@ -1,6 +1,11 @@
 from nbexchange.handlers.assignment import Assignment, Assignments
-from nbexchange.handlers.collection import Collection, Collections
-from nbexchange.handlers.feedback import FeedbackHandler
+from nbexchange.handlers.collection import Collection, CollectionArchive, Collections
+from nbexchange.handlers.feedback import (
+    FeedbackArchive,
+    FeedbackBatch,
+    FeedbackDownload,
+    FeedbackHandler,
+)
 from nbexchange.handlers.pages import HomeHandler
 from nbexchange.handlers.submission import Submission, Submissions
 
@@ -8,9 +13,13 @@ default_handlers = [
     Assignment,
     Assignments,
     Collection,
+    CollectionArchive,
     Collections,
     Submission,
     Submissions,
     HomeHandler,
     FeedbackHandler,
+    FeedbackDownload,
+    FeedbackArchive,
+    FeedbackBatch,
 ]
@@ -1,11 +1,12 @@
-import os
 import time
-import uuid
 
 from tornado import httputil, web
 
-from nbexchange.database import scoped_session
-from nbexchange.handlers.base import BaseHandler, authenticated
+from nbexchange.handlers.base import (
+    BaseHandler,
+    UploadHandler,
+    authenticated,
+)
 from nbexchange.models.actions import Action, AssignmentActions
 from nbexchange.models.assignments import Assignment as AssignmentModel
 from nbexchange.models.courses import Course
@@ -24,16 +25,27 @@ class Assignments(BaseHandler):
     """.../assignments/
     parmas:
         course_id: course_code
+        status: (optional) only these actions - repeated, or comma-separated (eg released,submitted)
+        assignment_id: (optional) only this assignment_code
+        latest_only: (optional) only the most recent of each action, for each assignment
+        limit: (optional) at most this many actions...
+        after_id: (optional) ...with an action_id greater than this
+        since: (optional) only actions newer than this action_id (a previous `high_water_mark`)
 
     GET: gets list of assignments for $course_code
+
+    Given `limit`, `after_id` or `since`, the actions are ordered by `action_id`, and the response includes
+    `next_after_id`: the `after_id` for the next page (or None if this is the last page).
+
+    The response always includes `high_water_mark`: the newest action_id listed (or `since`, if nothing
+    is newer), so a client can poll with `since` and only get what has changed. Polling with `since` also
+    lists the `feedback_released` actions of the user's feedback, so the poller learns that it has arrived.
     """
 
     urls = ["assignments"]
 
     @authenticated
-    def get(self):
-        models = []
-
+    async def get(self):
         [course_code] = self.get_params(["course_id"])
 
         if not course_code:
@@ -43,7 +55,7 @@ class Assignments(BaseHandler):
             return
 
         # Who is my user?
-        this_user = self.nbex_user
+        this_user = await self.get_nbex_user()
 
         self.log.debug(f"User: {this_user.get('name')}")
         # For what course do we want to see the assignments?
@@ -55,71 +67,121 @@ class Assignments(BaseHandler):
             self.finish({"success": False, "note": note, "value": []})
             return
 
+        try:
+            filters, limit = self.listing_filters()
+        except ValueError as e:
+            note = str(e)
+            self.log.info(note)
+            self.finish({"success": False, "note": note, "value": []})
+            return
+
+        self.finish(await self.run_db_read(self._list_assignments, course_code, this_user, filters, limit))
+
+    def listing_filters(self):
+        """The `Action.find_for_course` filters, and the page size, asked for in the query parameters
+
+        Raises ValueError (with a note for the user) if a parameter is not valid
+        """
+        statuses = [status for value in self.get_arguments("status") for status in value.split(",") if status]
+        try:
+            actions = [AssignmentActions(status) for status in statuses]
+        except ValueError:
+            raise ValueError(f"Unknown status in {statuses}")
+        [assignment_code] = self.get_params(["assignment_id"])
+        after_id = self.get_int_param("after_id")
+        since = self.get_int_param("since")
+        if after_id is not None and since is not None:
+            raise ValueError("Only one of after_id and since can be given")
+        filters = {
+            "actions": actions or None,
+            "assignment_code": assignment_code,
+            "latest_only": self.get_flag("latest_only"),
+            # both are "actions after this id"
+            "after_id": since if after_id is None else after_id,
+            # feedback being released is a change a poller needs to see
+            "feedback": since is not None,
+        }
+        return filters, self.get_int_param("limit", minimum=1)
+
+    def _list_assignments(self, session, course_code, this_user, filters, limit=None):
+        models = []
+
         # Find the course being referred to
-        with scoped_session() as session:
-            course = Course.find_by_code(db=session, code=course_code, org_id=this_user["org_id"], log=self.log)
-            if not course:
-                note = f"Course {course_code} does not exist"
-                self.log.info(note)
-                self.finish({"success": False, "note": note, "value": []})
-                return
-
-            assignments = AssignmentModel.find_for_course(db=session, course_id=course.id, log=self.log)
-
-            for assignment in assignments:
-                self.log.debug("==========")
-                self.log.debug(f"Assignment: {assignment}")
-                for action in assignment.actions:
-                    # For every action that is not "released" checked if the user id matches
-                    if action.action != AssignmentActions.released and this_user.get("id") != action.user_id:
-                        self.log.debug(f"ormuser: {this_user.get('id')} - actionUser {action.user_id}")
-                        self.log.debug("Action does not belong to user, skip action")
-                        continue
-                    notebooks = []
-
-                    for notebook in assignment.notebooks:
-                        feedback_available = False
-                        feedback_timestamp = None
-                        if action.action == AssignmentActions.submitted:
-                            feedback = Feedback.find_notebook_for_student(
-                                db=session,
-                                notebook_id=notebook.id,
-                                student_id=this_user.get("id"),
-                                log=self.log,
-                            )
-                            if feedback:
-                                feedback_available = bool(feedback)
-                                feedback_timestamp = feedback.timestamp.strftime("%Y-%m-%d %H:%M:%S.%f %Z")
-
-                        notebooks.append(
-                            {
-                                "notebook_id": notebook.name,
-                                "has_exchange_feedback": feedback_available,
-                                "feedback_updated": False,  # TODO: needs a real value
-                                "feedback_timestamp": feedback_timestamp,
-                            }
-                        )
-                    models.append(
-                        {
-                            "assignment_id": assignment.assignment_code,
-                            "student_id": action.user_id,
-                            "course_id": assignment.course.course_code,
-                            "status": action.action.value,  # currently called 'action' in our db
-                            "path": action.location,
-                            "notebooks": notebooks,
-                            "timestamp": action.timestamp.strftime("%Y-%m-%d %H:%M:%S.%f %Z"),
-                        }
-                    )
+        course = Course.find_by_code(db=session, code=course_code, org_id=this_user["org_id"], log=self.log)
+        if not course:
+            note = f"Course {course_code} does not exist"
+            self.log.info(note)
+            return {"success": False, "note": note, "value": []}
+
+        # Every release, plus the user's own actions - with their assignments & notebooks
+        query = Action.find_for_course(
+            db=session, course_id=course.id, user_id=this_user.get("id"), log=self.log, **filters
+        )
+        paged = limit is not None or filters["after_id"] is not None
+        if paged:
+            query = query.order_by(None).order_by(Action.id)
+        if limit is not None:
+            # one extra, to know if there's another page
+            actions = query.limit(limit + 1).all()
+            more, actions = len(actions) > limit, actions[:limit]
+        else:
+            actions = query.all()
+
+        # The latest feedback for each notebook, if the user has submitted anything
+        feedbacks = {}
+        if any(action.action == AssignmentActions.submitted for action in actions):
+            notebook_ids = {notebook.id for action in actions for notebook in action.assignment.notebooks}
+            feedbacks = Feedback.find_latest_for_student(
+                db=session, student_id=this_user.get("id"), notebook_ids=notebook_ids, log=self.log
+            )
+
+        for action in actions:
+            assignment = action.assignment
+            notebooks = []
+
+            for notebook in assignment.notebooks:
+                feedback_available = False
+                feedback_timestamp = None
+                if action.action == AssignmentActions.submitted:
+                    feedback = feedbacks.get(notebook.id)
+                    if feedback:
+                        feedback_available = bool(feedback)
+                        feedback_timestamp = feedback.timestamp.strftime("%Y-%m-%d %H:%M:%S.%f %Z")
+
+                notebooks.append(
+                    {
+                        "notebook_id": notebook.name,
+                        "has_exchange_feedback": feedback_available,
+                        "feedback_updated": False,  # TODO: needs a real value
+                        "feedback_timestamp": feedback_timestamp,
+                    }
+                )
+            models.append(
+                {
+                    "assignment_id": assignment.assignment_code,
+                    "student_id": action.user_id,
+                    "course_id": course.course_code,
+                    "status": action.action.value,  # currently called 'action' in our db
+                    "path": action.location,
+                    "notebooks": notebooks,
+                    "timestamp": action.timestamp.strftime("%Y-%m-%d %H:%M:%S.%f %Z"),
+                    "action_id": action.id,
+                }
+            )
 
         self.log.debug(f"Assignments: {models}")
-        self.finish({"success": True, "value": models})
+        result = {"success": True, "value": models}
+        result["high_water_mark"] = max((action.id for action in actions), default=filters["after_id"])
+        if paged:
+            result["next_after_id"] = actions[-1].id if limit is not None and more else None
+        return result
 
     # This has no authentiction wrapper, so false implication os service
     def post(self):
         raise web.HTTPError(501)
 
 
-class Assignment(BaseHandler):
+class Assignment(UploadHandler):
     """.../assignment/
     parmas:
         course_id: course_code
@@ -132,8 +194,10 @@ class Assignment(BaseHandler):
     # urls = ["assignment/([^/]+)(?:/?([^/]+))?"]
     urls = ["assignment"]
 
+    oversize_note = "File upload oversize, and rejected. Please reduce the contents of the assignment, re-generate, and re-release"  # noqa: E501
+
     @authenticated
-    def get(self):  # def get(self, course_code, assignment_code=None):
+    async def get(self):  # def get(self, course_code, assignment_code=None):
         [course_code, assignment_code] = self.get_params(["course_id", "assignment_id"])
 
         if not (course_code and assignment_code):
@@ -142,7 +206,7 @@ class Assignment(BaseHandler):
             self.finish({"success": False, "note": note})
             return
 
-        this_user = self.nbex_user
+        this_user = await self.get_nbex_user()
 
         if course_code not in this_user["courses"]:
             note = f"User not subscribed to course {course_code}"
@@ -150,91 +214,86 @@ class Assignment(BaseHandler):
             self.finish({"success": False, "note": note})
             return
 
-        # Find the course being referred to
-        with scoped_session() as session:
-            course = Course.find_by_code(db=session, code=course_code, org_id=this_user["org_id"], log=self.log)
-            if course is None:
-                note = f"Course {course_code} does not exist"
-                self.log.info(note)
-                self.finish({"success": False, "note": note})
-                return  # needs a proper 'fail' here
-
-            note = ""
-            self.log.debug(f"Course:{course_code} assignment:{assignment_code}")
-
-            # The location for the data-object is actually held in the 'released' action for the given assignment
-            # We want the last one...
-            assignment = AssignmentModel.find_by_code(
-                db=session,
-                code=assignment_code,
-                course_id=course.id,
-                action=AssignmentActions.released.value,
-            )
+        result = await self.run_db(self._fetch_release, course_code, assignment_code, this_user)
+        if isinstance(result, dict):
+            self.finish(result)
+            return
+        release_file, checksum, released, fetched = result
 
-            if assignment is None:
-                note = f"Assignment {assignment_code} does not exist"
-                self.log.info(note)
-                self.finish({"success": False, "note": note})
-                return  # needs a proper 'fail' here
+        self._headers = httputil.HTTPHeaders(
+            {
+                "Content-Type": "application/gzip",
+                "Date": httputil.format_timestamp(time.time()),
+            }
+        )
+        await self.stream_file(release_file, checksum, released, actions=fetched)
 
-            self._headers = httputil.HTTPHeaders(
-                {
-                    "Content-Type": "application/gzip",
-                    "Date": httputil.format_timestamp(time.time()),
-                }
-            )
+    def _fetch_release(self, session, course_code, assignment_code, this_user):
+        """Read the most recent release
 
-            data = b""
+        Returns the location of the release file, its checksum, when it was released & the fetch to record (see
+        `stream_file`), or a dict [note] if there's a problem
+        """
+        # Find the course being referred to
+        course = Course.find_by_code(db=session, code=course_code, org_id=this_user["org_id"], log=self.log)
+        if course is None:
+            note = f"Course {course_code} does not exist"
+            self.log.info(note)
+            return {"success": False, "note": note}  # needs a proper 'fail' here
+
+        note = ""
+        self.log.debug(f"Course:{course_code} assignment:{assignment_code}")
+
+        # The location for the data-object is actually held in the 'released' action for the given assignment
+        # We want the last one...
+        assignment = AssignmentModel.find_by_code(
+            db=session,
+            code=assignment_code,
+            course_id=course.id,
+            action=AssignmentActions.released.value,
+        )
 
-            release_file = None
+        if assignment is None:
+            note = f"Assignment {assignment_code} does not exist"
+            self.log.info(note)
+            return {"success": False, "note": note}  # needs a proper 'fail' here
 
-            action = Action.find_most_recent_action(
-                db=session,
-                assignment_id=assignment.id,
-                action=AssignmentActions.released,
-                log=self.log,
-            )
-            release_file = action.location
+        release_file = None
 
-            if release_file:
-                try:
-                    with open(release_file, "r+b") as handle:
-                        data = handle.read()
-                except Exception as e:  # TODO: exception handling
-                    self.log.warning(f"Error: {e}")  # TODO: improve error message
-                    self.log.info("Unable to open file")
+        action = Action.find_most_recent_action(
+            db=session,
+            assignment_id=assignment.id,
+            action=AssignmentActions.released,
+            log=self.log,
+        )
+        release_file = action.location
 
-                    # error 500??
-                    raise Exception
+        if release_file:
+            if not self.call_blocking(self.storage.exists, release_file):
+                self.log.warning(f"Error: {release_file} is not in storage")  # TODO: improve error message
+                self.log.info("Unable to open file")
 
-                self.log.info(
-                    f"Adding action {AssignmentActions.fetched.value} for user {this_user['id']} against assignment {assignment.id}"  # noqa: E501
-                )
-                action = Action(
-                    user_id=this_user["id"],
-                    assignment_id=assignment.id,
-                    action=AssignmentActions.fetched,
-                    location=release_file,
-                )
-                session.add(action)
-                self.log.info("record of fetch action committed")
-                self.finish(data)
-            else:
-                self.log.info("no release file found")
+                # error 500??
                 raise Exception
 
-    # This is releasing an **assignment**, not a student submission
-    @authenticated
-    def post(self):
-        # Do a content-length check, before we go any further
-        if "Content-Length" in self.request.headers and int(self.request.headers["Content-Length"]) > int(
-            self.max_buffer_size
-        ):
-            note = "File upload oversize, and rejected. Please reduce the contents of the assignment, re-generate, and re-release"  # noqa: E501
-            self.log.info(note)
-            self.finish({"success": False, "note": note})
-            return
+            # Releases from before checksums were recorded
+            if not action.checksum:
+                action.checksum = self.call_blocking(self.storage.checksum, release_file)
+
+            fetched = {
+                "user_id": this_user["id"],
+                "assignment_id": assignment.id,
+                "action": AssignmentActions.fetched,
+                "location": release_file,
+                "checksum": action.checksum,
+            }
+            return release_file, action.checksum, action.timestamp, [fetched]
+        else:
+            self.log.info("no release file found")
+            raise Exception
 
+    # This is releasing an **assignment**, not a student submission
+    async def prepare_upload(self):
         [course_code, assignment_code] = self.get_params(["course_id", "assignment_id"])
         self.log.debug(
             f"Called POST /assignment with arguments: course {course_code} and  assignment {assignment_code}"
@@ -243,136 +302,116 @@ class Assignment(BaseHandler):
             note = "Posting an Assigment requires a course code and an assignment code"
             self.log.info(note)
             self.finish({"success": False, "note": note})
-            return
+            return False
 
-        this_user = self.nbex_user
+        this_user = await self.get_nbex_user()
 
         if course_code not in this_user["courses"]:
             note = f"User not subscribed to course {course_code}"
             self.log.info(note)
             self.finish({"success": False, "note": note})
-            return
+            return False
 
         if not "instructor" == this_user["current_role"].casefold():  # we may need to revisit this
             note = f"User not an instructor to course {course_code}"
             self.log.info(note)
             self.finish({"success": False, "note": note})
-            return
-
-        # The course will exist: the user object creates it if it doesn't exist
-        #  - and we know the user is subscribed to the course as an instructor (above)
-        with scoped_session() as session:
-            course = Course.find_by_code(db=session, code=course_code, org_id=this_user["org_id"], log=self.log)
+            return False
 
-            # We need to find this assignment, or make a new one.
-            assignment = AssignmentModel.find_by_code(db=session, code=assignment_code, course_id=course.id)
+        return True
 
-            if assignment is None:
-                # Look for inactive assignments
-                assignment = AssignmentModel.find_by_code(
-                    db=session, code=assignment_code, course_id=course.id, active=False
-                )
+    @authenticated
+    async def post(self):
+        [course_code, assignment_code] = self.get_params(["course_id", "assignment_id"])
+        this_user = await self.get_nbex_user()
 
-            if assignment is None:
-                self.log.info(f"New Assignment details: assignment_code:{assignment_code}, course_id:{course.id}")
-                # defaults active
-                assignment = AssignmentModel(assignment_code=assignment_code, course_id=course.id)
-                session.add(assignment)
-                # deliberately no commit: we need to be able to roll-back if there's no data!
-
-            # Set assignment to active
-            assignment.active = True
-
-            # storage is dynamically in $path/release/$course_code/$assignment_code/<timestamp>/
-            # Note - this means we can have multiple versions of the same release on the system
-            release_file = "/".join(
-                [
-                    self.base_storage_location,
-                    str(this_user["org_id"]),
-                    AssignmentActions.released.value,
-                    course_code,
-                    assignment_code,
-                    str(int(time.time())),
-                ]
-            )
+        # The body has been streamed to disk by now (see UploadHandler)
+        upload = await self.uploaded_file("assignment")
+        if upload is None:
+            return
 
-            if not self.request.files:
-                self.log.warning("Error: No file supplied in upload")  # TODO: improve error message
-                raise web.HTTPError(412)  # precondition failed
+        # The notebooks associated with this assignment
+        notebooks = self.get_arguments("notebooks")
+
+        # Releases are stored by their contents (see StorageBackend): we keep every version of a
+        # release, but re-releasing an unchanged assignment doesn't store another copy
+        result = await self.run_db(
+            self._release_assignment,
+            course_code,
+            assignment_code,
+            this_user,
+            notebooks,
+            upload["path"],
+            upload["sha256"],
+        )
+        self.finish(result)
 
-            try:
-                # Write the uploaded file to the desired location
-                file_info = self.request.files["assignment"][0]
+    def _release_assignment(self, session, course_code, assignment_code, this_user, notebooks, release_file, checksum):
+        # The course will exist: the user object creates it if it doesn't exist
+        #  - and we know the user is subscribed to the course as an instructor (above)
+        course = Course.find_by_code(db=session, code=course_code, org_id=this_user["org_id"], log=self.log)
 
-                filename, content_type = (
-                    file_info["filename"],
-                    file_info["content_type"],
-                )
-                note = f"Received file {filename}, of type {content_type}"
-                self.log.info(note)
-                extn = os.path.splitext(filename)[1]
-                cname = str(uuid.uuid4()) + extn
-
-                # store to disk.
-                # This should be abstracted, so it can be overloaded to store in other manners (eg AWS)
-                release_file = release_file + "/" + cname
-                # Ensure the directory exists
-                os.makedirs(os.path.dirname(release_file), exist_ok=True)
-                with open(release_file, "w+b") as handle:
-                    handle.write(file_info["body"])
-
-            except Exception as e:  # TODO: exception handling
-                self.log.warning(f"Error: {e}")  # TODO: improve error message
-
-                self.log.info("Upload failed")
-                # error 500??
-                raise Exception
+        # We need to find this assignment, or make a new one.
+        assignment = AssignmentModel.find_by_code(db=session, code=assignment_code, course_id=course.id)
 
-            # Check the file exists on disk
-            if not (
-                os.path.exists(release_file) and os.access(release_file, os.R_OK) and os.path.getsize(release_file) > 0
-            ):
-                note = "File upload failed."
-                self.log.info(note)
-                self.finish({"success": False, "note": note})
-                return
-
-            # We shouldn't get here, but a double-check is good
-            if os.path.getsize(release_file) > self.max_buffer_size:
-                os.remove(release_file)
-                note = "File upload oversize, and rejected. Please reduce the contents of the assignment, re-generate, and re-release"  # noqa: E501
-                self.log.info(note)
-                self.finish({"success": False, "note": note})
-                return
-
-            # now commit the assignment, and get it back to find the id
-            assignment = AssignmentModel.find_by_code(db=session, code=assignment_code, course_id=course.id)
-
-            # Record the notebooks associated with this assignment
-            notebooks = self.get_arguments("notebooks")
-
-            for notebook in notebooks:
-                self.log.debug(f"Adding notebook {notebook}")
-                new_notebook = Notebook(name=notebook)
-                assignment.notebooks.append(new_notebook)
-
-            # Record the action.
-            # Note we record the path to the files.
-            self.log.info(
-                f"Adding action {AssignmentActions.released.value} for user {this_user['id']} against assignment {assignment.id}"  # noqa: E501
-            )
-            action = Action(
-                user_id=this_user["id"],
-                assignment_id=assignment.id,
-                action=AssignmentActions.released,
-                location=release_file,
+        if assignment is None:
+            # Look for inactive assignments
+            assignment = AssignmentModel.find_by_code(
+                db=session, code=assignment_code, course_id=course.id, active=False
             )
-            session.add(action)
-            self.finish({"success": True, "note": "Released"})
+
+        if assignment is None:
+            self.log.info(f"New Assignment details: assignment_code:{assignment_code}, course_id:{course.id}")
+            # defaults active
+            assignment = AssignmentModel(assignment_code=assignment_code, course_id=course.id)
+            session.add(assignment)
+            # deliberately no commit: we need to be able to roll-back if there's no data!
+
+        # Set assignment to active
+        assignment.active = True
+
+        # Check the file made it to storage
+        try:
+            size = self.call_blocking(self.storage.stat, release_file).size
+        except FileNotFoundError:
+            size = 0
+        if not size:
+            note = "File upload failed."
+            self.log.info(note)
+            return {"success": False, "note": note}
+
+        # We shouldn't get here, but a double-check is good
+        if size > self.max_buffer_size:
+            self.log.info(self.oversize_note)
+            return {"success": False, "note": self.oversize_note}
+
+        # now commit the assignment, and get it back to find the id
+        assignment = AssignmentModel.find_by_code(db=session, code=assignment_code, course_id=course.id)
+
+        # Record the notebooks associated with this assignment
+        for notebook in notebooks:
+            self.log.debug(f"Adding notebook {notebook}")
+            new_notebook = Notebook(name=notebook)
+            assignment.notebooks.append(new_notebook)
+
+        # Record the action.
+        # Note we record the path to the files.
+        self.log.info(
+            f"Adding action {AssignmentActions.released.value} for user {this_user['id']} against assignment {assignment.id}"  # noqa: E501
+        )
+        action = Action(
+            user_id=this_user["id"],
+            assignment_id=assignment.id,
+            action=AssignmentActions.released,
+            location=release_file,
+            checksum=checksum,
+        )
+        session.add(action)
+        return {"success": True, "note": "Released"}
 
     # This is unreleasing an assignment
     @authenticated
-    def delete(self):
+    async def delete(self):
         [course_code, assignment_code, purge] = self.get_params(["course_id", "assignment_id", "purge"])
 
         self.log.debug(
@@ -384,7 +423,7 @@ class Assignment(BaseHandler):
             self.finish({"success": False, "note": note})
             return
 
-        this_user = self.nbex_user
+        this_user = await self.get_nbex_user()
 
         if course_code not in this_user["courses"]:
             note = f"User not subscribed to course {course_code}"
@@ -398,28 +437,29 @@ class Assignment(BaseHandler):
             self.finish({"success": False, "note": note})
             return
 
-        note = f"Assignment '{assignment_code}' on course '{course_code}' marked as unreleased"
-        with scoped_session() as session:
-            course = Course.find_by_code(db=session, code=course_code, org_id=this_user["org_id"], log=self.log)
+        self.finish(await self.run_db(self._unrelease_assignment, course_code, assignment_code, purge, this_user))
 
-            assignment = AssignmentModel.find_by_code(db=session, code=assignment_code, course_id=course.id)
-
-            if not assignment:
-                note = f"Missing assignment for {assignment_code} and {course_code}, cannot delete"
-                self.log.info(note)
-                self.finish({"success": False, "note": note})
-                return
+    def _unrelease_assignment(self, session, course_code, assignment_code, purge, this_user):
+        note = f"Assignment '{assignment_code}' on course '{course_code}' marked as unreleased"
+        course = Course.find_by_code(db=session, code=course_code, org_id=this_user["org_id"], log=self.log)
 
-            # Set assignment to inactive
-            assignment.active = False
-            # Delete the associated notebook
-            for notebook in assignment.notebooks:
-                session.delete(notebook)
+        assignment = AssignmentModel.find_by_code(db=session, code=assignment_code, course_id=course.id)
 
-            # If we have the purge parameter, we actually delete the data
-            # The various 'cascade on delete' settings should clear all the sub-tables
-            if purge:
-                session.delete(assignment)
-                note = f"Assignment '{assignment_code}' on course '{course_code}' deleted and purged from the database"
+        if not assignment:
+            note = f"Missing assignment for {assignment_code} and {course_code}, cannot delete"
+            self.log.info(note)
+            return {"success": False, "note": note}
+
+        # Set assignment to inactive
+        assignment.active = False
+        # Delete the associated notebook
+        for notebook in assignment.notebooks:
+            session.delete(notebook)
+
+        # If we have the purge parameter, we actually delete the data
+        # The various 'cascade on delete' settings should clear all the sub-tables
+        if purge:
+            session.delete(assignment)
+            note = f"Assignment '{assignment_code}' on course '{course_code}' deleted and purged from the database"
         self.log.info(f"{note} by user {this_user['id']} ")
-        self.finish({"success": True, "note": note})
+        return {"success": True, "note": note}
@@ -1,26 +1,38 @@
 import logging
 import os
+import time
 
 import jwt
 from tornado import web
 
+from nbexchange.cache import LRUCache
 from nbexchange.handlers.auth.user_handler import BaseUserHandler
 
 
 class NaasUserHandler(BaseUserHandler):
     jwt_key = os.environ.get("SECRET_KEY")
 
-    def get_current_user(self, request: web.RequestHandler) -> dict:
-        cookies = dict()
-        # Pass through cookies
-        for name in request.request.cookies:
-            cookies[name] = request.get_cookie(name)
+    # Verified tokens are cached, so the same token is only decoded once.
+    # An entry never outlives the token's own `exp`
+    token_cache_size = 1024
+    token_cache_ttl = 300
+
+    def __init__(self):
+        self.token_cache = LRUCache(maxsize=self.token_cache_size, ttl=self.token_cache_ttl)
 
-        if "noteable_auth" not in cookies:
+    def get_current_user(self, request: web.RequestHandler) -> dict:
+        encoded = request.get_cookie("noteable_auth")
+        if encoded is None:
             logging.debug(f"No noteable_auth cookie found - got {','.join(request.request.cookies)}")
             return None
 
-        encoded = cookies["noteable_auth"]
+        user = self.token_cache.get(encoded)
+        if user is None:
+            user = self.decode_user(encoded)
+        return dict(user)
+
+    def decode_user(self, encoded: str) -> dict:
+        """Verify the token, and turn it into the user dict, caching the result"""
         result = jwt.decode(encoded, self.jwt_key, algorithms=["HS256"])
 
         # TODO this _ to - transformation is unfortunate but the alternatives are also bad
@@ -36,7 +48,7 @@ class NaasUserHandler(BaseUserHandler):
         # We need to strip out forward slashes from the username. If not, the created paths will be invalid
         transformed_username = transformed_username.replace("/", "-")
 
-        return {
+        user = {
             "name": transformed_username,
             "full_name": result.get("n_fn", ""),
             "course_id": result["n_cid"],
@@ -45,3 +57,9 @@ class NaasUserHandler(BaseUserHandler):
             "org_id": result["n_oid"],
             "cust_id": result["n_cust_id"],
         }
+
+        ttl = None
+        if "exp" in result:
+            ttl = int(result["exp"] - time.time())
+        self.token_cache.set(encoded, user, ttl=ttl)
+        return user
@@ -1,16 +1,72 @@
+import copy
+import datetime
+import email.utils
 import functools
 import re
+import time
 from typing import Awaitable, Callable, Optional
 from urllib.parse import unquote, unquote_plus
 
-from tornado import web
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.util import await_only
+from tornado import httputil, iostream, web
+from tornado.ioloop import IOLoop
 from tornado.log import app_log
 
-from nbexchange.database import scoped_session
+from nbexchange import metrics, multipart, replicas, tarstream
+from nbexchange.cache import LRUCache
+from nbexchange.database import async_scoped_session, scoped_session
+from nbexchange.models.actions import Action
 from nbexchange.models.courses import Course
 from nbexchange.models.subscriptions import Subscription
 from nbexchange.models.users import User
 
+# Resolved `nbex_user` models, keyed on the identity claims that produced them.
+# Configured by the application (see NbExchange.user_cache_size & NbExchange.user_cache_ttl)
+# Changes made through this process (and its fellow workers) invalidate it; anything else
+# (another exchange on the same database, a direct database edit) waits for the ttl.
+user_cache = LRUCache()
+
+
+def _identity_key(hub_user):
+    return (
+        hub_user.get("name"),
+        hub_user.get("org_id", 1),
+        hub_user.get("course_id"),
+        hub_user.get("course_role"),
+        hub_user.get("full_name"),
+        hub_user.get("course_title", "no_title"),
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _invalidate_user_cache(session, flush_context):
+    """Drop cached users when their user, course, or subscription rows change
+
+    New users & courses cannot be in the cache yet, and subscription or user changes
+    only affect that user. A changed or deleted course clears the whole cache.
+    """
+    # (an empty cache here may not be empty in the other worker processes)
+    if not len(user_cache) and not user_cache.shared:
+        return
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Subscription):
+            user_cache.discard_where(lambda model: model["id"] == obj.user_id)
+        elif isinstance(obj, User) and obj not in session.new:
+            user_cache.discard_where(lambda model: model["id"] == obj.id)
+        elif isinstance(obj, Course) and obj not in session.new:
+            user_cache.clear()
+            return
+
+
+@event.listens_for(Session, "after_bulk_delete")
+@event.listens_for(Session, "after_bulk_update")
+def _invalidate_user_cache_bulk(update_context):
+    if update_context.mapper.class_ in (Course, Subscription, User):
+        user_cache.clear()
+
 
 def authenticated(method: Callable[..., Optional[Awaitable[None]]]) -> Callable[..., Optional[Awaitable[None]]]:
     """Decorate methods with this to require that the user be logged in.
@@ -33,6 +89,9 @@ class BaseHandler(web.RequestHandler):
     # register URL patterns
     urls = []
 
+    # Files are sent to the client in blocks of this many bytes
+    download_chunk_size = 64 * 1024
+
     def __init__(self, application, request, **kwargs):
         super(BaseHandler, self).__init__(application, request, **kwargs)
         self.set_header("Content-type", "application/json")
@@ -42,6 +101,11 @@ class BaseHandler(web.RequestHandler):
     def base_storage_location(self):
         return self.settings["base_storage_location"]
 
+    # Where uploaded files are stored (see NbExchange.storage_class)
+    @property
+    def storage(self):
+        return self.settings["storage"]
+
     @property
     def user_plugin(self):
         return self.settings["user_plugin"]
@@ -53,11 +117,267 @@ class BaseHandler(web.RequestHandler):
     def get_current_user(self):
         return self.user_plugin.get_current_user(self)
 
+    @property
+    def executor(self):
+        """The thread pool that blocking (database & storage) work is run on"""
+        return self.settings["executor"]
+
+    async def run_blocking(self, fn, *args, **kwargs):
+        """Run the blocking `fn(*args, **kwargs)` on the executor, so it doesn't stall the IOLoop"""
+        queued_at = time.monotonic()
+        metrics.EXECUTOR_QUEUED.inc()
+
+        def _run():
+            metrics.EXECUTOR_QUEUED.dec()
+            metrics.EXECUTOR_WAIT.observe(time.monotonic() - queued_at)
+            with metrics.EXECUTOR_ACTIVE.track_inprogress():
+                return fn(*args, **kwargs)
+
+        return await IOLoop.current().run_in_executor(self.executor, _run)
+
+    async def run_db(self, fn, *args, **kwargs):
+        """Run `fn(session, *args, **kwargs)` inside a `scoped_session`, on the executor
+
+        The session is committed (or rolled back) before this returns.
+
+        With the asyncio engine (NbExchange.db_async) `fn` is instead given the sync view of an
+        `async_scoped_session`, and runs on the IOLoop: queries don't block, but anything else
+        blocking (eg file storage) must go through `call_blocking`.
+        """
+        # (read replicas send this user's reads to the primary for a while, if this writes)
+        user = self.current_user
+        if self.settings.get("db_async"):
+            async with async_scoped_session() as session:
+                result = await session.run_sync(fn, *args, **kwargs)
+            if replicas.wrote(session.sync_session):
+                replicas.note_writer(user)
+            return result
+
+        def _run():
+            with scoped_session() as session:
+                result = fn(session, *args, **kwargs)
+            if replicas.wrote(session):
+                replicas.note_writer(user)
+            return result
+
+        return await self.run_blocking(_run)
+
+    def call_blocking(self, fn, *args, **kwargs):
+        """Call the blocking `fn(*args, **kwargs)` (eg file storage) from inside a `run_db` callback
+
+        Normally the callback is already on the executor, so `fn` is just called. With the asyncio
+        engine the callback runs on the IOLoop, so `fn` is sent to the executor, and the callback
+        waits for it without blocking the IOLoop.
+        """
+        if self.settings.get("db_async"):
+            return await_only(self.run_blocking(fn, *args, **kwargs))
+        return fn(*args, **kwargs)
+
+    async def run_db_read(self, fn, *args, **kwargs):
+        """`run_db`, for work that only reads: run on a read replica (NbExchange.db_replica_urls), if there is one
+
+        A user who has written recently (within NbExchange.db_replica_lag seconds) reads from the
+        primary, so they see what they've just done. If the replica fails, it's taken out of rotation
+        (until it passes a health check) and `fn` is run on the primary instead.
+        """
+        replica_set = self.settings.get("db_replicas")
+        replica = None
+        # (the asyncio engine has no replicas)
+        if replica_set is not None and not self.settings.get("db_async"):
+            if not replicas.recently_wrote(self.current_user):
+                replica = replica_set.choose()
+        if replica is None:
+            metrics.DB_READS.labels(target="primary").inc()
+            return await self.run_db(fn, *args, **kwargs)
+
+        def _run():
+            with replica.session() as session:
+                return fn(session, *args, **kwargs)
+
+        try:
+            result = await self.run_blocking(_run)
+        except OperationalError as e:
+            self.log.warning(f"{replica} failed, so reading from the primary: {e}")
+            replica.healthy = False
+            metrics.DB_READS.labels(target="primary").inc()
+            return await self.run_db(fn, *args, **kwargs)
+        metrics.DB_READS.labels(target="replica").inc()
+        return result
+
+    def record_actions(self, session, actions):
+        """Record `actions` (dicts of Action columns), in one insert
+
+        With the write-behind recorder (NbExchange.action_queue_size) they are queued, to be written
+        after the response; otherwise - or if the queue is full - they are written in `session`.
+        """
+        recorder = self.settings.get("action_recorder")
+        if recorder is not None and recorder.record(actions):
+            return
+        Action.insert_many(session, actions)
+
+    async def stream_file(self, location, checksum=None, modified=None, actions=None):
+        """Send the stored file at `location` as the response
+
+        The file is read & sent a block at a time, waiting for each block to be sent before
+        reading the next - so a download holds one block in memory, and a slow client slows
+        the reading rather than filling up the server's buffers.
+
+        Stored files never change, so `checksum` (the sha256 of the contents) is a strong ETag:
+        conditional requests (`If-None-Match`, `If-Modified-Since`) get a 304, and `Range`
+        requests get just the bytes asked for.
+
+        `modified` is when the release (submission, feedback) was recorded, for `Last-Modified`.
+        Not the stored file's own time: files are stored by their contents, so identical releases
+        share the file stored for the first of them.
+
+        `actions` (dicts of Action columns: the fetch, collection...) are recorded (see `record_actions`) when
+        the download starts - not for a 304, nor a `Range` request for a later part of the file - so a client
+        revalidating its copy, or resuming a download, doesn't record the download again.
+        """
+        stored = await self.run_blocking(self.storage.stat, location)
+        if checksum:
+            self.set_header("Etag", f'"{checksum}"')
+        if modified is not None:
+            # (recorded in UTC)
+            if modified.tzinfo is None:
+                modified = modified.replace(tzinfo=datetime.timezone.utc)
+            self.set_header("Last-Modified", modified)
+        self.set_header("Accept-Ranges", "bytes")
+
+        if self.not_modified(modified):
+            self.set_status(304)
+            return
+
+        start, end = self.requested_range(stored.size)
+        if start is None:
+            return  # the range can't be satisfied
+        if actions and start == 0:
+            self.log.info(f"Adding {len(actions)} actions {actions[0]['action'].value} by user {actions[0]['user_id']}")
+            await self.run_db(self.record_actions, actions)
+        self.set_header("Content-Length", end - start)
+        try:
+            await self.send_stored(location, start, end - start)
+        except iostream.StreamClosedError:
+            self.log.info(f"Client went away during download of {location}")
+            return
+        self.finish()
+
+    async def send_stored(self, location, start, length):
+        """Send `length` bytes of the stored file at `location`, from `start`, a block at a time"""
+        handle = await self.run_blocking(self.storage.get, location, start)
+        try:
+            remaining = length
+            while remaining > 0:
+                chunk = await self.run_blocking(handle.read, min(self.download_chunk_size, remaining))
+                if not chunk:
+                    raise IOError(f"{location} is shorter than expected")
+                remaining -= len(chunk)
+                self.write(chunk)
+                await self.flush()
+        finally:
+            handle.close()
+
+    async def stream_tar(self, filename, members):
+        """Send `members` (a list of `tarstream.Member`) as a tar archive, called `filename`
+
+        Like `stream_file`, the archive is built & sent a block at a time: stored files are
+        read from storage as they are sent, and nothing is put together in memory or on disk.
+        """
+        self.set_header("Content-Type", "application/x-tar")
+        self.set_header("Content-Disposition", f'attachment; filename="{filename}"')
+        self.set_header("Content-Length", tarstream.archive_size(members))
+        try:
+            for member in members:
+                self.write(tarstream.header(member))
+                if isinstance(member.source, bytes):
+                    self.write(member.source)
+                else:
+                    await self.send_stored(member.source, 0, member.size)
+                self.write(tarstream.padding(member.size))
+                await self.flush()
+            self.write(tarstream.END_OF_ARCHIVE)
+            await self.flush()
+        except iostream.StreamClosedError:
+            self.log.info(f"Client went away during download of {filename}")
+            return
+        self.finish()
+
+    def not_modified(self, modified):
+        """Whether the client already has the current version of the response (see `stream_file`)"""
+        if self.request.headers.get("If-None-Match"):
+            return self.check_etag_header()
+        if_modified_since = self.request.headers.get("If-Modified-Since")
+        if if_modified_since and modified is not None:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+            # (HTTP dates are to the second)
+            return since is not None and since.timestamp() >= int(modified.timestamp())
+        return False
+
+    def requested_range(self, size):
+        """The (start, end) of the file to send, given the request's `Range` header
+
+        Sets the status (& Content-Range) for a partial response. If the range cannot be
+        satisfied, the response is set to a 416 and (None, None) is returned.
+        """
+        range_header = self.request.headers.get("Range")
+        if_range = self.request.headers.get("If-Range")
+        if not range_header or (if_range and if_range != self._headers.get("Etag")):
+            return 0, size
+        request_range = httputil._parse_request_range(range_header)
+        if request_range is None:
+            return 0, size
+        start, end = request_range
+        if start is not None and start < 0:
+            start = max(start + size, 0)
+        if (start is not None and (start >= size or (end is not None and start >= end))) or end == 0:
+            self.set_status(416)
+            self.set_header("Content-Type", "text/plain")
+            self.set_header("Content-Range", f"bytes */{size}")
+            return None, None
+        start = start or 0
+        end = size if end is None else min(end, size)
+        if end - start != size:
+            self.set_status(206)
+            self.set_header("Content-Range", httputil._get_content_range(start, end, size))
+        return start, end
+
     @property
     def nbex_user(self):
-        hub_user = self.get_current_user()
-        hub_username = hub_user.get("name")
+        """The nbexchange user model for the current user (blocking: prefer `get_nbex_user`)"""
+        # `current_user` is memoised by tornado, so this does not re-authenticate the request
+        hub_user = self.current_user
+        model = self._cached_nbex_user(hub_user)
+        if model is None:
+            with scoped_session() as session:
+                model, generation = self._sync_nbex_user(session, hub_user)
+            user_cache.set(_identity_key(hub_user), copy.deepcopy(model), generation=generation)
+        return model
+
+    async def get_nbex_user(self):
+        """The nbexchange user model for the current user, with any database work done on the executor"""
+        hub_user = self.current_user
+        model = self._cached_nbex_user(hub_user)
+        if model is None:
+            model, generation = await self.run_db(self._sync_nbex_user, hub_user)
+            user_cache.set(_identity_key(hub_user), copy.deepcopy(model), generation=generation)
+        return model
 
+    def _cached_nbex_user(self, hub_user):
+        # The same identity (same user, course & role) resolves to the same model, so
+        # skip the database entirely if we've seen it recently.
+        model = user_cache.get(_identity_key(hub_user))
+        if model is not None:
+            self.org_id = hub_user.get("org_id", 1)
+            return copy.deepcopy(model)
+        return None
+
+    def _sync_nbex_user(self, session, hub_user):
+        """Make sure the user, course & subscription exist, and read back the user's model
+
+        Returns the model, and the `user_cache.generation` from before it was read: if something invalidates
+        the cache while we're reading, what we read may be stale, and mustn't be cached.
+        """
+        hub_username = hub_user.get("name")
         full_name = hub_user.get("full_name")
         current_course = hub_user.get("course_id")
         current_role = hub_user.get("course_role")
@@ -72,50 +392,41 @@ class BaseHandler(web.RequestHandler):
 
         self.org_id = org_id
 
-        with scoped_session() as session:
-            user = User.find_by_name(db=session, name=hub_username, log=self.log)
-            if user is None:
-                self.log.debug(f"New user details: name:{hub_username}, org_id:{org_id}")
-                user = User(name=hub_username, org_id=org_id)
-                session.add(user)
-            if user.full_name != full_name:
-                user.full_name = full_name
-
-            course = Course.find_by_code(db=session, code=current_course, org_id=org_id, log=self.log)
-            if course is None:
-                self.log.debug(f"New course details: code:{current_course}, org_id:{org_id}")
-                course = Course(org_id=org_id, course_code=current_course)
-                if course_title:
-                    self.log.debug(f"Adding title {course_title}")
-                    course.course_title = course_title
-                session.add(course)
-
-            # Check to see if we have a subscription (for this course)
-            self.log.debug(f"Looking for subscription for: user:{user.id}, course:{course.id}, role:{current_role}")
-
-            subscription = Subscription.find_by_set(db=session, user_id=user.id, course_id=course.id, role=current_role)
-            if subscription is None:
-                self.log.debug(f"New subscription details: user:{user.id}, course:{course.id}, role:{current_role}")
-                subscription = Subscription(user_id=user.id, course_id=course.id, role=current_role)
-                session.add(subscription)
-
-            courses = {}
-
-            for subscription in user.courses:
-                if subscription.course.course_code not in courses:
-                    courses[subscription.course.course_code] = {}
-                courses[subscription.course.course_code][subscription.role] = 1
-
-            model = {
-                "kind": "user",
-                "id": user.id,
-                "name": user.name,
-                "org_id": user.org_id,
-                "current_course": current_course,
-                "current_role": current_role,
-                "courses": courses,
-            }
-        return model
+        # Upsert the user, course & subscription (no find-then-insert races between two tabs of
+        # the same user), then read back every subscription for the user in one query
+        User.upsert(db=session, name=hub_username, org_id=org_id, full_name=full_name, log=self.log)
+        Course.upsert(db=session, code=current_course, org_id=org_id, title=course_title, log=self.log)
+        if Subscription.upsert(
+            db=session,
+            user_name=hub_username,
+            course_code=current_course,
+            org_id=org_id,
+            role=current_role,
+            log=self.log,
+        ):
+            self.log.debug(f"New subscription: user:{hub_username}, course:{current_course}, role:{current_role}")
+            # Any cached models for this user are missing the new subscription
+            user_cache.discard_where(lambda model: model["name"] == hub_username)
+
+        # (after our own invalidation, above)
+        generation = user_cache.generation
+        user_id = None
+        courses = {}
+        for user_id, course_code, role in Subscription.find_roles_for_user(
+            db=session, user_name=hub_username, org_id=org_id, log=self.log
+        ):
+            courses.setdefault(course_code, {})[role] = 1
+
+        model = {
+            "kind": "user",
+            "id": user_id,
+            "name": hub_username,
+            "org_id": int(float(org_id)),
+            "current_course": current_course,
+            "current_role": current_role,
+            "courses": courses,
+        }
+        return model, generation
 
     @property
     def log(self):
@@ -135,6 +446,123 @@ class BaseHandler(web.RequestHandler):
             return_params.append(value)
         return return_params
 
+    def get_flag(self, param):
+        """Whether the query parameter `param` is set to true (`true`, `yes` or `1`)"""
+        [value] = self.get_params([param])
+        return bool(value) and value.lower() in ("true", "yes", "1")
+
+    def get_int_param(self, param, minimum=0):
+        """The query parameter `param` as an int, or None if it is not given
+
+        Raises ValueError (with a note for the user) if it is not a whole number, or is below `minimum`
+        """
+        [value] = self.get_params([param])
+        if value is None:
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValueError(f"{param} must be a whole number")
+        if value < minimum:
+            raise ValueError(f"{param} must be at least {minimum}")
+        return value
+
+
+@web.stream_request_body
+class UploadHandler(BaseHandler):
+    """A handler that takes a (multipart/form-data) file upload on POST
+
+    The body is parsed as it arrives, and files are written straight to storage,
+    so each upload only holds one chunk in memory however big the file is. The size limit
+    (`max_buffer_size`) is applied as the file arrives, not once it has all been received.
+
+    Subclasses implement `prepare_upload`, which does all the checks that can be done
+    before the body is accepted, and then use `uploaded_file` in `post`.
+    """
+
+    # Returned if the upload is bigger than max_buffer_size
+    oversize_note = "File upload oversize, and rejected."
+
+    upload = None
+
+    async def prepare(self):
+        if self.request.method != "POST":
+            return
+        # No body is accepted from an unauthenticated user
+        if not self.current_user:
+            raise web.HTTPError(403)
+        if "Content-Length" in self.request.headers and int(self.request.headers["Content-Length"]) > int(
+            self.max_buffer_size
+        ):
+            self.log.info(self.oversize_note)
+            self.finish({"success": False, "note": self.oversize_note})
+            return
+
+        if not await self.prepare_upload():
+            return
+
+        boundary = multipart.boundary_for(self.request.headers.get("Content-Type", ""))
+        if boundary:
+            # Allow for the form fields & part headers around the file
+            self.request.connection.set_max_body_size(int(self.max_buffer_size) + multipart.MAX_FIELD_SIZE)
+            self.upload = multipart.MultipartStreamParser(boundary, self.storage, int(self.max_buffer_size))
+
+    async def prepare_upload(self):
+        """Check the request can go ahead, before the body is accepted
+
+        Return True if the upload can go ahead, or finish the request and return False.
+        """
+        raise NotImplementedError()
+
+    async def data_received(self, chunk):
+        if self.upload is not None:
+            await self.run_blocking(self.upload.feed, chunk)
+
+    async def uploaded_file(self, name):
+        """Finish the upload, and return the details of the file uploaded as `name`
+
+        This is the `path` (storage location) of the file, its `size`, and the `sha256` of its contents.
+
+        The upload's form fields are added to the request arguments.
+        Raises a 412 if no file was uploaded, or finishes the request and returns None if the upload failed.
+        """
+        files = await self.uploaded_files(name)
+        return files[0] if files is not None else None
+
+    async def uploaded_files(self, name):
+        """As `uploaded_file`, but the details of every file uploaded as `name`, in the order they were sent"""
+        if self.upload is None:
+            self.log.warning("Error: No file supplied in upload")  # TODO: improve error message
+            raise web.HTTPError(412)  # precondition failed
+        await self.run_blocking(self.upload.close)
+
+        if self.upload.error:
+            self.log.info(self.upload.error)
+            note = self.oversize_note if self.upload.oversize else "File upload failed."
+            self.finish({"success": False, "note": note})
+            return None
+
+        for field, values in self.upload.arguments.items():
+            self.request.body_arguments.setdefault(field, []).extend(values)
+            self.request.arguments.setdefault(field, []).extend(values)
+
+        if name not in self.upload.files:
+            self.log.warning("Error: No file supplied in upload")  # TODO: improve error message
+            raise web.HTTPError(412)  # precondition failed
+
+        for file_info in self.upload.files[name]:
+            self.log.info(f"Received file {file_info['filename']}, of type {file_info['content_type']}")
+        return self.upload.files[name]
+
+    def on_finish(self):
+        # Throw away any partly-written file (eg the client went away)
+        if self.upload is not None:
+            self.upload.discard()
+
+    def on_connection_close(self):
+        super().on_connection_close()
+        self.on_finish()
+
 
 class Template404(BaseHandler):
     """Render nbexchange's 404 template"""
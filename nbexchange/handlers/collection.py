@@ -1,6 +1,9 @@
+import json
+import time
+
 from tornado import web
 
-from nbexchange.database import scoped_session
+from nbexchange import tarstream
 from nbexchange.handlers.base import BaseHandler, authenticated
 from nbexchange.models.actions import Action, AssignmentActions
 from nbexchange.models.assignments import Assignment as AssignmentModel
@@ -21,6 +24,7 @@ class Collections(BaseHandler):
         course_id: course_code
         assignment_id: assignment_code
         user_id: user_id - optional
+        latest_only: only the most recent submission of each user - optional
 
     GET: gets list of actions for the assignment
     """
@@ -28,9 +32,7 @@ class Collections(BaseHandler):
     urls = ["collections"]
 
     @authenticated
-    def get(self):
-        models = []
-
+    async def get(self):
         [course_code, assignment_code, user_id] = self.get_params(["course_id", "assignment_id", "user_id"])
 
         if not (course_code and assignment_code):
@@ -40,7 +42,7 @@ class Collections(BaseHandler):
             return
 
         # Who is my user?
-        this_user = self.nbex_user
+        this_user = await self.get_nbex_user()
 
         self.log.debug(f"User: {this_user.get('name')}")
         # For what course do we want to see the assignments?
@@ -57,59 +59,67 @@ class Collections(BaseHandler):
             self.finish({"success": False, "note": note})
             return
 
-        # Find the course being referred to
-        with scoped_session() as session:
-            course = Course.find_by_code(db=session, code=course_code, org_id=this_user["org_id"], log=self.log)
-            if not course:
-                note = f"Course {course_code} does not exist"
-                self.log.info(note)
-                self.finish({"success": False, "note": note})
-                return
-
-            assignment = AssignmentModel.find_by_code(
-                db=session,
-                course_id=course.id,
-                log=self.log,
-                code=assignment_code,
-                action=AssignmentActions.submitted.value,
+        latest_only = self.get_flag("latest_only")
+        self.finish(
+            await self.run_db_read(
+                self._list_collections, course_code, assignment_code, user_id, latest_only, this_user
             )
+        )
 
-            if not assignment:
-                note = f"Assignment {assignment_code} does not exist"
-                self.log.info(note)
-                self.finish({"success": True, "value": []})
-                return
-
-            self.log.debug(f"Assignment: {assignment}")
+    def _list_collections(self, session, course_code, assignment_code, user_id, latest_only, this_user):
+        models = []
 
-            filters = [
-                Action.assignment_id == assignment.id,
-                Action.action == AssignmentActions.submitted.value,
-            ]
+        # Find the course being referred to
+        course = Course.find_by_code(db=session, code=course_code, org_id=this_user["org_id"], log=self.log)
+        if not course:
+            note = f"Course {course_code} does not exist"
+            self.log.info(note)
+            return {"success": False, "note": note}
+
+        assignment = AssignmentModel.find_by_code(
+            db=session,
+            course_id=course.id,
+            log=self.log,
+            code=assignment_code,
+            action=AssignmentActions.submitted.value,
+        )
+
+        if not assignment:
+            note = f"Assignment {assignment_code} does not exist"
+            self.log.info(note)
+            return {"success": True, "value": []}
+
+        self.log.debug(f"Assignment: {assignment}")
+
+        student_id = None
+        if user_id:
+            student = session.query(User).filter(User.name == user_id).first()
+            student_id = student.id
+
+        actions = Action.find_submissions(
+            db=session, assignment_id=assignment.id, user_id=student_id, latest_only=latest_only, log=self.log
+        )
+
+        # The same for every submission
+        # 'name' in db, 'notebook_id' id nbgrader
+        notebooks = [{"notebook_id": x.name} for x in assignment.notebooks]
+
+        for action in actions:
+            models.append(
+                {
+                    "student_id": action.user.name,
+                    "full_name": action.user.full_name,
+                    "assignment_id": assignment.assignment_code,
+                    "course_id": course.course_code,
+                    "status": action.action.value,  # currently called 'action' in our db
+                    "path": action.location,
+                    "notebooks": notebooks,
+                    "timestamp": action.timestamp.strftime("%Y-%m-%d %H:%M:%S.%f %Z"),
+                }
+            )
 
-            if user_id:
-                student = session.query(User).filter(User.name == user_id).first()
-                filters.append(Action.user_id == student.id)
-
-            actions = session.query(Action).filter(*filters)
-
-            for action in actions:
-                models.append(
-                    {
-                        "student_id": action.user.name,
-                        "full_name": action.user.full_name,
-                        "assignment_id": assignment.assignment_code,
-                        "course_id": assignment.course.course_code,
-                        "status": action.action.value,  # currently called 'action' in our db
-                        "path": action.location,
-                        # 'name' in db, 'notebook_id' id nbgrader
-                        "notebooks": [{"notebook_id": x.name} for x in assignment.notebooks],
-                        "timestamp": action.timestamp.strftime("%Y-%m-%d %H:%M:%S.%f %Z"),
-                    }
-                )
-
-            self.log.debug(f"Assignments: {models}")
-        self.finish({"success": True, "value": models})
+        self.log.debug(f"Assignments: {models}")
+        return {"success": True, "value": models}
 
     # This has no authentiction wrapper, so false implication os service
     def post(self):
@@ -122,16 +132,22 @@ class Collection(BaseHandler):
         course_id: course_code
         assignment_id: assignment_code
         path: url_encoded_path
+        user_id: the student who submitted it (optional)
 
     GET: Downloads the specified file (checking that it's "submitted", for this course/assignment,
     and the user has access to do so)
+
+    Identical submissions share a path, so give `user_id` to get the right student's submission
+    (for its `Last-Modified`, and the checks on it).
     """
 
     urls = ["collection"]
 
     @authenticated
-    def get(self):
-        [course_code, assignment_code, path] = self.get_params(["course_id", "assignment_id", "path"])
+    async def get(self):
+        [course_code, assignment_code, path, student_id] = self.get_params(
+            ["course_id", "assignment_id", "path", "user_id"]
+        )
 
         if not (course_code and assignment_code and path):
             note = "Collection call requires a course code, an assignment code, and a path"
@@ -140,7 +156,7 @@ class Collection(BaseHandler):
             return
 
         # Who is my user?
-        this_user = self.nbex_user
+        this_user = await self.get_nbex_user()
 
         self.log.debug(f"User: {this_user.get('name')}")
         # For what course do we want to see the assignments?
@@ -159,53 +175,214 @@ class Collection(BaseHandler):
             self.finish({"success": False, "note": note})
             return
 
+        result = await self.run_db(self._collect_submission, course_code, assignment_code, path, this_user, student_id)
+        if isinstance(result, dict):
+            self.finish(result)
+            return
+
+        self.set_header("Content-Type", "application/gzip")
+        if result is not None:
+            path, checksum, submitted, collected = result
+            await self.stream_file(path, checksum, submitted, actions=collected)
+
+    def _collect_submission(self, session, course_code, assignment_code, path, this_user, student_id=None):
+        """Read the submitted file
+
+        Returns the file's location, checksum, when it was submitted & the collection to record (see `stream_file`),
+        a dict [note] if there's a problem, or None if there's no submission
+        """
         # Find the course being referred to
-        with scoped_session() as session:
-            course = Course.find_by_code(db=session, code=course_code, org_id=this_user["org_id"], log=self.log)
-            if not course:
-                note = f"Course {course_code} does not exist"
-                self.log.info(note)
-                self.finish({"success": False, "note": note})
-                return
-
-            # We need to key off the assignment, but we're actually looking
-            # for the action with a action and a specific path
-            assignments = AssignmentModel.find_for_course(
+        course = Course.find_by_code(db=session, code=course_code, org_id=this_user["org_id"], log=self.log)
+        if not course:
+            note = f"Course {course_code} does not exist"
+            self.log.info(note)
+            return {"success": False, "note": note}
+
+        # We need to key off the assignment, but we're actually looking
+        # for the action with a action and a specific path
+        assignments = AssignmentModel.find_for_course(
+            db=session,
+            course_id=course.id,
+            log=self.log,
+            action=AssignmentActions.submitted.value,
+            path=path,
+        )
+
+        # Identical submissions, to different assignments, share a path
+        assignments = [assignment for assignment in assignments if assignment.assignment_code == assignment_code]
+
+        student = None
+        if student_id:
+            student = session.query(User).filter(User.name == student_id, User.org_id == course.org_id).first()
+            if student is None:
+                self.log.info(f"Student {student_id} does not exist")
+                return None
+
+        # I do not want to assume there will just be one.
+        for assignment in assignments:
+            self.log.debug(f"Assignment: {assignment}")
+
+            if not self.call_blocking(self.storage.exists, path):
+                self.log.warning(f"Error: {path} is not in storage")  # TODO: improve error message
+
+                # error 500??
+                raise Exception
+
+            submitted = Action.find_most_recent_action(
                 db=session,
-                course_id=course.id,
+                assignment_id=assignment.id,
+                action=AssignmentActions.submitted,
+                location=path,
+                user_id=student.id if student else None,
                 log=self.log,
-                action=AssignmentActions.submitted.value,
-                path=path,
+            )
+            if submitted is None:
+                self.log.info(f"No submission by {student_id} at {path}")
+                return None
+            # Submissions from before checksums were recorded
+            if not submitted.checksum:
+                submitted.checksum = self.call_blocking(self.storage.checksum, path)
+
+            collected = {
+                "user_id": this_user["id"],
+                "assignment_id": assignment.id,
+                "action": AssignmentActions.collected,
+                "location": path,
+                "checksum": submitted.checksum,
+            }
+            return path, submitted.checksum, submitted.timestamp, [collected]
+
+    # This has no authentiction wrapper, so false implication os service
+    def post(self):
+        raise web.HTTPError(501)
+
+
+class CollectionArchive(BaseHandler):
+    """.../collections/archive
+    parmas:
+        course_id: course_code
+        assignment_id: assignment_code
+        user_id: user_id - optional, may be repeated
+
+    GET: Downloads the latest submission of every student (or of each user_id given) as a single tar.
+    The first member is "manifest.json", a list of
+        {"student_id", "full_name", "timestamp", "checksum", "member"}
+    one for each of the other members: the submitted file, named "member".
+
+    A collection is recorded against every submission in the archive.
+    """
+
+    urls = ["collections/archive"]
+
+    @authenticated
+    async def get(self):
+        [course_code, assignment_code] = self.get_params(["course_id", "assignment_id"])
+        user_ids = [self.param_decode(value) for value in self.get_arguments("user_id") if value]
+
+        if not (course_code and assignment_code):
+            note = "Collection archive call requires both a course code and an assignment code"
+            self.log.info(note)
+            self.finish({"success": False, "note": note})
+            return
+
+        # Who is my user?
+        this_user = await self.get_nbex_user()
+
+        self.log.debug(f"User: {this_user.get('name')}")
+        # For what course do we want to see the assignments?
+        self.log.debug(f"Course: {course_code}")
+        # Is our user subscribed to this course?
+        if course_code not in this_user["courses"]:
+            note = f"User not subscribed to course {course_code}"
+            self.log.info(note)
+            self.finish({"success": False, "note": note})
+            return
+        if not "instructor" == this_user["current_role"].casefold():  # we may need to revisit this
+            note = f"User not an instructor to course {course_code}"
+            self.log.info(note)
+            self.finish({"success": False, "note": note})
+            return
+
+        result = await self.run_db(self._collect_archive, course_code, assignment_code, user_ids, this_user)
+        if isinstance(result, dict):
+            self.finish(result)
+            return
+
+        manifest, members = result
+        manifest = json.dumps(manifest).encode("utf-8")
+        members.insert(0, tarstream.Member("manifest.json", len(manifest), time.time(), manifest))
+        await self.stream_tar(f"{course_code}-{assignment_code}.tar", members)
+
+    def _collect_archive(self, session, course_code, assignment_code, user_ids, this_user):
+        """Find the latest submissions, and record their collection (in one insert)
+
+        Returns the manifest & the `tarstream.Member` for each submission, or a dict [note] if there's a problem
+        """
+        # Find the course being referred to
+        course = Course.find_by_code(db=session, code=course_code, org_id=this_user["org_id"], log=self.log)
+        if not course:
+            note = f"Course {course_code} does not exist"
+            self.log.info(note)
+            return {"success": False, "note": note}
+
+        assignment = AssignmentModel.find_by_code(
+            db=session,
+            course_id=course.id,
+            log=self.log,
+            code=assignment_code,
+            action=AssignmentActions.submitted.value,
+        )
+        if not assignment:
+            self.log.info(f"Assignment {assignment_code} does not exist")
+            return [], []
+
+        student_ids = None
+        if user_ids:
+            student_ids = [
+                user.id for user in session.query(User.id).filter(User.name.in_(user_ids), User.org_id == course.org_id)
+            ]
+
+        submissions = Action.find_submissions(
+            db=session, assignment_id=assignment.id, latest_only=True, user_ids=student_ids, log=self.log
+        )
+
+        manifest, members, collected = [], [], []
+        for submission in submissions:
+            try:
+                stored = self.call_blocking(self.storage.stat, submission.location)
+            except FileNotFoundError:
+                self.log.warning(f"Error: {submission.location} is not in storage - not collected")
+                continue
+            # Submissions from before checksums were recorded
+            if not submission.checksum:
+                submission.checksum = self.call_blocking(self.storage.checksum, submission.location)
+
+            member = f"{submission.user.name.replace('/', '_')}.tar.gz"
+            manifest.append(
+                {
+                    "student_id": submission.user.name,
+                    "full_name": submission.user.full_name,
+                    "timestamp": submission.timestamp.strftime("%Y-%m-%d %H:%M:%S.%f %Z"),
+                    "checksum": submission.checksum,
+                    "member": member,
+                }
+            )
+            members.append(tarstream.Member(member, stored.size, stored.modified, submission.location))
+            collected.append(
+                {
+                    "user_id": this_user["id"],
+                    "assignment_id": assignment.id,
+                    "action": AssignmentActions.collected,
+                    "location": submission.location,
+                    "checksum": submission.checksum,
+                }
             )
 
-            self.set_header("Content-Type", "application/gzip")
-
-            # I do not want to assume there will just be one.
-            for assignment in assignments:
-                self.log.debug(f"Assignment: {assignment}")
-
-                try:
-                    with open(path, "r+b") as handle:
-                        data = handle.read()
-                except Exception as e:  # TODO: exception handling
-                    self.log.warning(f"Error: {e}")  # TODO: improve error message
-
-                    # error 500??
-                    raise Exception
-
-                self.log.info(
-                    f"Adding action {AssignmentActions.collected.value} for user {this_user['id']} against assignment {assignment.id}"  # noqa: E501
-                )
-                action = Action(
-                    user_id=this_user["id"],
-                    assignment_id=assignment.id,
-                    action=AssignmentActions.collected,
-                    location=path,
-                )
-                session.add(action)
-
-                self.finish(data)
-                return
+        self.log.info(
+            f"Adding {len(collected)} actions {AssignmentActions.collected.value} for user {this_user['id']} against assignment {assignment.id}"  # noqa: E501
+        )
+        self.record_actions(session, collected)
+        return manifest, members
 
     # This has no authentiction wrapper, so false implication os service
     def post(self):
@@ -1,13 +1,12 @@
 import base64
-import os
-import tempfile
+import json
 import time
 
 from dateutil import parser
 from tornado import web
 
-from nbexchange.database import scoped_session
-from nbexchange.handlers.base import BaseHandler, authenticated
+from nbexchange import tarstream
+from nbexchange.handlers.base import BaseHandler, UploadHandler, authenticated
 from nbexchange.models.actions import Action, AssignmentActions
 from nbexchange.models.assignments import Assignment as AssignmentModel
 from nbexchange.models.courses import Course
@@ -23,14 +22,62 @@ This relys on users being logged in, and the user-object having additional data:
 """
 
 
+def find_feedback(session, course_id, assignment_id, this_user, log):
+    """The assignment, and the (feedback, filename) of each piece of feedback for this user on it"""
+    course = Course.find_by_code(db=session, code=course_id, org_id=this_user["org_id"], log=log)
+    if not course:
+        note = f"Course {course_id} not found"
+        log.info(note)
+        raise web.HTTPError(404, note)
+
+    assignment = AssignmentModel.find_by_code(db=session, code=assignment_id, course_id=course.id, log=log)
+    if not assignment:
+        note = f"Assignment {assignment_id} for Course {course_id} not found"
+        log.info(note)
+        raise web.HTTPError(404, note)
+
+    res = Feedback.find_all_for_student(
+        db=session,
+        student_id=this_user["id"],
+        assignment_id=assignment.id,
+        log=log,
+    )
+    feedbacks = [(r, "{0}.html".format(r.notebook.name)) for r in res]
+    return assignment, feedbacks
+
+
+def read_base64(storage, location):
+    """The stored file at `location`, base64 encoded. Blocking"""
+    return base64.b64encode(storage.read(location)).decode("utf-8")
+
+
+def archive_member(timestamp, filename):
+    """What a piece of feedback is called in the archive: "timestamp/filename", safe to extract anywhere"""
+    return f"{timestamp.strftime('%Y-%m-%dT%H-%M-%S.%f')}/{filename.strip().replace('/', '_')}"
+
+
+def feedback_entry(feedback, filename):
+    """How a piece of feedback is described to the student"""
+    return {
+        "filename": filename,
+        # This matches self.timestamp_format
+        "timestamp": feedback.timestamp.strftime("%Y-%m-%d %H:%M:%S.%f %Z"),
+        "checksum": feedback.checksum,
+        # Only good for the student the feedback is for: downloads only look among their own feedback, on
+        # their own course (see record_feedback_fetched)
+        "token": str(feedback.id),
+    }
+
+
 class FeedbackHandler(BaseHandler):
     """.../feedback/
     parmas:
         course_id: course_code
         assignment_id: assignment_code
         user_id: user_id (optional)
+        manifest: just list the feedback files, with a token to download each one (optional)
 
-    GET: Get list of feedback files for an assignment and user
+    GET: Get list of feedback files (with their contents, unless manifest=true) for an assignment and user
     POST: (role=instructor, with file): Add ("feedback") to an assignment
     """
 
@@ -38,7 +85,7 @@ class FeedbackHandler(BaseHandler):
 
     # Fetch feedback
     @authenticated
-    def get(self):
+    async def get(self):
         [course_id, assignment_id] = self.get_params(["course_id", "assignment_id"])
 
         if not assignment_id or not course_id:
@@ -49,64 +96,27 @@ class FeedbackHandler(BaseHandler):
 
         self.log.debug(f"checking for feedback for {assignment_id} on {course_id}")
 
-        this_user = self.nbex_user
-
-        with scoped_session() as session:
-            course = Course.find_by_code(db=session, code=course_id, org_id=this_user["org_id"], log=self.log)
-            if not course:
-                note = f"Course {course_id} not found"
-                self.log.info(note)
-                # self.finish({"success": False, "note": note, "value": []})
-                # return
-                raise web.HTTPError(404, note)
-
-            assignment = AssignmentModel.find_by_code(db=session, code=assignment_id, course_id=course.id, log=self.log)
-            if not assignment:
-                note = f"Assignment {assignment_id} for Course {course_id} not found"
-                self.log.info(note)
-                # self.finish({"success": False, "note": note, "value": []})
-                # return
-                raise web.HTTPError(404, note)
-
-            student = User.find_by_name(db=session, name=this_user["name"], log=self.log)
-
-            res = Feedback.find_all_for_student(
-                db=session,
-                student_id=student.id,
-                assignment_id=assignment.id,
-                log=self.log,
-            )
-            feedbacks = []
-            for r in res:
-                f = {}
-                notebook = Notebook.find_by_pk(db=session, pk=r.notebook_id, log=self.log)
-                if notebook is not None:
-                    feedback_name = "{0}.html".format(notebook.name)
-                else:
-                    feedback_name = os.path.basename(r.location)
-                with open(r.location, "r+b") as fp:
-                    f["content"] = base64.b64encode(fp.read()).decode("utf-8")
-                f["filename"] = feedback_name
-                # This matches self.timestamp_format
-                f["timestamp"] = r.timestamp.strftime("%Y-%m-%d %H:%M:%S.%f %Z")
-                f["checksum"] = r.checksum
-                feedbacks.append(f)
-
-                # Add action
-                self.log.info(
-                    f"Adding action {AssignmentActions.feedback_fetched.value} by user {this_user['id']} against assignment {assignment.id}"  # noqa: E501
-                )
-                action = Action(
-                    user_id=this_user["id"],
-                    assignment_id=assignment.id,
-                    action=AssignmentActions.feedback_fetched,
-                    location=r.location,
-                )
-                session.add(action)
-            self.finish({"success": True, "feedback": feedbacks})
+        this_user = await self.get_nbex_user()
+
+        manifest = self.get_flag("manifest")
+        # The manifest only reads; sending the files records that they were fetched
+        run_db = self.run_db_read if manifest else self.run_db
+        self.finish(await run_db(self._fetch_feedback, course_id, assignment_id, this_user, manifest))
+
+    def _fetch_feedback(self, session, course_id, assignment_id, this_user, manifest=False):
+        if manifest:
+            _, feedbacks = find_feedback(session, course_id, assignment_id, this_user, self.log)
+            return {"success": True, "feedback": [feedback_entry(r, name) for r, name in feedbacks]}
+
+        entries = []
+        for entry, location, _ in record_feedback_fetched(session, self, course_id, assignment_id, None, this_user):
+            del entry["token"]
+            entry["content"] = self.call_blocking(read_base64, self.storage, location)
+            entries.append(entry)
+        return {"success": True, "feedback": entries}
 
     @authenticated
-    def post(self):
+    async def post(self):
         """
         This endpoint accepts feedback files for a notebook.
         It requires a notebook id, student id, feedback timestamp and
@@ -134,7 +144,7 @@ class FeedbackHandler(BaseHandler):
             self.finish({"success": False, "note": note})
             return
 
-        this_user = self.nbex_user
+        this_user = await self.get_nbex_user()
 
         if course_id not in this_user["courses"]:
             note = f"User not subscribed to course {course_id}"
@@ -148,130 +158,348 @@ class FeedbackHandler(BaseHandler):
             self.finish({"success": False, "note": note})
             return
 
-        with scoped_session() as session:
-            # Start building feedback object
+        await self.run_db(
+            self._release_feedback, course_id, assignment_id, notebook_id, student_id, timestamp, checksum, this_user
+        )
+        self.finish({"success": True, "note": "Feedback released"})
 
-            course = Course.find_by_code(db=session, code=course_id, org_id=this_user["org_id"], log=self.log)
+    def _release_feedback(
+        self, session, course_id, assignment_id, notebook_id, student_id, timestamp, checksum, this_user
+    ):
+        # Start building feedback object
 
-            if not course:
-                self.log.info(f"Could not find requested resource course {course_id}")
-                raise web.HTTPError(404, f"Could not find requested resource course {course_id}")
+        course = Course.find_by_code(db=session, code=course_id, org_id=this_user["org_id"], log=self.log)
 
-            assignment = AssignmentModel.find_by_code(
-                db=session,
-                code=assignment_id,
-                course_id=course.id,
-                action=AssignmentActions.released.value,
-            )
+        if not course:
+            self.log.info(f"Could not find requested resource course {course_id}")
+            raise web.HTTPError(404, f"Could not find requested resource course {course_id}")
 
-            if not assignment:
-                note = f"Could not find requested resource assignment {assignment_id}"
-                self.log.info(note)
-                raise web.HTTPError(404, note)
-
-            notebook = Notebook.find_by_name(db=session, name=notebook_id, assignment_id=assignment.id, log=self.log)
-            if not notebook:
-                note = f"Could not find requested resource notebook {notebook_id}"
-                self.log.info(note)
-                raise web.HTTPError(404, note)
-
-            student = User.find_by_name(db=session, name=student_id, log=self.log)
-
-            if not student:
-                note = f"Could not find requested resource student {student_id}"
-                self.log.info(note)
-                raise web.HTTPError(404, note)
-
-            # TODO: check access. Is the user an instructor on the course to which the notebook belongs
-
-            # Check whether there is an HTML file attached to the request
-            if not self.request.files:
-                self.log.warning("Error: No file supplied in upload")  # TODO: improve error message
-                raise web.HTTPError(412)  # precondition failed
-
-            try:
-                # Grab the file
-                file_info = self.request.files["feedback"][0]
-                filename, content_type = (
-                    file_info["filename"],
-                    file_info["content_type"],
-                )
-                note = f"Received file {filename}, of type {content_type}"
-                self.log.info(note)
-                fbfile = tempfile.NamedTemporaryFile()
-                fbfile.write(file_info["body"])
-                fbfile.seek(0)
-
-            except Exception as e:
-                # Could not grab the feedback file
-                self.log.error(f"Error: {e}")
-                raise web.HTTPError(412)
-            # TODO: should we check the checksum?
-            # unique_key = make_unique_key(
-            #     course_id,
-            #     assignment_id,
-            #     notebook_id,
-            #     student_id,
-            #     str(timestamp).strip(),
-            # )
-            # check_checksum = notebook_hash(fbfile.name, unique_key)
-            #
-            # if check_checksum != checksum:
-            #     self.log.info(f"Checksum {checksum} does not match {check_checksum}")
-            #     raise web.HTTPError(403, f"Checksum {checksum} does not match {check_checksum}")
-
-            # TODO: What is file of the original notebook we are getting the feedback for?
-            # assignment_dir = "collected/student_id/assignment_name"
-            # nbfile = os.path.join(assignment_dir, "{}.ipynb".format(notebook.name))
-            # calc_checksum = notebook_hash(nbfile.name, unique_key)
-            # if calc_checksum != checksum:
-            #     self.log.info(f"Mismatched checksums {calc_checksum} and {checksum}.")
-            #     raise web.HTTPError(412)
-
-            location = "/".join(
-                [
-                    self.base_storage_location,
-                    str(this_user["org_id"]),
-                    "feedback",
-                    notebook.assignment.course.course_code,
-                    notebook.assignment.assignment_code,
-                    str(int(time.time())),
-                ]
-            )
+        assignment = AssignmentModel.find_by_code(
+            db=session,
+            code=assignment_id,
+            course_id=course.id,
+            action=AssignmentActions.released.value,
+        )
+
+        if not assignment:
+            note = f"Could not find requested resource assignment {assignment_id}"
+            self.log.info(note)
+            raise web.HTTPError(404, note)
+
+        notebook = Notebook.find_by_name(db=session, name=notebook_id, assignment_id=assignment.id, log=self.log)
+        if not notebook:
+            note = f"Could not find requested resource notebook {notebook_id}"
+            self.log.info(note)
+            raise web.HTTPError(404, note)
+
+        student = User.find_by_name(db=session, name=student_id, log=self.log)
+
+        if not student:
+            note = f"Could not find requested resource student {student_id}"
+            self.log.info(note)
+            raise web.HTTPError(404, note)
 
-            # This should be abstracted, so it can be overloaded to store in other manners (eg AWS)
-            feedback_file = location + "/" + checksum + ".html"
-
-            try:
-                # Ensure the directory exists
-                os.makedirs(os.path.dirname(feedback_file), exist_ok=True)
-                with open(feedback_file, "w+b") as handle:
-                    handle.write(file_info["body"])
-            except Exception as e:
-                self.log.error(f"Could not save file. \n {e}")
-                raise web.HTTPError(500)
-
-            feedback = Feedback(
-                notebook_id=notebook.id,
-                checksum=checksum,
-                location=feedback_file,
-                student_id=student.id,
-                instructor_id=this_user.get("id"),
-                timestamp=parser.parse(timestamp),
+        # TODO: check access. Is the user an instructor on the course to which the notebook belongs
+
+        # Check whether there is an HTML file attached to the request
+        if not self.request.files:
+            self.log.warning("Error: No file supplied in upload")  # TODO: improve error message
+            raise web.HTTPError(412)  # precondition failed
+
+        try:
+            # Grab the file
+            file_info = self.request.files["feedback"][0]
+            filename, content_type = (
+                file_info["filename"],
+                file_info["content_type"],
             )
+            note = f"Received file {filename}, of type {content_type}"
+            self.log.info(note)
+        except Exception as e:
+            # Could not grab the feedback file
+            self.log.error(f"Error: {e}")
+            raise web.HTTPError(412)
+        # TODO: should we check the checksum?
+
+        # Stored by its contents (see StorageBackend), so identical feedback is only stored once
+        try:
+            feedback_file, _ = self.call_blocking(self.storage.put, file_info["body"])
+        except Exception as e:
+            self.log.error(f"Could not save file. \n {e}")
+            raise web.HTTPError(500)
+
+        feedback = Feedback(
+            notebook_id=notebook.id,
+            checksum=checksum,
+            location=feedback_file,
+            student_id=student.id,
+            instructor_id=this_user.get("id"),
+            timestamp=parser.parse(timestamp),
+        )
 
-            session.add(feedback)
+        session.add(feedback)
 
-            # Add action
-            self.log.info(
-                f"Adding action {AssignmentActions.feedback_released.value} by user {this_user['id']}, for student {student.id}, against assignment {assignment.id}"  # noqa: E501
+        # Add action
+        self.log.info(
+            f"Adding action {AssignmentActions.feedback_released.value} by user {this_user['id']}, for student {student.id}, against assignment {assignment.id}"  # noqa: E501
+        )
+        action = Action(
+            user_id=this_user["id"],
+            assignment_id=notebook.assignment.id,
+            action=AssignmentActions.feedback_released,
+            location=feedback_file,
+        )
+        session.add(action)
+
+
+class FeedbackDownload(BaseHandler):
+    """.../feedback/download
+    parmas:
+        course_id: course_code
+        assignment_id: assignment_code
+        token: the token of one of the user's feedback files (from GET .../feedback?manifest=true)
+
+    GET: Downloads that feedback file
+    """
+
+    urls = ["feedback/download"]
+
+    @authenticated
+    async def get(self):
+        [course_id, assignment_id, token] = self.get_params(["course_id", "assignment_id", "token"])
+
+        if not (course_id and assignment_id and token):
+            note = "Feedback download requires a course id, an assignment id and a token"
+            self.log.info(note)
+            self.finish({"success": False, "note": note})
+            return
+
+        this_user = await self.get_nbex_user()
+
+        result, fetched = await self.run_db(feedback_fetched, self, course_id, assignment_id, [token], this_user)
+        if not result:
+            note = "Feedback not found"
+            self.log.info(note)
+            self.finish({"success": False, "note": note})
+            return
+
+        [(_, location, released)] = result
+        self.set_header("Content-Type", "text/html")
+        await self.stream_file(location, modified=released, actions=fetched)
+
+    # This has no authentiction wrapper, so false implication os service
+    def post(self):
+        raise web.HTTPError(501)
+
+
+class FeedbackArchive(BaseHandler):
+    """.../feedback/archive
+    parmas:
+        course_id: course_code
+        assignment_id: assignment_code
+
+    GET: Downloads all the user's feedback files for the assignment as a single tar.
+    The first member is "manifest.json", a list of
+        {"filename", "timestamp", "checksum", "token", "member"}
+    one for each of the other members: the feedback file, named "member" ("timestamp/filename", with the timestamp
+    as "YYYY-MM-DDTHH-MM-SS.ffffff").
+    """
+
+    urls = ["feedback/archive"]
+
+    @authenticated
+    async def get(self):
+        [course_id, assignment_id] = self.get_params(["course_id", "assignment_id"])
+
+        if not (course_id and assignment_id):
+            note = "Feedback archive requires a course id and an assignment id"
+            self.log.info(note)
+            self.finish({"success": False, "note": note})
+            return
+
+        this_user = await self.get_nbex_user()
+
+        result = await self.run_db(record_feedback_fetched, self, course_id, assignment_id, None, this_user)
+        manifest, members = [], []
+        for entry, location, released in result:
+            stored = await self.run_blocking(self.storage.stat, location)
+            entry["member"] = archive_member(released, entry["filename"])
+            manifest.append(entry)
+            members.append(tarstream.Member(entry["member"], stored.size, stored.modified, location))
+        manifest = json.dumps(manifest).encode("utf-8")
+        members.insert(0, tarstream.Member("manifest.json", len(manifest), time.time(), manifest))
+        await self.stream_tar(f"{course_id}-{assignment_id}-feedback.tar", members)
+
+    # This has no authentiction wrapper, so false implication os service
+    def post(self):
+        raise web.HTTPError(501)
+
+
+class FeedbackBatch(UploadHandler):
+    """.../feedback/batch
+    parmas:
+        course_id: course_code
+        assignment_id: assignment_code
+
+    POST: (role=instructor, multipart/form-data) releases any number of feedback files for an assignment.
+    The nth "feedback" file is described by the nth "manifest" field: a json object of
+        {"notebook", "student", "timestamp", "checksum"}
+    as the params of a single POST .../feedback.
+
+    Nothing is recorded unless every notebook & student is found.
+    """
+
+    urls = ["feedback/batch"]
+
+    # This has no authentiction wrapper, so false implication os service
+    def get(self):
+        raise web.HTTPError(501)
+
+    async def prepare_upload(self):
+        [course_id, assignment_id] = self.get_params(["course_id", "assignment_id"])
+        if not (course_id and assignment_id):
+            note = "Feedback batch call requires a course id and an assignment id"
+            self.log.info(note)
+            self.finish({"success": False, "note": note})
+            return False
+
+        this_user = await self.get_nbex_user()
+
+        if course_id not in this_user["courses"]:
+            note = f"User not subscribed to course {course_id}"
+            self.log.info(note)
+            self.finish({"success": False, "note": note})
+            return False
+
+        if "instructor" != this_user["current_role"].casefold():  # we may need to revisit this
+            note = f"User not an instructor to course {course_id}"
+            self.log.info(note)
+            self.finish({"success": False, "note": note})
+            return False
+
+        return True
+
+    @authenticated
+    async def post(self):
+        [course_id, assignment_id] = self.get_params(["course_id", "assignment_id"])
+        this_user = await self.get_nbex_user()
+
+        # The files have been streamed to storage by now (see UploadHandler)
+        uploads = await self.uploaded_files("feedback")
+        if uploads is None:
+            return
+
+        required = ("notebook", "student", "timestamp", "checksum")
+        try:
+            manifest = [json.loads(entry) for entry in self.get_arguments("manifest")]
+            valid = len(manifest) == len(uploads) and all(all(entry.get(key) for key in required) for entry in manifest)
+        except (ValueError, AttributeError):
+            valid = False
+        if not valid:
+            note = f"Each feedback file needs a manifest entry, with: {', '.join(required)}"
+            self.log.info(note)
+            self.finish({"success": False, "note": note})
+            return
+
+        self.finish(
+            await self.run_db(self._release_batch, course_id, assignment_id, list(zip(manifest, uploads)), this_user)
+        )
+
+    def _release_batch(self, session, course_id, assignment_id, released, this_user):
+        course = Course.find_by_code(db=session, code=course_id, org_id=this_user["org_id"], log=self.log)
+        if not course:
+            self.log.info(f"Could not find requested resource course {course_id}")
+            raise web.HTTPError(404, f"Could not find requested resource course {course_id}")
+
+        assignment = AssignmentModel.find_by_code(
+            db=session,
+            code=assignment_id,
+            course_id=course.id,
+            action=AssignmentActions.released.value,
+        )
+        if not assignment:
+            note = f"Could not find requested resource assignment {assignment_id}"
+            self.log.info(note)
+            raise web.HTTPError(404, note)
+
+        # All the notebooks, and all the students, in one query each
+        notebook_names = {entry["notebook"] for entry, _ in released}
+        notebooks = {
+            notebook.name: notebook
+            for notebook in session.query(Notebook).filter(
+                Notebook.assignment_id == assignment.id, Notebook.name.in_(notebook_names)
+            )
+        }
+        student_names = {entry["student"] for entry, _ in released}
+        students = {
+            user.name: user
+            for user in session.query(User).filter(User.name.in_(student_names), User.org_id == course.org_id)
+        }
+
+        missing_notebooks = sorted(notebook_names - set(notebooks))
+        missing_students = sorted(student_names - set(students))
+        if missing_notebooks or missing_students:
+            note = f"Could not find requested resources: notebooks {missing_notebooks}, students {missing_students}"
+            self.log.info(note)
+            return {"success": False, "note": note}
+
+        feedbacks, actions = [], []
+        for entry, upload in released:
+            feedbacks.append(
+                {
+                    "notebook_id": notebooks[entry["notebook"]].id,
+                    "checksum": entry["checksum"],
+                    "location": upload["path"],
+                    "student_id": students[entry["student"]].id,
+                    "instructor_id": this_user.get("id"),
+                    "timestamp": parser.parse(entry["timestamp"]),
+                }
             )
-            action = Action(
-                user_id=this_user["id"],
-                assignment_id=notebook.assignment.id,
-                action=AssignmentActions.feedback_released,
-                location=feedback_file,
+            actions.append(
+                {
+                    "user_id": this_user["id"],
+                    "assignment_id": assignment.id,
+                    "action": AssignmentActions.feedback_released,
+                    "location": upload["path"],
+                }
             )
-            session.add(action)
 
-        self.finish({"success": True, "note": "Feedback released"})
+        self.log.info(
+            f"Adding {len(actions)} actions {AssignmentActions.feedback_released.value} by user {this_user['id']} against assignment {assignment.id}"  # noqa: E501
+        )
+        session.bulk_insert_mappings(Feedback, feedbacks)
+        Action.insert_many(session, actions)
+        return {"success": True, "note": f"Feedback released ({len(feedbacks)} files)"}
+
+
+def feedback_fetched(session, handler, course_id, assignment_id, tokens, this_user):
+    """This user's feedback (just the pieces with these `tokens`, unless None), and the fetches to record
+
+    Returns the manifest entry, location & timestamp of each piece, and the feedback_fetched actions
+    """
+    assignment, feedbacks = find_feedback(session, course_id, assignment_id, this_user, handler.log)
+    if tokens is not None:
+        feedbacks = [(r, name) for r, name in feedbacks if str(r.id) in tokens]
+    fetched = [
+        {
+            "user_id": this_user["id"],
+            "assignment_id": assignment.id,
+            "action": AssignmentActions.feedback_fetched,
+            "location": r.location,
+        }
+        for r, _ in feedbacks
+    ]
+    return [(feedback_entry(r, name), r.location, r.timestamp) for r, name in feedbacks], fetched
+
+
+def record_feedback_fetched(session, handler, course_id, assignment_id, tokens, this_user):
+    """Record the fetching of this user's feedback (just the pieces with these `tokens`, unless None), in one insert
+
+    Returns the manifest entry, location & timestamp of each piece
+    """
+    result, fetched = feedback_fetched(session, handler, course_id, assignment_id, tokens, this_user)
+    handler.log.info(
+        f"Adding {len(fetched)} actions {AssignmentActions.feedback_fetched.value} by user {this_user['id']}"
+    )
+    handler.record_actions(session, fetched)
+    return result
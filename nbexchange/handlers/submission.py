@@ -1,11 +1,6 @@
-import os
-import time
-import uuid
-
 from tornado import web
 
-from nbexchange.database import scoped_session
-from nbexchange.handlers.base import BaseHandler, authenticated
+from nbexchange.handlers.base import BaseHandler, UploadHandler, authenticated
 from nbexchange.models.actions import Action, AssignmentActions
 from nbexchange.models.assignments import Assignment
 from nbexchange.models.courses import Course
@@ -18,7 +13,7 @@ This relys on users being logged in, and the user-object having additional data:
 """
 
 
-class Submission(BaseHandler):
+class Submission(UploadHandler):
     """.../submisssion/
     parmas:
         course_id: course_code
@@ -28,21 +23,14 @@ class Submission(BaseHandler):
 
     urls = ["submission"]
 
+    oversize_note = "File upload oversize, and rejected. Please reduce the files in your submission and try again."
+
     # This has no authentiction wrapper, so false implication os service
     def get(self):
         raise web.HTTPError(501)
 
     # This is a student submitting an assignment, not an instructor "release"
-    @authenticated
-    def post(self):
-        if "Content-Length" in self.request.headers and int(self.request.headers["Content-Length"]) > int(
-            self.max_buffer_size
-        ):
-            note = "File upload oversize, and rejected. Please reduce the files in your submission and try again."
-            self.log.info(note)
-            self.finish({"success": False, "note": note})
-            return
-
+    async def prepare_upload(self):
         [course_code, assignment_code] = self.get_params(["course_id", "assignment_id"])
         self.log.debug(
             f"Called POST /submission with arguments: course {course_code} and  assignment {assignment_code}"
@@ -51,108 +39,92 @@ class Submission(BaseHandler):
             note = "Submission call requires both a course code and an assignment code"
             self.log.info(note)
             self.finish({"success": False, "note": note})
-            return
+            return False
 
-        this_user = self.nbex_user
+        this_user = await self.get_nbex_user()
 
         if course_code not in this_user["courses"]:
             note = f"User not subscribed to course {course_code}"
             self.log.info(note)
             self.finish({"success": False, "note": note})
+            return False
+
+        # No point taking the upload if it can't be recorded
+        if not await self.run_db(self._find_assignment, course_code, assignment_code, this_user):
+            note = f"User not fetched assignment {assignment_code}"
+            self.log.info(note)
+            self.finish({"success": False, "note": note})
+            return False
+
+        return True
+
+    @authenticated
+    async def post(self):
+        [course_code, assignment_code] = self.get_params(["course_id", "assignment_id"])
+        this_user = await self.get_nbex_user()
+
+        # The body has been streamed to disk by now (see UploadHandler)
+        upload = await self.uploaded_file("assignment")
+        if upload is None:
             return
 
+        # Submissions are stored by their contents (see StorageBackend): a user can submit multiple
+        # times and we have all copies, but identical submissions are only stored once
+        result = await self.run_db(
+            self._submit_assignment, course_code, assignment_code, this_user, upload["path"], upload["sha256"]
+        )
+        self.finish(result)
+
+    def _find_assignment(self, session, course_code, assignment_code, this_user):
+        course = Course.find_by_code(db=session, code=course_code, org_id=this_user["org_id"], log=self.log)
+        return course is not None and bool(
+            Assignment.find_by_code(db=session, code=assignment_code, course_id=course.id)
+        )
+
+    def _submit_assignment(self, session, course_code, assignment_code, this_user, release_file, checksum):
         # The course will exist: the user object creates it if it doesn't exist
         #  - and we know the user is subscribed to the course as an instructor (above)
-        with scoped_session() as session:
-            course = Course.find_by_code(db=session, code=course_code, org_id=this_user["org_id"], log=self.log)
-
-            # We need to find this assignment, or make a new one.
-            assignment = Assignment.find_by_code(db=session, code=assignment_code, course_id=course.id)
-            if assignment is None:
-                note = f"User not fetched assignment {assignment_code}"
-                self.log.info(note)
-                self.finish({"success": False, "note": note})
-                return
-
-            # storage is dynamically in $path/submitted/$course_code/$assignment_code/$username/<timestamp>/
-            # Note - this means that a user can submit multiple times, and we have all copies
-            release_file = "/".join(
-                [
-                    self.base_storage_location,
-                    str(this_user["org_id"]),
-                    AssignmentActions.submitted.value,
-                    course_code,
-                    assignment_code,
-                    this_user["name"],
-                    str(int(time.time())),
-                ]
-            )
-
-            if not self.request.files:
-                self.log.warning("Error: No file supplies in upload")  # TODO: improve error message
-                raise web.HTTPError(412)  # precondition failed
-
-            try:
-                # Write the uploaded file to the desired location
-                file_info = self.request.files["assignment"][0]
-
-                filename, content_type = (
-                    file_info["filename"],
-                    file_info["content_type"],
-                )
-                note = f"Received file {filename}, of type {content_type}"
-                self.log.info(note)
-                extn = os.path.splitext(filename)[1]
-                cname = str(uuid.uuid4()) + extn
-
-                # store to disk.
-                # This should be abstracted, so it can be overloaded to store in other manners (eg AWS)
-                release_file = release_file + "/" + cname
-                # Ensure the directory exists
-                os.makedirs(os.path.dirname(release_file), exist_ok=True)
-                with open(release_file, "w+b") as handle:
-                    handle.write(file_info["body"])
-
-            except Exception as e:  # TODO: exception handling
-                self.log.warning(f"Error: {e}")  # TODO: improve error message
-
-                self.log.info("Upload failed")
-                # error 500??
-                raise web.HTTPError(418)
-
-            # Check the file exists on disk
-            if not (
-                os.path.exists(release_file) and os.access(release_file, os.R_OK) and os.path.getsize(release_file) > 0
-            ):
-                note = "File upload failed."
-                self.log.info(note)
-                self.finish({"success": False, "note": note})
-                return
-
-            # We shouldn't need this, but it's good to double-check
-            if os.path.getsize(release_file) > self.max_buffer_size:
-                os.remove(release_file)
-                note = "File upload oversize, and rejected. Please reduce the files in your submission and try again."
-                self.log.info(note)
-                self.finish({"success": False, "note": note})
-                return
-
-            # now commit the assignment, and get it back to find the id
-            assignment = Assignment.find_by_code(db=session, code=assignment_code, course_id=course.id)
-
-            # Record the action.
-            # Note we record the path to the files.
-            self.log.info(
-                f"Adding action {AssignmentActions.submitted.value} for user {this_user['id']} against assignment {assignment.id}"  # noqa: E501
-            )
-            action = Action(
-                user_id=this_user["id"],
-                assignment_id=assignment.id,
-                action=AssignmentActions.submitted,
-                location=release_file,
-            )
-            session.add(action)
-        self.finish({"success": True, "note": "Submitted"})
+        course = Course.find_by_code(db=session, code=course_code, org_id=this_user["org_id"], log=self.log)
+
+        # We need to find this assignment, or make a new one.
+        assignment = Assignment.find_by_code(db=session, code=assignment_code, course_id=course.id)
+        if assignment is None:
+            note = f"User not fetched assignment {assignment_code}"
+            self.log.info(note)
+            return {"success": False, "note": note}
+
+        # Check the file made it to storage
+        try:
+            size = self.call_blocking(self.storage.stat, release_file).size
+        except FileNotFoundError:
+            size = 0
+        if not size:
+            note = "File upload failed."
+            self.log.info(note)
+            return {"success": False, "note": note}
+
+        # We shouldn't need this, but it's good to double-check
+        if size > self.max_buffer_size:
+            self.log.info(self.oversize_note)
+            return {"success": False, "note": self.oversize_note}
+
+        # now commit the assignment, and get it back to find the id
+        assignment = Assignment.find_by_code(db=session, code=assignment_code, course_id=course.id)
+
+        # Record the action.
+        # Note we record the path to the files.
+        self.log.info(
+            f"Adding action {AssignmentActions.submitted.value} for user {this_user['id']} against assignment {assignment.id}"  # noqa: E501
+        )
+        action = Action(
+            user_id=this_user["id"],
+            assignment_id=assignment.id,
+            action=AssignmentActions.submitted,
+            location=release_file,
+            checksum=checksum,
+        )
+        session.add(action)
+        return {"success": True, "note": "Submitted"}
 
 
 class Submissions(BaseHandler):
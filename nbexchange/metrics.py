@@ -0,0 +1,118 @@
+"""Prometheus metrics for the exchange
+
+These are published, along with the tornado request metrics, on `/metrics`
+
+With more than one worker process (see NbExchange.num_processes), prometheus_client must be in
+multiprocess mode - `PROMETHEUS_MULTIPROC_DIR` set, to an empty directory, before it is imported -
+so that each worker writes its metrics there, and `/metrics` adds them all up. Gauges say how their
+workers' values are combined (`multiprocess_mode`), and are `set` (a `set_function` isn't seen
+by the other workers).
+"""
+
+import glob
+import os
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    multiprocess,
+)
+from prometheus_client.exposition import choose_encoder
+from tornado.web import RequestHandler
+
+EXECUTOR_QUEUED = Gauge(
+    "nbexchange_executor_queued_tasks",
+    "Blocking (database & storage) tasks waiting for an executor thread",
+    multiprocess_mode="livesum",
+)
+EXECUTOR_ACTIVE = Gauge(
+    "nbexchange_executor_active_tasks",
+    "Blocking (database & storage) tasks currently running on an executor thread",
+    multiprocess_mode="livesum",
+)
+EXECUTOR_WAIT = Histogram(
+    "nbexchange_executor_wait_seconds",
+    "Time blocking tasks spend waiting for an executor thread",
+)
+ACTION_QUEUE_DEPTH = Gauge(
+    "nbexchange_action_queue_depth",
+    "Actions waiting to be written by the write-behind recorder (see NbExchange.action_queue_size)",
+    multiprocess_mode="livesum",
+)
+ACTION_QUEUE_LAG = Histogram(
+    "nbexchange_action_queue_lag_seconds",
+    "Time actions wait in the write-behind recorder before being written",
+)
+ACTION_QUEUE_OVERFLOWS = Counter(
+    "nbexchange_action_queue_overflows_total",
+    "Times the write-behind recorder was full, so actions were recorded with their request",
+)
+ACTION_QUEUE_DROPPED = Counter(
+    "nbexchange_action_queue_dropped_total",
+    "Actions the write-behind recorder gave up on: they can't be written, or the database was unavailable for too long",
+)
+DB_REPLICAS_HEALTHY = Gauge(
+    "nbexchange_db_replicas_healthy",
+    "Read replicas passing their health check (see NbExchange.db_replica_urls)",
+    multiprocess_mode="livemin",
+)
+DB_READS = Counter(
+    "nbexchange_db_reads_total",
+    "Read-only handler work, by where it was run (replica or primary)",
+    ["target"],
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "nbexchange_db_pool_checked_out",
+    "Database connections currently checked out of the pool",
+    multiprocess_mode="livesum",
+)
+DB_POOL_CHECKOUTS = Counter(
+    "nbexchange_db_pool_checkouts_total",
+    "Database connections checked out of the pool",
+)
+DB_POOL_CONNECTIONS = Counter(
+    "nbexchange_db_pool_connections_total",
+    "New database connections opened by the pool",
+)
+DB_POOL_TIMEOUTS = Counter(
+    "nbexchange_db_pool_timeouts_total",
+    "Times a request gave up waiting for a database connection (see NbExchange.db_pool_timeout)",
+)
+
+
+def multiprocess_dir():
+    """Where the workers write their metrics, if prometheus_client is in multiprocess mode (else None)"""
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+
+def clear_multiprocess_dir():
+    """Remove the metrics of any previous run. Before the workers start"""
+    for path in glob.glob(os.path.join(multiprocess_dir(), "*.db")):
+        os.remove(path)
+
+
+def mark_process_dead():
+    """Drop this worker's live gauges (`live*` multiprocess_mode). As it stops"""
+    if multiprocess_dir():
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def registry():
+    """The metrics to publish: this process's, or, in multiprocess mode, every worker's"""
+    if not multiprocess_dir():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+class MetricsHandler(RequestHandler):
+    """`/metrics`"""
+
+    def get(self):
+        encoder, content_type = choose_encoder(self.request.headers.get("accept"))
+        self.set_header("Content-Type", content_type)
+        self.write(encoder(registry()))
@@ -7,13 +7,59 @@ Notes:
 """
 
 # import sqlalchemy.orm as orm
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import Query, declarative_base
 
 Base = declarative_base()
 
+
+def dialect_insert(db, model):
+    """Return an `INSERT` for `model` that supports this database's upsert syntax
+
+    SQLite & Postgres have `INSERT ... ON CONFLICT`, MySQL has `INSERT ... ON DUPLICATE KEY`.
+    Returns None for any other database, so callers can fall back to find-then-insert.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+    else:
+        return None
+    return insert(model)
+
+
+def async_finder(name):
+    """Make an asyncio version of the `name` finder classmethod, for use with an AsyncSession
+
+    class Course(Base):
+        async_find_by_code = async_finder("find_by_code")
+
+    course = await Course.async_find_by_code(db=async_session, code="cool_course", org_id=1)
+
+    The finder runs with the session's sync view, so it takes exactly the same parameters.
+    Queries are returned as lists, as they can't be iterated outside the session.
+
+    Note that un-loaded relationships on the returned objects can't be lazy-loaded from
+    asyncio code: do that work inside `AsyncSession.run_sync`, or load them eagerly.
+    """
+
+    async def finder(cls, db, *args, **kwargs):
+        def _find(session):
+            result = getattr(cls, name)(session, *args, **kwargs)
+            return result.all() if isinstance(result, Query) else result
+
+        return await db.run_sync(_find)
+
+    finder.__name__ = f"async_{name}"
+    finder.__doc__ = f"asyncio version of `{name}`"
+    return classmethod(finder)
+
+
 # E402 : module level import not at top of file
 # F401 : module imported but unused
-from .actions import Action  # noqa: E402 F401
+from .actions import Action, ActionLatest  # noqa: E402 F401
 from .assignments import Assignment  # noqa: E402 F401
 from .courses import Course  # noqa: E402 F401
 from .feedback import Feedback  # noqa: E402 F401
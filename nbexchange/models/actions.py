@@ -1,10 +1,25 @@
 import enum
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, Enum, ForeignKey, Integer, Unicode
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Index,
+    Integer,
+    Unicode,
+    and_,
+    event,
+    func,
+    insert,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.orm import Session, contains_eager, joinedload, relationship
 
-from nbexchange.models import Base
+from nbexchange.models import Base, async_finder, dialect_insert
 
 
 # This is the action: a user does something with an assignment, at a given time
@@ -45,6 +60,14 @@ class Action(Base):
     """
 
     __tablename__ = "action"
+    # Action ids only ever go up, so "the actions on these assignments since action N" is a range scan
+    __table_args__ = (
+        Index("ix_action_assignment_id_id", "assignment_id", "id"),
+        # the latest action of a kind (find_most_recent_action, find_submissions)
+        Index("ix_action_assignment_id_action_id", "assignment_id", "action", "id"),
+        # the action for a file (collecting a submission)
+        Index("ix_action_assignment_id_location", "assignment_id", "location"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), index=True)
@@ -61,6 +84,22 @@ class Action(Base):
     def __repr__(self):
         return f"Assignment #{self.assignment_id} {self.action} by {self.user_id} at {self.timestamp}"
 
+    @classmethod
+    def insert_many(cls, db, actions, log=None):
+        """Record `actions` (dicts of Action columns) in one insert, keeping ActionLatest up to date
+
+        Action.insert_many(db=session, actions=[{"user_id": 1, "assignment_id": 2, "action": "fetched"}])
+
+        (`bulk_insert_mappings` skips the flush, so the flush hook that maintains ActionLatest
+        doesn't see these)
+        """
+        if log:
+            log.debug(f"Action.insert_many - {len(actions)} actions")
+        if not actions:
+            return
+        db.bulk_insert_mappings(cls, actions)
+        ActionLatest.refresh(db, [(a["assignment_id"], a["user_id"], a["action"]) for a in actions])
+
     @classmethod
     def find_by_pk(cls, db, pk, log=None):
         """Find an Action by Primary Key.
@@ -77,7 +116,7 @@ class Action(Base):
             raise TypeError("Primary Keys are required to be Ints")
 
     @classmethod
-    def find_most_recent_action(cls, db, assignment_id, action=None, log=None):
+    def find_most_recent_action(cls, db, assignment_id, action=None, log=None, location=None, user_id=None):
         """Find the most recent action for a given assignment
 
         action = orm.Action.find_most_recent_action(
@@ -87,16 +126,289 @@ class Action(Base):
         optional parameters:
             'action' Allows one to restrict the search to a specific action. Not used
                 if set to None. Defaults to None
+            'location' Allows one to restrict the search to a specific location [path]. Not used
+                if set to None. Defaults to None
+            'user_id' Restrict the search to one user's actions (only with 'location'). Not used if set
+                to None. Defaults to None
 
         Returns None if not found
         """
         if log:
-            log.debug(f"Action.find_most_recent_action - code:{assignment_id} (action:{action})")
+            log.debug(
+                f"Action.find_most_recent_action - code:{assignment_id} (action:{action}, location:{location}, "
+                f"user_id:{user_id})"
+            )
         if assignment_id is None or not isinstance(assignment_id, int):
             raise TypeError("assignment_id must be defined, and an Int")
         if action is not None and not (isinstance(action, str) or isinstance(action, AssignmentActions)):
             raise TypeError("action, if defined, must be a string")
+        if action and not location:
+            # the newest of each user's latest: one summary row per user
+            return (
+                db.query(cls)
+                .join(ActionLatest, ActionLatest.action_id == cls.id)
+                .filter(ActionLatest.assignment_id == assignment_id, ActionLatest.action == action)
+                .order_by(cls.id.desc())
+                .first()
+            )
         filters = [cls.assignment_id == assignment_id]
         if action:
             filters.append(cls.action == action)
+        if location:
+            filters.append(cls.location == location)
+        if user_id is not None:
+            filters.append(cls.user_id == user_id)
         return db.query(cls).filter(*filters).order_by(cls.id.desc()).first()
+
+    @classmethod
+    def find_for_course(
+        cls,
+        db,
+        course_id,
+        user_id,
+        active=True,
+        log=None,
+        actions=None,
+        assignment_code=None,
+        latest_only=False,
+        after_id=None,
+        feedback=False,
+    ):
+        """Find the actions a user can see on the assignments for a course: every release,
+        plus the user's own actions
+
+        actions = orm.Action.find_for_course(db=session, course_id=course.id, user_id=user.id)
+
+        Each action's assignment, and the assignment's notebooks, are loaded with it (in one
+        more query), so listing them doesn't go back to the database.
+
+        optional params:
+            'active' True/False - defaults to true
+            'actions' Restrict the search to these actions. Not used if set to None. Defaults to None
+            'assignment_code' Restrict the search to one assignment. Not used if set to None. Defaults to None
+            'latest_only' Only the most recent of each action, for each assignment. Defaults to False
+            'after_id' Only actions with a greater id (a cursor). Not used if set to None. Defaults to None
+            'feedback' Also the releases of feedback for the user (recorded as the instructor's actions).
+                Defaults to False
+
+        Returns a query, ordered by assignment (newest first) then by action
+        """
+        from nbexchange.models.assignments import Assignment
+        from nbexchange.models.feedback import Feedback
+        from nbexchange.models.notebooks import Notebook
+
+        if log:
+            log.debug(
+                f"Action.find_for_course - course_id:{course_id}, user_id:{user_id}, active:{active}, "
+                f"actions:{actions}, assignment_code:{assignment_code}, latest_only:{latest_only}, "
+                f"after_id:{after_id}, feedback:{feedback}"
+            )
+        if course_id is None or not isinstance(course_id, int):
+            raise TypeError("course_id must be defined, and an Int")
+        if after_id is not None and not isinstance(after_id, int):
+            raise TypeError("after_id, if defined, must be an Int")
+        visible = [cls.action == AssignmentActions.released, cls.user_id == user_id]
+        if feedback:
+            # The feedback_released action stored with the user's feedback (by location)
+            visible.append(
+                and_(
+                    cls.action == AssignmentActions.feedback_released,
+                    select(Feedback.id)
+                    .join(Notebook, Notebook.id == Feedback.notebook_id)
+                    .where(
+                        Feedback.student_id == user_id,
+                        Feedback.location == cls.location,
+                        Notebook.assignment_id == cls.assignment_id,
+                    )
+                    .exists(),
+                )
+            )
+        filters = [
+            Assignment.course_id == course_id,
+            Assignment.active == active,
+            or_(*visible),
+        ]
+        if actions:
+            filters.append(cls.action.in_(actions))
+        if assignment_code:
+            filters.append(Assignment.assignment_code == assignment_code)
+        if latest_only:
+            # Visible actions, other than releases, are all the user's own: so this is the
+            # latest release, and the user's latest everything else
+            latest_filters = [
+                Assignment.course_id == course_id,
+                Assignment.active == active,
+                or_(ActionLatest.action == AssignmentActions.released, ActionLatest.user_id == user_id),
+            ]
+            if actions:
+                latest_filters.append(ActionLatest.action.in_(actions))
+            if assignment_code:
+                latest_filters.append(Assignment.assignment_code == assignment_code)
+            latest = (
+                db.query(func.max(ActionLatest.action_id))
+                .join(Assignment, Assignment.id == ActionLatest.assignment_id)
+                .filter(*latest_filters)
+                .group_by(ActionLatest.assignment_id, ActionLatest.action)
+            )
+            if feedback:
+                # (all of the user's feedback: the latest feedback_released action may be for someone else's)
+                filters.append(or_(cls.id.in_(latest.scalar_subquery()), visible[-1]))
+            else:
+                filters.append(cls.id.in_(latest.scalar_subquery()))
+        if after_id is not None:
+            filters.append(cls.id > after_id)
+        return (
+            db.query(cls)
+            .join(cls.assignment)
+            .filter(*filters)
+            .options(contains_eager(cls.assignment).selectinload(Assignment.notebooks))
+            .order_by(Assignment.id.desc(), cls.id)
+        )
+
+    @classmethod
+    def find_submissions(cls, db, assignment_id, user_id=None, latest_only=False, user_ids=None, log=None):
+        """Find the submissions for an assignment, with the user who made each one
+
+        actions = orm.Action.find_submissions(db=session, assignment_id=assignment.id, latest_only=True)
+
+        optional params:
+            'user_id' Restrict the search to one user's submissions. Not used if set to None. Defaults to None
+            'latest_only' Only the most recent submission of each user. Defaults to False
+            'user_ids' Restrict the search to these users' submissions. Not used if set to None. Defaults to None
+
+        Returns a query, oldest first
+        """
+        if log:
+            log.debug(
+                f"Action.find_submissions - assignment_id:{assignment_id}, user_id:{user_id}, latest_only:{latest_only}, user_ids:{user_ids}"  # noqa: E501
+            )
+        if assignment_id is None or not isinstance(assignment_id, int):
+            raise TypeError("assignment_id must be defined, and an Int")
+        filters = [cls.assignment_id == assignment_id, cls.action == AssignmentActions.submitted]
+        if user_id is not None:
+            filters.append(cls.user_id == user_id)
+        if user_ids is not None:
+            filters.append(cls.user_id.in_(user_ids))
+        if latest_only:
+            latest_filters = [
+                ActionLatest.assignment_id == assignment_id,
+                ActionLatest.action == AssignmentActions.submitted,
+            ]
+            if user_id is not None:
+                latest_filters.append(ActionLatest.user_id == user_id)
+            if user_ids is not None:
+                latest_filters.append(ActionLatest.user_id.in_(user_ids))
+            latest = db.query(ActionLatest.action_id).filter(*latest_filters)
+            filters.append(cls.id.in_(latest.scalar_subquery()))
+        return db.query(cls).filter(*filters).options(joinedload(cls.user)).order_by(cls.id)
+
+    # asyncio versions of the finders, for use with an AsyncSession
+    async_find_by_pk = async_finder("find_by_pk")
+    async_find_most_recent_action = async_finder("find_most_recent_action")
+    async_find_for_course = async_finder("find_for_course")
+    async_find_submissions = async_finder("find_submissions")
+
+
+class ActionLatest(Base):
+    """The latest action of each kind, by each user, on each assignment
+
+    `action` only ever grows (every fetch, collection & feedback fetch adds a row), so finding
+    "the latest X" there is an ordered scan of everything that's ever happened. This has one row
+    per (assignment, user, action), pointing at the newest of those actions: finding the latest
+    is a primary key lookup.
+
+    It is kept up to date in the same transaction as the actions are recorded in: by the flush
+    hook below for `session.add(Action(...))`, and by `Action.insert_many` for bulk inserts. It can
+    be rebuilt from `action` with `python -m nbexchange.dbutil backfill-latest`.
+    """
+
+    __tablename__ = "action_latest"
+
+    # (in this order, "the latest X by anyone" is a prefix of the key)
+    assignment_id = Column(Integer, ForeignKey("assignment.id", ondelete="CASCADE"), primary_key=True)
+    action = Column(Enum(AssignmentActions), primary_key=True)
+    user_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    action_id = Column(Integer, ForeignKey("action.id", ondelete="CASCADE"), nullable=False)
+
+    latest = relationship("Action")
+
+    def __repr__(self):
+        return f"Latest {self.action} by {self.user_id} on assignment #{self.assignment_id}: action #{self.action_id}"
+
+    @classmethod
+    def _upsert_latest(cls, db, filters):
+        """Point the summary rows for the actions matching `filters` at the latest of them"""
+        latest = (
+            select(Action.assignment_id, Action.user_id, Action.action, func.max(Action.id))
+            .where(Action.assignment_id.isnot(None), Action.user_id.isnot(None), *filters)
+            .group_by(Action.assignment_id, Action.user_id, Action.action)
+        )
+        stmt = dialect_insert(db, cls)
+        if stmt is None:
+            # (this may be run mid-flush, so no ORM objects)
+            for assignment_id, user_id, action, action_id in db.execute(latest).all():
+                key = [cls.assignment_id == assignment_id, cls.user_id == user_id, cls.action == action]
+                if not db.execute(update(cls).where(*key).values(action_id=action_id)).rowcount:
+                    db.execute(
+                        insert(cls).values(
+                            assignment_id=assignment_id, user_id=user_id, action=action, action_id=action_id
+                        )
+                    )
+            return
+        stmt = stmt.from_select(["assignment_id", "user_id", "action", "action_id"], latest)
+        if db.get_bind().dialect.name == "mysql":
+            stmt = stmt.on_duplicate_key_update(action_id=func.greatest(cls.action_id, stmt.inserted.action_id))
+        else:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[cls.assignment_id, cls.action, cls.user_id],
+                set_={"action_id": stmt.excluded.action_id},
+                # A concurrent transaction may already have recorded a later one
+                where=cls.action_id < stmt.excluded.action_id,
+            )
+        db.execute(stmt)
+
+    @classmethod
+    def refresh(cls, db, keys, log=None):
+        """Bring the summary up to date for `keys`, (assignment_id, user_id, action)s just recorded in `db`
+
+        ActionLatest.refresh(db=session, keys=[(assignment.id, user.id, AssignmentActions.fetched)])
+
+        One statement, however many keys.
+        """
+        keys = {
+            (assignment_id, user_id, AssignmentActions(action))
+            for assignment_id, user_id, action in keys
+            if None not in (assignment_id, user_id, action)
+        }
+        if log:
+            log.debug(f"ActionLatest.refresh - {len(keys)} keys")
+        if not keys:
+            return
+        assignment_ids, user_ids, actions = (set(column) for column in zip(*keys))
+        # (any other combinations of these are refreshed too, which does no harm)
+        cls._upsert_latest(
+            db,
+            [Action.assignment_id.in_(assignment_ids), Action.user_id.in_(user_ids), Action.action.in_(actions)],
+        )
+
+    @classmethod
+    def rebuild(cls, db, log=None):
+        """Rebuild the whole summary from `action`. Returns the number of rows
+
+        ActionLatest.rebuild(db=session)
+        """
+        if log:
+            log.debug("ActionLatest.rebuild")
+        db.query(cls).delete(synchronize_session=False)
+        cls._upsert_latest(db, [])
+        return db.query(cls).count()
+
+
+@event.listens_for(Session, "after_flush")
+def _refresh_action_latest(session, flush_context):
+    """Keep ActionLatest up to date with the actions added to (or changed in) a session"""
+    keys = [
+        (obj.assignment_id, obj.user_id, obj.action) for obj in session.new | session.dirty if isinstance(obj, Action)
+    ]
+    if keys:
+        ActionLatest.refresh(session, keys)
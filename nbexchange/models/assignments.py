@@ -1,7 +1,7 @@
 from sqlalchemy import Boolean, Column, ForeignKey, Integer, Text, UniqueConstraint
 from sqlalchemy.orm import relationship
 
-from nbexchange.models import Base
+from nbexchange.models import Base, async_finder
 from nbexchange.models.actions import Action
 
 
@@ -121,3 +121,8 @@ class Assignment(Base):
 
     def __repr__(self):
         return f"Assignment {self.assignment_code} for course {self.course_id}"
+
+    # asyncio versions of the finders, for use with an AsyncSession
+    async_find_by_pk = async_finder("find_by_pk")
+    async_find_by_code = async_finder("find_by_code")
+    async_find_for_course = async_finder("find_for_course")
@@ -1,7 +1,7 @@
 from sqlalchemy import Column, Integer, Unicode, UniqueConstraint
 from sqlalchemy.orm import relationship
 
-from nbexchange.models import Base
+from nbexchange.models import Base, async_finder, dialect_insert
 
 
 class Course(Base):
@@ -62,6 +62,35 @@ class Course(Base):
             raise ValueError("org_id needs to be defined, and a number")
         return db.query(cls).filter(cls.course_code == code, cls.org_id == org_id).first()
 
+    @classmethod
+    def upsert(cls, db, code, org_id, title=None, log=None):
+        """Make sure a course exists.
+
+        Course.upsert(db, code="cool_course", org_id=1, title="A cool course")
+
+        The title is only set when the course is created.
+        """
+        if log:
+            log.debug(f"Course.upsert - code:{code} (org_id:{org_id})")
+        if code is None:
+            raise ValueError("code needs to be defined")
+        org_id = int(float(org_id)) if org_id else None
+        if org_id is None:
+            raise ValueError("org_id needs to be defined, and a number")
+
+        stmt = dialect_insert(db, cls)
+        if stmt is None:
+            if cls.find_by_code(db=db, code=code, org_id=org_id) is None:
+                db.add(cls(course_code=code, org_id=org_id, course_title=title))
+                db.flush()
+            return
+        stmt = stmt.values(course_code=code, org_id=org_id, course_title=title)
+        if db.get_bind().dialect.name == "mysql":
+            stmt = stmt.on_duplicate_key_update(course_code=stmt.inserted.course_code)
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[cls.course_code, cls.org_id])
+        db.execute(stmt)
+
     @classmethod
     def find_by_org(cls, db, org_id, log=None):
         """Find all courses or an organisation.
@@ -76,3 +105,8 @@ class Course(Base):
 
     def __repr__(self):
         return f"Course/{self.course_code} {self.course_title}"
+
+    # asyncio versions of the finders, for use with an AsyncSession
+    async_find_by_pk = async_finder("find_by_pk")
+    async_find_by_code = async_finder("find_by_code")
+    async_find_by_org = async_finder("find_by_org")
@@ -1,14 +1,16 @@
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, Unicode
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, Unicode, func
+from sqlalchemy.orm import contains_eager, relationship
 
-from nbexchange.models import Base
+from nbexchange.models import Base, async_finder
 from nbexchange.models.notebooks import Notebook
 
 
 class Feedback(Base):
     __tablename__ = "feedback_2"
+    # the latest feedback for a student's notebook (find_notebook_for_student, find_latest_for_student)
+    __table_args__ = (Index("ix_feedback_2_notebook_id_student_id_id", "notebook_id", "student_id", "id"),)
 
     #: Unique id of the feedback (automatically incremented)
     id = Column(Integer(), primary_key=True, autoincrement=True)
@@ -71,6 +73,34 @@ class Feedback(Base):
         filters = [cls.notebook_id == notebook_id, cls.student_id == student_id]
         return db.query(cls).filter(*filters).order_by(cls.id.desc()).first()
 
+    @classmethod
+    def find_latest_for_student(cls, db, student_id, notebook_ids, log=None):
+        """Find the most recent piece of feedback for a student, for each of a set of notebooks
+
+        feedback = orm.Feedback.find_latest_for_student(
+            db=session, student_id=some_user.id, notebook_ids=[nb.id for nb in assignment.notebooks]
+        )
+
+        This is `find_notebook_for_student` for many notebooks, in one query.
+
+        Returns a dict of notebook_id -> feedback, for the notebooks that have feedback
+        """
+        if log:
+            log.debug(f"Feedback.find_latest_for_student - student_id:{student_id}, notebook_ids:{notebook_ids}")
+        if student_id is None or not isinstance(student_id, int):
+            raise TypeError("student_id must be defined, and an Int")
+        notebook_ids = list(notebook_ids)
+        if not notebook_ids:
+            return {}
+        latest = (
+            db.query(func.max(cls.id))
+            .filter(cls.student_id == student_id, cls.notebook_id.in_(notebook_ids))
+            .group_by(cls.notebook_id)
+        )
+        return {
+            feedback.notebook_id: feedback for feedback in db.query(cls).filter(cls.id.in_(latest.scalar_subquery()))
+        }
+
     @classmethod
     def find_all_for_student(cls, db, student_id, assignment_id, log=None):
         """Find all the pieces of feedback for a student on an specified assignment
@@ -79,7 +109,9 @@ class Feedback(Base):
             db=session, assignment_id=current_assignment.id, student_id=some_user.id
         )
 
-        Returns None if not found
+        Each piece of feedback comes with its notebook (from the same query)
+
+        Returns a list, oldest first
         """
         if log:
             log.debug(f"Feedback.find_all_for_student - assignment_id:{assignment_id}, student_id:{student_id}")
@@ -91,4 +123,17 @@ class Feedback(Base):
             Notebook.assignment_id == assignment_id,
             cls.student_id == student_id,
         ]
-        return db.query(cls).join(Notebook).filter(*filters).all()
+        return (
+            db.query(cls)
+            .join(cls.notebook)
+            .options(contains_eager(cls.notebook))
+            .filter(*filters)
+            .order_by(cls.id)
+            .all()
+        )
+
+    # asyncio versions of the finders, for use with an AsyncSession
+    async_find_by_pk = async_finder("find_by_pk")
+    async_find_notebook_for_student = async_finder("find_notebook_for_student")
+    async_find_latest_for_student = async_finder("find_latest_for_student")
+    async_find_all_for_student = async_finder("find_all_for_student")
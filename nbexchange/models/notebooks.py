@@ -1,6 +1,6 @@
 from sqlalchemy import Column, ForeignKey, Integer, Unicode, UniqueConstraint
 
-from nbexchange.models import Base
+from nbexchange.models import Base, async_finder
 
 
 class Notebook(Base):
@@ -80,3 +80,8 @@ class Notebook(Base):
         return db.query(cls).filter(*filters).all()
         # I think it should be this to be safe:
         # return db.query(cls).filter(*filters).order_by(cls.id.desc()).first()
+
+    # asyncio versions of the finders, for use with an AsyncSession
+    async_find_by_pk = async_finder("find_by_pk")
+    async_find_by_name = async_finder("find_by_name")
+    async_find_all_for_assignment = async_finder("find_all_for_assignment")
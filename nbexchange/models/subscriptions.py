@@ -1,7 +1,17 @@
-from sqlalchemy import Column, ForeignKey, Integer, UnicodeText, UniqueConstraint
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Integer,
+    UnicodeText,
+    UniqueConstraint,
+    literal,
+    select,
+)
 from sqlalchemy.orm import relationship
 
-from nbexchange.models import Base
+from nbexchange.models import Base, async_finder, dialect_insert
+from nbexchange.models.courses import Course
+from nbexchange.models.users import User
 
 
 class Subscription(Base):
@@ -54,5 +64,69 @@ class Subscription(Base):
             log.debug(f"Subscription.find_by_set - user_id:{user_id}, course_id:{course_id}, role:{role}")
         return db.query(cls).filter(cls.user_id == user_id, cls.course_id == course_id, cls.role == role).first()
 
+    @classmethod
+    def upsert(cls, db, user_name, course_code, org_id, role, log=None):
+        """Make sure the named user is subscribed to the course, with the given role.
+
+        Subscription.upsert(db, user_name="1-freddy", course_code="cool_course", org_id=1, role="Student")
+
+        The user & course must already exist (see User.upsert & Course.upsert): the ids are
+        resolved inside the `INSERT`, so there's no need to look them up first.
+
+        Returns True if a new subscription was created.
+        """
+        if log:
+            log.debug(f"Subscription.upsert - user:{user_name}, course:{course_code}, org_id:{org_id}, role:{role}")
+        org_id = int(float(org_id)) if org_id else None
+        if org_id is None:
+            raise ValueError("org_id needs to be defined, and a number")
+
+        stmt = dialect_insert(db, cls)
+        if stmt is None:
+            user = db.query(User).filter(User.name == user_name, User.org_id == org_id).one()
+            course = Course.find_by_code(db=db, code=course_code, org_id=org_id)
+            if cls.find_by_set(db=db, user_id=user.id, course_id=course.id, role=role) is not None:
+                return False
+            db.add(cls(user_id=user.id, course_id=course.id, role=role))
+            db.flush()
+            return True
+
+        ids = (
+            select(User.id, Course.id, literal(role))
+            .select_from(User)
+            .join(Course, Course.org_id == User.org_id)
+            .where(User.name == user_name, User.org_id == org_id, Course.course_code == course_code)
+        )
+        stmt = stmt.from_select([cls.user_id, cls.course_id, cls.role], ids)
+        if db.get_bind().dialect.name == "mysql":
+            stmt = stmt.on_duplicate_key_update(role=stmt.inserted.role)
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[cls.user_id, cls.course_id, cls.role])
+        return db.execute(stmt).rowcount > 0
+
+    @classmethod
+    def find_roles_for_user(cls, db, user_name, org_id, log=None):
+        """Find all the course subscriptions for a user, in a single query.
+
+        rows = Subscription.find_roles_for_user(db, user_name="1-freddy", org_id=1)
+
+        Returns a list of (user_id, course_code, role) tuples.
+        """
+        if log:
+            log.debug(f"Subscription.find_roles_for_user - user:{user_name}, org_id:{org_id}")
+        org_id = int(float(org_id)) if org_id else None
+        return (
+            db.query(User.id, Course.course_code, cls.role)
+            .join(cls, cls.user_id == User.id)
+            .join(Course, Course.id == cls.course_id)
+            .filter(User.name == user_name, User.org_id == org_id)
+            .all()
+        )
+
     def __repr__(self):
         return f"Subscription for user {self.user_id} to course {self.course_id} as a {self.role}"
+
+    # asyncio versions of the finders, for use with an AsyncSession
+    async_find_by_pk = async_finder("find_by_pk")
+    async_find_by_set = async_finder("find_by_set")
+    async_find_roles_for_user = async_finder("find_roles_for_user")
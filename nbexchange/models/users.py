@@ -1,7 +1,7 @@
 from sqlalchemy import Column, Integer, Text, Unicode, UniqueConstraint
 from sqlalchemy.orm import relationship
 
-from nbexchange.models import Base
+from nbexchange.models import Base, async_finder, dialect_insert
 
 
 class User(Base):
@@ -65,6 +65,44 @@ class User(Base):
             raise ValueError("Name needs to be defined")
         return db.query(cls).filter(cls.name == name).first()
 
+    @classmethod
+    def upsert(cls, db, name, org_id, full_name=None, log=None):
+        """Make sure a user exists, and has the given full name.
+
+        User.upsert(db, name="1-freddy", org_id=1, full_name="Freddy Mercury")
+
+        Uses a single `INSERT ... ON CONFLICT` (or `ON DUPLICATE KEY`), so two
+        concurrent requests for a new user cannot collide on the unique constraint.
+        """
+        if log:
+            log.debug(f"User.upsert - name:{name}, org_id:{org_id}")
+        if name is None:
+            raise ValueError("Name needs to be defined")
+        org_id = int(float(org_id)) if org_id else None
+        if org_id is None:
+            raise ValueError("org_id needs to be defined, and a number")
+
+        stmt = dialect_insert(db, cls)
+        if stmt is None:
+            user = db.query(cls).filter(cls.name == name, cls.org_id == org_id).first()
+            if user is None:
+                user = cls(name=name, org_id=org_id)
+                db.add(user)
+            user.full_name = full_name
+            db.flush()
+            return
+        stmt = stmt.values(name=name, org_id=org_id, full_name=full_name)
+        if db.get_bind().dialect.name == "mysql":
+            stmt = stmt.on_duplicate_key_update(full_name=stmt.inserted.full_name)
+        else:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[cls.name, cls.org_id],
+                set_={"full_name": stmt.excluded.full_name},
+                # Don't re-write the row on every request
+                where=cls.full_name.is_distinct_from(stmt.excluded.full_name),
+            )
+        db.execute(stmt)
+
     @classmethod
     def find_by_org(cls, db, org_id, log=None):
         """Find all users for an organisation.
@@ -82,3 +120,8 @@ class User(Base):
 
     def __repr__(self):
         return f"User/{self.name}"
+
+    # asyncio versions of the finders, for use with an AsyncSession
+    async_find_by_pk = async_finder("find_by_pk")
+    async_find_by_name = async_finder("find_by_name")
+    async_find_by_org = async_finder("find_by_org")
@@ -0,0 +1,193 @@
+"""Incremental parsing of multipart/form-data uploads.
+
+Tornado's own multipart parsing needs the whole body in memory. This parser is
+fed the body a chunk at a time (see `tornado.web.stream_request_body`), and
+writes file parts straight to storage as they arrive - so an upload only ever
+holds about one chunk in memory, however big the file is.
+
+Form fields (eg the `notebooks` sent with a release) are small, and are kept
+in memory - up to `MAX_FIELD_SIZE` bytes each.
+"""
+
+from tornado import httputil
+
+# The most we'll hold in memory for the headers of a part, or for a form field
+MAX_FIELD_SIZE = 64 * 1024
+
+
+def boundary_for(content_type):
+    """The multipart boundary from a Content-Type header, or None if the body is not multipart/form-data"""
+    if not content_type.startswith("multipart/form-data"):
+        return None
+    for field in content_type.split(";"):
+        key, _, value = field.strip().partition("=")
+        if key == "boundary" and value:
+            if value.startswith('"') and value.endswith('"'):
+                value = value[1:-1]
+            return value.encode("latin1")
+    return None
+
+
+class MultipartStreamParser:
+    """Parse a multipart/form-data body as it arrives
+
+    parser = MultipartStreamParser(boundary, storage, max_file_size)
+    for chunk in body:
+        parser.feed(chunk)
+    parser.close()
+
+    Each file is written to the (content-addressed) `storage`, and is described in
+    `files` - including the sha256 of its contents, which is also where it is stored:
+
+        parser.files["assignment"] == [
+            {"filename": "x.gz", "content_type": "...", "path": "...", "size": 123, "sha256": "9f86d0..."}
+        ]
+
+    Form fields are collected into `arguments` (name -> list of bytes), as tornado does.
+
+    The parser never raises on bad input: it stops, discards any partly written file, and sets
+    `error` (and `oversize`, if a file was bigger than `max_file_size`). Anything fed to it
+    after that is ignored.
+    """
+
+    # states
+    PREAMBLE, DELIMITER, HEADERS, BODY, DONE = range(5)
+
+    def __init__(self, boundary, storage, max_file_size):
+        self.storage = storage
+        self.max_file_size = max_file_size
+        self.files = {}
+        self.arguments = {}
+        self.error = None
+        self.oversize = False
+
+        self._first_delimiter = b"--" + boundary
+        self._delimiter = b"\r\n--" + boundary
+        self._buffer = bytearray()
+        self._state = self.PREAMBLE
+        self._part = None  # the file being written
+        self._name = None
+        self._writer = None
+        self._field = None
+
+    @property
+    def complete(self):
+        return self._state == self.DONE
+
+    def feed(self, data):
+        if self.error or self.complete:
+            return
+        self._buffer += data
+        try:
+            self._parse()
+        except Exception as e:
+            self._fail(f"Upload failed: {e}")
+
+    def close(self):
+        """The body has ended: finish off the last file"""
+        if not (self.error or self.complete):
+            self._fail("Upload incomplete")
+
+    def discard(self):
+        """Throw away any partly written file
+
+        Completed files are stored by their contents, so may be shared with other uploads, so are kept.
+        """
+        if self._writer is not None:
+            self._writer.abort()
+            self._writer = None
+
+    def _parse(self):
+        while True:
+            if self._state == self.PREAMBLE:
+                index = self._buffer.find(self._first_delimiter)
+                if index == -1:
+                    # keep just enough to spot a delimiter split over two chunks
+                    del self._buffer[: -len(self._first_delimiter)]
+                    return
+                del self._buffer[: index + len(self._first_delimiter)]
+                self._state = self.DELIMITER
+
+            elif self._state == self.DELIMITER:
+                if len(self._buffer) < 2:
+                    return
+                if self._buffer[:2] == b"--":
+                    self._state = self.DONE
+                    self._buffer.clear()
+                    return
+                if self._buffer[:2] != b"\r\n":
+                    raise ValueError("malformed delimiter")
+                del self._buffer[:2]
+                self._state = self.HEADERS
+
+            elif self._state == self.HEADERS:
+                index = self._buffer.find(b"\r\n\r\n")
+                if index == -1:
+                    if len(self._buffer) > MAX_FIELD_SIZE:
+                        raise ValueError("part headers too large")
+                    return
+                headers = httputil.HTTPHeaders.parse(self._buffer[:index].decode("utf-8"))
+                del self._buffer[: index + 4]
+                self._start_part(headers)
+                self._state = self.BODY
+
+            elif self._state == self.BODY:
+                index = self._buffer.find(self._delimiter)
+                if index == -1:
+                    # write everything that can't be the start of the delimiter
+                    safe = len(self._buffer) - len(self._delimiter) + 1
+                    if safe > 0:
+                        self._write(self._buffer[:safe])
+                        del self._buffer[:safe]
+                    return
+                self._write(self._buffer[:index])
+                del self._buffer[: index + len(self._delimiter)]
+                self._end_part()
+                self._state = self.DELIMITER
+
+    def _start_part(self, headers):
+        disposition, params = httputil._parse_header(headers.get("Content-Disposition", ""))
+        if disposition != "form-data" or not params.get("name"):
+            raise ValueError("part is not form-data")
+        name = params["name"]
+        if "filename" in params:
+            self._name = name
+            self._writer = self.storage.writer()
+            self._part = {
+                "filename": params["filename"],
+                "content_type": headers.get("Content-Type", "application/unknown"),
+                "size": 0,
+            }
+        else:
+            self._field = (name, bytearray())
+
+    def _write(self, data):
+        if not data:
+            return
+        if self._writer is not None:
+            self._part["size"] += len(data)
+            if self._part["size"] > self.max_file_size:
+                self.oversize = True
+                raise ValueError("file too large")
+            self._writer.write(data)
+        else:
+            value = self._field[1]
+            value += data
+            if len(value) > MAX_FIELD_SIZE:
+                raise ValueError(f"form field {self._field[0]} too large")
+
+    def _end_part(self):
+        if self._writer is not None:
+            self._part["path"] = self._writer.commit()
+            self._part["sha256"] = self._writer.digest
+            self.files.setdefault(self._name, []).append(self._part)
+            self._writer = None
+        else:
+            name, value = self._field
+            self.arguments.setdefault(name, []).append(bytes(value))
+        self._part = self._field = None
+
+    def _fail(self, error):
+        self.error = error
+        self._buffer.clear()
+        self.discard()
@@ -7,11 +7,20 @@ from urllib.parse import quote_plus
 
 import nbgrader.exchange.abc as abc
 from nbgrader.api import Gradebook, MissingEntry
+from traitlets import Bool
 
 from .exchange import Exchange
 
 
 class ExchangeCollect(abc.ExchangeCollect, Exchange):
+    use_archive = Bool(
+        False,
+        help="""
+Download all the submissions being collected in one request (from `collections/archive`),
+rather than one request per submission. Needs an exchange new enough to have the archive
+""",
+    ).tag(config=True)
+
     def do_copy(self, src, dest):
         pass
 
@@ -27,7 +36,7 @@ class ExchangeCollect(abc.ExchangeCollect, Exchange):
     def download(self, submission, dest_path):
         self.log.debug(f"ExchangeCollect.download - record {submission} to {dest_path}")
         r = self.api_request(
-            f"collection?course_id={quote_plus(self.coursedir.course_id)}&assignment_id={quote_plus(self.coursedir.assignment_id)}&path={quote_plus(submission['path'])}"  # noqa: E501
+            f"collection?course_id={quote_plus(self.coursedir.course_id)}&assignment_id={quote_plus(self.coursedir.assignment_id)}&path={quote_plus(submission['path'])}&user_id={quote_plus(submission['student_id'])}"  # noqa: E501
         )
         self.log.debug(f"Got back {r.status_code}  {r.headers['content-type']} after file download")
 
@@ -74,6 +83,8 @@ class ExchangeCollect(abc.ExchangeCollect, Exchange):
         url = f"collections?course_id={quote_plus(self.coursedir.course_id)}&assignment_id={quote_plus(self.coursedir.assignment_id)}"  # noqa: E501
         if self.coursedir.student_id != "*":
             url = url + f"&user_id={quote_plus(self.coursedir.student_id)}"
+        # Only the latest submission of each student is collected (as with nbgrader's own exchange)
+        url = url + "&latest_only=true"
         r = self.api_request(url)
 
         self.log.debug(f"Got back {r} when listing collectable assignments")
@@ -100,6 +111,7 @@ class ExchangeCollect(abc.ExchangeCollect, Exchange):
                 f"Processing {len(submissions)} submissions of '{self.coursedir.assignment_id}' for course '{self.coursedir.course_id}'"  # noqa: E501
             )
 
+        pending = {}  # student_id: local_dest_path, for the archive
         for submission in submissions:
             student_id = submission["student_id"]
             full_name = submission.get("full_name") or ""
@@ -153,7 +165,10 @@ class ExchangeCollect(abc.ExchangeCollect, Exchange):
                             self.log.info(
                                 f"Unable to update: {student_id} with first_name={first_name}, last_name={last_name}"
                             )
-                    self.download(submission, local_dest_path)
+                    if self.use_archive:
+                        pending[student_id] = local_dest_path
+                    else:
+                        self.download(submission, local_dest_path)
                 else:
                     if self.update:
                         self.log.info(f"No newer submission to collect: {student_id} {self.coursedir.assignment_id}")
@@ -162,5 +177,62 @@ class ExchangeCollect(abc.ExchangeCollect, Exchange):
                             f"Submission already exists, use --update to update: {student_id} {self.coursedir.assignment_id}"  # noqa: E501
                         )
 
+        if pending:
+            self.download_archive(pending)
+
+    def download_archive(self, pending):
+        """Download the submissions of the students in `pending` (student_id: dest_path) as one archive
+
+        The archive is read as it arrives, and each submission unpacked into its dest_path.
+        A submission that can't be unpacked, or isn't in the archive, is logged and left uncollected.
+        """
+        self.log.debug(f"ExchangeCollect.download_archive - {len(pending)} submissions")
+        url = f"collections/archive?course_id={quote_plus(self.coursedir.course_id)}&assignment_id={quote_plus(self.coursedir.assignment_id)}"  # noqa: E501
+        url = url + "".join(f"&user_id={quote_plus(student_id)}" for student_id in pending)
+        r = self.api_request(url, stream=True)
+        self.log.debug(f"Got back {r.status_code}  {r.headers['content-type']} after archive download")
+
+        if r.status_code > 399:
+            self.fail(
+                f"Error failing to collect for assignment {self.coursedir.assignment_id} on course {self.coursedir.course_id}: status code {r.status_code}: error {r.content}"  # noqa: E501
+            )
+
+        if r.headers["content-type"] != "application/x-tar":
+            data = r.json()
+            self.fail(
+                f"Error failing to collect for assignment {self.coursedir.assignment_id} on course {self.coursedir.course_id}: {data.get('note')}"  # noqa: E501
+            )
+
+        try:
+            with tarfile.open(fileobj=r.raw, mode="r|") as archive:
+                members = {}
+                found = set()
+                for member in archive:
+                    if member.name == "manifest.json":
+                        manifest = json.load(archive.extractfile(member))
+                        members = {entry["member"]: entry for entry in manifest}
+                        continue
+                    student_id = members.get(member.name, {}).get("student_id")
+                    if student_id not in pending:
+                        self.log.warning(f"Skipping {member.name}: not a submission we asked for")
+                        continue
+                    self.log.debug(f"ExchangeCollect.download_archive - {student_id} to {pending[student_id]}")
+                    found.add(student_id)
+                    try:
+                        with tarfile.open(fileobj=archive.extractfile(member), mode="r|*") as handle:
+                            handle.extractall(path=pending[student_id])
+                    except tarfile.TarError as e:
+                        self.log.warning(f"Unable to unpack the submission of {student_id}: {e}")
+                        # (so that it's collected next time)
+                        shutil.rmtree(pending[student_id], ignore_errors=True)
+        except Exception as e:  # TODO: exception handling
+            self.fail(
+                f"Error unpacking download for {self.coursedir.assignment_id} on course {self.coursedir.course_id}: {e}"  # noqa: E501
+            )
+
+        for student_id in pending:
+            if student_id not in found:
+                self.log.warning(f"No submission for {student_id} in the download: not collected")
+
     def copy_files(self):
         self.do_collect()
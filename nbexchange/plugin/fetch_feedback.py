@@ -1,5 +1,9 @@
 import base64
+import io
+import json
 import os
+import shutil
+import tarfile
 from urllib.parse import quote_plus
 
 import nbgrader.exchange.abc as abc
@@ -26,35 +30,68 @@ class ExchangeFetchFeedback(abc.ExchangeFetchFeedback, Exchange):
     def download(self):
         self.log.debug(f"Download feedback for {quote_plus(self.coursedir.notebook_id)} from {self.service_url}")
         r = self.api_request(
-            f"feedback?course_id={quote_plus(self.coursedir.course_id)}&assignment_id={quote_plus(self.coursedir.assignment_id)}"  # noqa: E501
+            f"feedback?course_id={quote_plus(self.coursedir.course_id)}&assignment_id={quote_plus(self.coursedir.assignment_id)}&manifest=true"  # noqa: E501
         )
         self.log.debug(f"Got back {r.status_code} {r.headers['content-type']} after file download")
         content = r.json()
 
         # Feedback, here, is the time the feedback was generated, not the time of the submission
         if "feedback" in content:
-            for f in content["feedback"]:
-                self.log.debug(f"##### fetch-feedback.download has {f['filename']}, {f['timestamp']}")
-                try:
-                    # This matches nb_timestamp in list.parse_assignments, "status" == "submitted"
-                    # The format should match the nbgrader default "%Y-%m-%d %H:%M:%S.%f %Z"
-                    # timestamp = (
-                    #     parser.parse(str(f["timestamp"]))
-                    #     .strftime(self.timestamp_format)
-                    #     .strip()
-                    # )
-                    timestamp = f["timestamp"]
-                    os.makedirs(os.path.join(self.dest_path, timestamp), exist_ok=True)
-                    self.log.debug(
-                        f"##### fetch-feedback.download writing to {os.path.join(self.dest_path, timestamp)}"
-                    )
-                    with open(os.path.join(self.dest_path, timestamp, f["filename"]), "wb") as handle:
-                        handle.write(base64.b64decode(f["content"]))
-                except Exception as e:  # TODO: exception handling
-                    self.fail(str(e))
+            if any("content" in f for f in content["feedback"]):
+                # An older exchange, which sends the files in the listing
+                for f in content["feedback"]:
+                    self.write_feedback(f)
+            elif content["feedback"]:
+                self.download_archive()
         else:
             self.fail(content.get("note", "could not get feedback"))
 
+    def download_archive(self):
+        """Download all the feedback files as one archive, writing each one as it arrives"""
+        r = self.api_request(
+            f"feedback/archive?course_id={quote_plus(self.coursedir.course_id)}&assignment_id={quote_plus(self.coursedir.assignment_id)}",  # noqa: E501
+            stream=True,
+        )
+        self.log.debug(f"Got back {r.status_code} {r.headers['content-type']} after archive download")
+        if r.status_code > 399 or r.headers["content-type"] != "application/x-tar":
+            self.fail(f"Error fetching feedback for {self.coursedir.assignment_id}: status code {r.status_code}")
+
+        try:
+            with tarfile.open(fileobj=r.raw, mode="r|") as archive:
+                manifest = {}
+                for member in archive:
+                    if member.name == "manifest.json":
+                        manifest = {f["member"]: f for f in json.load(archive.extractfile(member))}
+                        continue
+                    self.write_feedback(manifest[member.name], archive.extractfile(member))
+        except Exception as e:  # TODO: exception handling
+            self.fail(str(e))
+
+    def write_feedback(self, f, source=None):
+        """Write the feedback file described by `f` (filename & timestamp), reading it from `source`
+
+        (or from its base64 "content", if there's no `source`)
+        """
+        self.log.debug(f"##### fetch-feedback.download has {f['filename']}, {f['timestamp']}")
+        try:
+            # This matches nb_timestamp in list.parse_assignments, "status" == "submitted"
+            # The format should match the nbgrader default "%Y-%m-%d %H:%M:%S.%f %Z"
+            # timestamp = (
+            #     parser.parse(str(f["timestamp"]))
+            #     .strftime(self.timestamp_format)
+            #     .strip()
+            # )
+            timestamp = f["timestamp"]
+            if source is None:
+                source = io.BytesIO(base64.b64decode(f["content"]))
+            os.makedirs(os.path.join(self.dest_path, timestamp), exist_ok=True)
+            self.log.debug(f"##### fetch-feedback.download writing to {os.path.join(self.dest_path, timestamp)}")
+            # Just the name: nothing is written outside the feedback directory
+            with open(os.path.join(self.dest_path, timestamp, os.path.basename(f["filename"])), "wb") as handle:
+                shutil.copyfileobj(source, handle)
+        except Exception as e:  # TODO: exception handling
+            self.fail(str(e))
+
     def copy_files(self):
         self.log.debug(f"Destination: {self.dest_path}")
         self.download()
@@ -1,7 +1,7 @@
 import glob
 import json
 import os
-from urllib.parse import quote_plus
+from urllib.parse import quote_plus, urlencode
 
 import nbgrader.exchange.abc as abc
 from traitlets import Unicode
@@ -25,21 +25,24 @@ class ExchangeList(abc.ExchangeList, Exchange):
     # (eg removed 'released' items if the 'fetched' item is on disk)
     seen_assignments = {"fetched": [], "collected": []}
 
-    def query_exchange(self):
+    def query_exchange(self, **params):
         """
         This queries the database for all the assignments for a course
 
-        if self.inbound or self.cached are true, it returns all the 'submitted'
-        items, else it returns all the 'released' ones.
-
-        (it doesn't care about feedback or collected actions)
+        `params` are passed on as filters (eg `status="released"`, `assignment_id=...`, `latest_only=True`),
+        so the exchange only sends back what's needed. Older exchanges ignore them, so callers
+        still check what they get back.
         """
+        query = urlencode(
+            {key: str(value).lower() if isinstance(value, bool) else value for key, value in params.items()}
+        )
         if self.coursedir.course_id:
             """List assignments for specific course"""
-            r = self.api_request(f"assignments?course_id={quote_plus(self.coursedir.course_id)}")
+            url = f"assignments?course_id={quote_plus(self.coursedir.course_id)}"
+            r = self.api_request(f"{url}&{query}" if query else url)
         else:
             """List assignments for all courses"""
-            r = self.api_request("assignments")
+            r = self.api_request(f"assignments?{query}" if query else "assignments")
 
         self.log.debug(f"Got back {r} when listing assignments")
 
@@ -59,7 +62,9 @@ class ExchangeList(abc.ExchangeList, Exchange):
     def init_dest(self):
         self.assignments = []
 
-        exchange_listed_assignments = self.query_exchange()
+        exchange_listed_assignments = self.query_exchange(
+            status="submitted" if self.inbound or self.cached else "released"
+        )
         self.log.debug(f"ExternalExchange.list.init_dest collected {exchange_listed_assignments}")
 
         # if "inbound", looking for inbound (submitted) records
@@ -112,8 +117,10 @@ class ExchangeList(abc.ExchangeList, Exchange):
         self.assignments = []
         held_assignments = {"fetched": {}, "released": {}}
 
-        # Get a list of everything from the exchange
-        exchange_listed_assignments = self.query_exchange()
+        # Get a list of what we're after from the exchange
+        exchange_listed_assignments = self.query_exchange(
+            status="submitted" if self.inbound or self.cached else "released"
+        )
 
         # if "inbound" or "cached" are true, we're looking for inbound
         #  (submitted) records else we're looking for outbound (released)
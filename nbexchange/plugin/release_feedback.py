@@ -7,6 +7,7 @@ from urllib.parse import quote_plus
 import nbgrader.exchange.abc as abc
 from dateutil import parser
 from nbgrader.utils import make_unique_key, notebook_hash
+from traitlets import Integer
 
 from .exchange import Exchange
 
@@ -14,6 +15,14 @@ from .exchange import Exchange
 class ExchangeReleaseFeedback(abc.ExchangeReleaseFeedback, Exchange):
     src_path = None
 
+    feedback_batch_size = Integer(
+        100,
+        help="""
+The most feedback files to send in one request (to `feedback/batch`).
+0 sends each file in a request of its own - as it is, anyway, to an exchange without `feedback/batch`
+""",
+    ).tag(config=True)
+
     # where the downloaded files are placed
     def init_src(self):
         student_id = self.coursedir.student_id if self.coursedir.student_id else "*"
@@ -38,6 +47,7 @@ class ExchangeReleaseFeedback(abc.ExchangeReleaseFeedback, Exchange):
         else:
             exclude_students = set()
 
+        releases = []
         html_files = glob.glob(os.path.join(self.src_path, "*.html"))
         for html_file in html_files:
             regexp = re.escape(os.path.sep).join(
@@ -99,6 +109,18 @@ class ExchangeReleaseFeedback(abc.ExchangeReleaseFeedback, Exchange):
                 )
             )
 
+            releases.append((html_file, student_id, notebook_id, timestamp, checksum))
+
+        if self.feedback_batch_size > 0:
+            for start in range(0, len(releases), self.feedback_batch_size):
+                if not self.upload_batch(releases[start : start + self.feedback_batch_size]):  # noqa: E203
+                    self.log.info("The exchange does not take batches of feedback: sending each file on its own")
+                    releases = releases[start:]
+                    break
+            else:
+                return
+
+        for html_file, student_id, notebook_id, timestamp, checksum in releases:
             self.upload(
                 html_file,
                 self.coursedir.assignment_id,
@@ -134,3 +156,39 @@ class ExchangeReleaseFeedback(abc.ExchangeReleaseFeedback, Exchange):
             self.fail(data["note"])
 
         self.log.info("Successfully uploaded feedback for assignment.")
+
+    def upload_batch(self, releases):
+        """Send the feedback files in `releases` in one request
+
+        Returns False, without sending anything, if the exchange doesn't have `feedback/batch`
+        """
+        files = []
+        manifest = []
+        for html_file, student, notebook, timestamp, checksum in releases:
+            with open(html_file) as feedback_file:
+                files.append(("feedback", ("feedback.html", feedback_file.read())))
+            manifest.append(
+                json.dumps({"notebook": notebook, "student": student, "timestamp": timestamp, "checksum": checksum})
+            )
+
+        url = (
+            f"feedback/batch?course_id={quote_plus(self.coursedir.course_id)}"
+            f"&assignment_id={quote_plus(self.coursedir.assignment_id)}"
+        )
+
+        r = self.api_request(url, method="POST", data={"manifest": manifest}, files=files)
+
+        self.log.debug(f"Got back {r.status_code} after feedback batch upload")
+        if r.status_code == 404:
+            return False
+
+        try:
+            data = r.json()
+        except json.decoder.JSONDecodeError:
+            self.fail(r.text)
+
+        if not data["success"]:
+            self.fail(data["note"])
+
+        self.log.info(f"Successfully uploaded {len(releases)} pieces of feedback for assignment.")
+        return True
@@ -67,7 +67,9 @@ class ExchangeSubmit(abc.ExchangeSubmit, Exchange):
         # List of filenames, no paths
         released_notebooks = []
 
-        assignments = ExchangeList.query_exchange(self)
+        assignments = ExchangeList.query_exchange(
+            self, assignment_id=self.coursedir.assignment_id, status="released", latest_only=True
+        )
         latest_timestamp = "1990-01-01 00:00:00"
         for assignment in assignments:
             # We want the last released version of this assignments
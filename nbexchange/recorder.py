@@ -0,0 +1,137 @@
+"""Write-behind recording of actions (see NbExchange.action_queue_size)
+
+Downloads record an action (`fetched`, `collected`, `feedback_fetched`) - which, recorded with the
+request, makes every download a write transaction, and on SQLite puts every download in line for
+the one writer. With a recorder, the actions are queued in memory instead, and written a batch at
+a time in the background (and when the exchange stops):
+
+    recorder = ActionRecorder(maxsize=10000, batch_size=500, executor=executor)
+    if not recorder.record([{"user_id": 1, "assignment_id": 2, "action": AssignmentActions.fetched}]):
+        ...  # the queue is full: record them some other way
+    await recorder.flush_async()
+
+Actions are timestamped when they are queued, not when they are written. Actions still queued if
+the process dies are lost.
+
+The exchange does read these actions back, so queueing them leaves a gap between a download and
+its being seen: until the flush, the action is missing from `GET /assignments` listings (including
+the user's own), from `action_latest`, and from polls with `since`. It is given its action_id when
+it is written, so a poller's `high_water_mark` doesn't pass over it - the next poll after the flush
+lists it - but it can be listed after actions with later timestamps.
+"""
+
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import exc
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+
+from nbexchange import metrics
+from nbexchange.database import scoped_session
+from nbexchange.models.actions import Action
+
+
+class ActionRecorder:
+    """A bounded queue of actions (dicts of Action columns), written to the database in batches"""
+
+    def __init__(self, maxsize, batch_size=500, max_retries=60, executor=None, log=None):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.executor = executor
+        self.log = log or app_log
+        self._lock = threading.Lock()
+        self._pending = deque()  # (queued at, action, failed attempts)
+        metrics.ACTION_QUEUE_DEPTH.set(0)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def record(self, actions):
+        """Queue `actions` to be written. Thread-safe.
+
+        Returns False, and queues none of them, if they don't all fit in the queue
+        """
+        timestamp = datetime.utcnow()
+        queued_at = time.monotonic()
+        with self._lock:
+            if len(self._pending) + len(actions) > self.maxsize:
+                metrics.ACTION_QUEUE_OVERFLOWS.inc()
+                return False
+            self._pending.extend((queued_at, dict({"timestamp": timestamp}, **action), 0) for action in actions)
+            metrics.ACTION_QUEUE_DEPTH.set(len(self._pending))
+        return True
+
+    def _take(self):
+        with self._lock:
+            batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            metrics.ACTION_QUEUE_DEPTH.set(len(self._pending))
+        return batch
+
+    def _write(self, batch):
+        with scoped_session() as session:
+            Action.insert_many(session, [action for _, action, _ in batch])
+        written_at = time.monotonic()
+        for queued_at, _, _ in batch:
+            metrics.ACTION_QUEUE_LAG.observe(written_at - queued_at)
+
+    def _drop(self, entries, reason):
+        for _, action, _ in entries:
+            self.log.error(f"Dropped queued action {action} ({reason})")
+        metrics.ACTION_QUEUE_DROPPED.inc(len(entries))
+
+    def _retry(self, batch):
+        """Put `batch` back at the front of the queue, less any actions that have been tried max_retries times"""
+        retry = [(queued_at, action, failures + 1) for queued_at, action, failures in batch]
+        self._drop([entry for entry in retry if entry[2] > self.max_retries], "the database is unavailable")
+        with self._lock:
+            self._pending.extendleft(reversed([entry for entry in retry if entry[2] <= self.max_retries]))
+            metrics.ACTION_QUEUE_DEPTH.set(len(self._pending))
+
+    def flush(self):
+        """Write everything queued, a batch (and a transaction) at a time. Blocking.
+
+        If the database can't be reached (or is locked), the batch is put back, to be tried again on the next
+        flush (up to max_retries times). If anything else goes wrong, the batch is written an action at a time,
+        and the actions that can never be written (eg their assignment has since been deleted) are dropped -
+        so they don't hold up everything queued behind them.
+        Returns the number of actions written
+        """
+        written = 0
+        while True:
+            batch = self._take()
+            if not batch:
+                return written
+            try:
+                self._write(batch)
+                written += len(batch)
+                continue
+            except Exception as e:
+                if _transient(e):
+                    self.log.exception(f"Failed to record {len(batch)} actions: will try again")
+                    self._retry(batch)
+                    return written
+                self.log.warning(f"Failed to record {len(batch)} actions together ({e}): recording them one by one")
+            for i, entry in enumerate(batch):
+                try:
+                    self._write([entry])
+                    written += 1
+                except Exception as e:
+                    if _transient(e):
+                        self.log.exception(f"Failed to record {len(batch) - i} actions: will try again")
+                        self._retry(batch[i:])
+                        return written
+                    self._drop([entry], e)
+
+    async def flush_async(self):
+        """`flush`, on the executor"""
+        if self._pending:
+            await IOLoop.current().run_in_executor(self.executor, self.flush)
+
+
+def _transient(e):
+    """Whether a failure to write is worth trying again: the database can't be reached, or is locked"""
+    return isinstance(e, exc.OperationalError) or getattr(e, "connection_invalidated", False)
@@ -0,0 +1,136 @@
+"""Read replicas of the database (see NbExchange.db_replica_urls)
+
+The listings (`/assignments`, `/collections`, `/feedback?manifest=true`) only read, so on a database
+with replicas (eg Postgres streaming replication) they can be served from a replica, taking load off
+the primary:
+
+    replicas = ReplicaSet(["postgresql://replica-1/nbexchange", "postgresql://replica-2/nbexchange"])
+    replica = replicas.choose()  # round-robin over the healthy replicas; None if there are none
+    with replica.session() as session:
+        ...
+    replicas.check()  # periodically: a replica that fails is out of rotation until it passes again
+
+Replicas lag the primary, so a user who has just written (submitted, say) may not see it on a replica.
+Handlers note who has written recently (`note_writer`), and send those users' reads to the primary for
+a while (`recently_wrote`).
+"""
+
+import itertools
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session, sessionmaker
+from tornado.log import app_log
+
+from nbexchange import metrics
+from nbexchange.cache import LRUCache
+from nbexchange.dbutil import engine_kwargs
+
+# Users who have written recently, keyed on (name, org_id).
+# Configured by the application (see NbExchange.db_replica_lag)
+recent_writers = LRUCache(maxsize=0, ttl=0)
+
+
+def note_writer(user):
+    """Note that `user` (a hub user) has just written to the primary"""
+    if user:
+        recent_writers.set((user.get("name"), user.get("org_id", 1)), True)
+
+
+def recently_wrote(user):
+    """Has `user` written recently enough that a replica may not have caught up?"""
+    return bool(user) and recent_writers.get((user.get("name"), user.get("org_id", 1))) is not None
+
+
+def wrote(session):
+    """Did `session` write anything?
+
+    Flushes, and statements run with `session.execute` that change rows, are seen. `bulk_insert_mappings`
+    isn't, on its own (`Action.insert_many` follows it with a statement that is).
+    """
+    return session.info.get("wrote", False)
+
+
+@event.listens_for(Session, "after_flush")
+def _note_flush(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _note_execute(orm_execute_state):
+    if orm_execute_state.is_select:
+        return None
+    result = orm_execute_state.invoke_statement()
+    # An upsert that changed nothing (the user we already had, say) isn't a write
+    if result.rowcount != 0:
+        orm_execute_state.session.info["wrote"] = True
+    return result
+
+
+class Replica:
+    """One read replica"""
+
+    def __init__(self, url, **kwargs):
+        self.url = url
+        self.engine = create_engine(url, **engine_kwargs(url, **kwargs))
+        self.Session = sessionmaker(bind=self.engine)
+        self.healthy = True
+
+    def __repr__(self):
+        return f"Replica {self.engine.url!r}"
+
+    @contextmanager
+    def session(self):
+        """A session on the replica, for reading: it is never committed"""
+        session = self.Session()
+        try:
+            yield session
+        finally:
+            session.rollback()
+            session.close()
+
+    def check(self):
+        """Can the replica answer a query? Blocking"""
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(select(1))
+        except Exception as e:
+            if self.healthy:
+                app_log.warning(f"{self} failed its health check, and is out of rotation: {e}")
+            self.healthy = False
+        else:
+            if not self.healthy:
+                app_log.info(f"{self} passed its health check, and is back in rotation")
+            self.healthy = True
+        return self.healthy
+
+
+class ReplicaSet:
+    """The read replicas, used round-robin. `kwargs` are the engine settings (see dbutil.engine_kwargs)"""
+
+    def __init__(self, urls, **kwargs):
+        self.replicas = [Replica(url, **kwargs) for url in urls]
+        self._turn = itertools.count()
+        metrics.DB_REPLICAS_HEALTHY.set(len(self.replicas))
+
+    def __len__(self):
+        return len(self.replicas)
+
+    def choose(self):
+        """The next healthy replica, or None if none of them are"""
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        # (a replica that failed a read is taken out of rotation by the handler)
+        metrics.DB_REPLICAS_HEALTHY.set(len(healthy))
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+    def check(self):
+        """Health-check every replica. Blocking. Returns the number that are healthy"""
+        healthy = sum(replica.check() for replica in self.replicas)
+        metrics.DB_REPLICAS_HEALTHY.set(healthy)
+        return healthy
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
@@ -0,0 +1,10 @@
+"""Storage for uploaded files (see NbExchange.storage_class)
+
+`LocalStorage` keeps files on a filesystem; `nbexchange.storage.s3.S3Storage` keeps them in an
+S3-compatible object store, so replicas of the exchange needn't share a mount.
+"""
+
+from nbexchange.storage.base import StorageBackend, StoredFile
+from nbexchange.storage.local import LocalStorage
+
+__all__ = ["LocalStorage", "StorageBackend", "StoredFile"]
@@ -0,0 +1,112 @@
+"""The interface every storage backend implements"""
+
+import hashlib
+from collections import namedtuple
+
+from traitlets import Integer
+from traitlets.config import LoggingConfigurable
+
+# What `StorageBackend.stat` knows about a stored file: its size in bytes, and when it was
+# stored (as a unix timestamp)
+StoredFile = namedtuple("StoredFile", ["size", "modified"])
+
+
+class StorageBackend(LoggingConfigurable):
+    """Where the exchange keeps uploaded files (see NbExchange.storage_class)
+
+    Files are content-addressed: each is stored once, at a location derived from the sha256 of
+    its contents (`location_for`), so the same upload twice stores nothing new. A location is
+    an opaque string, recorded against actions & feedback in the database.
+
+    All methods block, and are run on the thread pool by the handlers.
+    """
+
+    read_chunk_size = Integer(
+        64 * 1024, help="The size, in bytes, of the blocks read when checksumming a stored file"
+    ).tag(config=True)
+
+    def location_for(self, digest):
+        """The location of the file whose contents have the sha256 `digest`"""
+        raise NotImplementedError()
+
+    def writer(self):
+        """A writer for a new file, to be written a chunk at a time:
+
+        writer = storage.writer()
+        writer.write(chunk)
+        ...
+        location = writer.commit()  # or writer.abort()
+
+        After `commit`, `writer.digest` is the sha256 of the contents & `writer.size` their length.
+        If the file is already stored, nothing new is kept.
+        """
+        raise NotImplementedError()
+
+    def get(self, location, start=0):
+        """Open a stored file for reading, from byte `start`
+
+        Returns a binary file-like object (with `read(size)` & `close()`). The caller closes it.
+        Raises FileNotFoundError if there is no such file.
+        """
+        raise NotImplementedError()
+
+    def stat(self, location):
+        """The `StoredFile` for `location`. Raises FileNotFoundError if there is no such file."""
+        raise NotImplementedError()
+
+    def delete(self, location):
+        """Remove a stored file
+
+        Files may be shared by any number of actions & feedback, so only remove one nothing refers to.
+        """
+        raise NotImplementedError()
+
+    def locations(self):
+        """Every file in the store, as (location, `StoredFile`) pairs
+
+        Just the content-addressed files: not files stored elsewhere by earlier versions of the exchange.
+        """
+        raise NotImplementedError()
+
+    def exists(self, location):
+        try:
+            self.stat(location)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, data):
+        """Store `data` (bytes), returning the location & digest of the file
+
+        The digest is known up-front, so nothing is written if the file is already stored.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        location = self.location_for(digest)
+        if not self.exists(location):
+            writer = self.writer()
+            try:
+                writer.write(data)
+            except Exception:
+                writer.abort()
+                raise
+            writer.commit()
+        return location, digest
+
+    def read(self, location):
+        """The whole contents of a (small) stored file"""
+        handle = self.get(location)
+        try:
+            return handle.read()
+        finally:
+            handle.close()
+
+    def checksum(self, location):
+        """The sha256 of a stored file's contents, for files stored before checksums were recorded"""
+        digest = hashlib.sha256()
+        handle = self.get(location)
+        try:
+            for chunk in iter(lambda: handle.read(self.read_chunk_size), b""):
+                digest.update(chunk)
+        finally:
+            handle.close()
+        return digest.hexdigest()
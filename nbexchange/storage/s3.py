@@ -0,0 +1,198 @@
+"""Content-addressed storage in an S3-compatible object store (AWS S3, MinIO, Ceph...)
+
+Every file is stored once, under the sha256 of its contents:
+
+    s3://<bucket>/<prefix>/blobs/<first two characters of the digest>/<digest>
+
+Uploads are streamed: they are sent to a temporary object, `part_size` bytes at a time, as a
+multipart upload - so an upload holds at most one part in memory - and then copied to their
+blob (unless it already exists), and the temporary object removed. Files smaller than one part
+are sent in one request, straight to their blob.
+
+Replicas of the exchange share the bucket, rather than a filesystem.
+
+Needs `boto3` (`pip install nbexchange[s3]`). Credentials are found the usual boto3 ways
+(environment, shared config, instance roles), or can be given in `client_kwargs`.
+"""
+
+import hashlib
+import uuid
+
+from traitlets import Dict, Integer, Unicode, validate
+
+from nbexchange.storage.base import StorageBackend, StoredFile
+
+# S3 won't accept multipart uploads with (non-final) parts smaller than this
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class S3Writer:
+    """Write a new object, a part at a time (see `StorageBackend.writer`)"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.size = 0
+        self.digest = None
+        self._hash = hashlib.sha256()
+        self._buffer = bytearray()
+        self._tmp_key = storage.key(f"tmp/{uuid.uuid4()}")
+        self._upload_id = None
+        self._parts = []
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        self._buffer += data
+        if len(self._buffer) >= self.storage.part_size:
+            self._upload_part()
+
+    def _upload_part(self):
+        client = self.storage.client
+        if self._upload_id is None:
+            response = client.create_multipart_upload(Bucket=self.storage.bucket, Key=self._tmp_key)
+            self._upload_id = response["UploadId"]
+        part_number = len(self._parts) + 1
+        response = client.upload_part(
+            Bucket=self.storage.bucket,
+            Key=self._tmp_key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=bytes(self._buffer),
+        )
+        self._parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self._buffer.clear()
+
+    def commit(self):
+        """Store the object, and return its location. If the object already exists, nothing new is stored."""
+        client = self.storage.client
+        bucket = self.storage.bucket
+        self.digest = self._hash.hexdigest()
+        location = self.storage.location_for(self.digest)
+        key = self.storage.key_for(self.digest)
+
+        if self._upload_id is None:
+            # Small enough to send in one go
+            if not self.storage.exists(location):
+                client.put_object(Bucket=bucket, Key=key, Body=bytes(self._buffer))
+            self._buffer.clear()
+            return location
+
+        if self._buffer:
+            self._upload_part()
+        client.complete_multipart_upload(
+            Bucket=bucket, Key=self._tmp_key, UploadId=self._upload_id, MultipartUpload={"Parts": self._parts}
+        )
+        self._upload_id = None
+        try:
+            if not self.storage.exists(location):
+                # a managed copy: itself multipart, for objects over 5GB
+                client.copy({"Bucket": bucket, "Key": self._tmp_key}, bucket, key)
+        finally:
+            client.delete_object(Bucket=bucket, Key=self._tmp_key)
+        return location
+
+    def abort(self):
+        """Throw away what has been written"""
+        self._buffer.clear()
+        if self._upload_id is not None:
+            self.storage.client.abort_multipart_upload(
+                Bucket=self.storage.bucket, Key=self._tmp_key, UploadId=self._upload_id
+            )
+            self._upload_id = None
+
+
+class S3Storage(StorageBackend):
+    """Content-addressed objects, in an S3 bucket"""
+
+    bucket = Unicode(help="The bucket files are stored in. It must already exist.").tag(config=True)
+
+    prefix = Unicode("nbexchange", help="The key prefix for everything the exchange stores in the bucket").tag(
+        config=True
+    )
+
+    endpoint_url = Unicode(
+        None, allow_none=True, help="The URL of an S3-compatible service (eg MinIO). Defaults to AWS S3."
+    ).tag(config=True)
+
+    region_name = Unicode(None, allow_none=True, help="The region of the bucket").tag(config=True)
+
+    client_kwargs = Dict(
+        help="""Any other kwargs to pass to the S3 client (eg credentials).
+        See boto3.client for details.
+        """
+    ).tag(config=True)
+
+    part_size = Integer(
+        8 * 1024 * 1024,
+        help="""The size, in bytes, of each part of a multipart upload (at least 5MB).
+
+        This is the most memory an upload holds at once.
+        """,
+    ).tag(config=True)
+
+    @validate("part_size")
+    def _validate_part_size(self, proposal):
+        if proposal["value"] < MIN_PART_SIZE:
+            raise ValueError(f"part_size must be at least {MIN_PART_SIZE} bytes")
+        return proposal["value"]
+
+    _client = None
+
+    @property
+    def client(self):
+        # boto3 clients are thread-safe, so one is shared by the whole thread pool
+        if self._client is None:
+            import boto3
+
+            self._client = boto3.client(
+                "s3", endpoint_url=self.endpoint_url, region_name=self.region_name, **self.client_kwargs
+            )
+        return self._client
+
+    def key(self, name):
+        return f"{self.prefix.strip('/')}/{name}" if self.prefix.strip("/") else name
+
+    def key_for(self, digest):
+        return self.key(f"blobs/{digest[:2]}/{digest}")
+
+    def location_for(self, digest):
+        return f"s3://{self.bucket}/{self.key_for(digest)}"
+
+    def _split(self, location):
+        bucket, _, key = location[len("s3://") :].partition("/")
+        if not location.startswith("s3://") or not key:
+            raise FileNotFoundError(f"Not an S3 location: {location}")
+        return bucket, key
+
+    def writer(self):
+        return S3Writer(self)
+
+    def get(self, location, start=0):
+        bucket, key = self._split(location)
+        kwargs = {"Range": f"bytes={start}-"} if start else {}
+        try:
+            response = self.client.get_object(Bucket=bucket, Key=key, **kwargs)
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(location)
+        return response["Body"]
+
+    def stat(self, location):
+        bucket, key = self._split(location)
+        try:
+            response = self.client.head_object(Bucket=bucket, Key=key)
+        except self.client.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                raise FileNotFoundError(location)
+            raise
+        return StoredFile(size=response["ContentLength"], modified=response["LastModified"].timestamp())
+
+    def locations(self):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.key("blobs/")):
+            for item in page.get("Contents", []):
+                location = f"s3://{self.bucket}/{item['Key']}"
+                yield location, StoredFile(size=item["Size"], modified=item["LastModified"].timestamp())
+
+    def delete(self, location):
+        bucket, key = self._split(location)
+        self.client.delete_object(Bucket=bucket, Key=key)
@@ -0,0 +1,39 @@
+"""Building tar archives as they are sent.
+
+A tar is a header block for each member, followed by its contents padded to a whole
+number of blocks, and then an end-of-archive marker - so it can be sent a member (and a
+block) at a time, without ever being put together in memory or on disk. Knowing each
+member's size up-front also gives the size of the whole archive:
+
+    members = [tarstream.Member("manifest.json", len(manifest), now, manifest), ...]
+    length = tarstream.archive_size(members)
+"""
+
+import tarfile
+from collections import namedtuple
+
+# `source` is either the contents (bytes), or the storage location of the contents
+Member = namedtuple("Member", ["name", "size", "mtime", "source"])
+
+END_OF_ARCHIVE = b"\0" * (2 * tarfile.BLOCKSIZE)
+
+
+def header(member):
+    """The header block(s) for `member`"""
+    info = tarfile.TarInfo(member.name)
+    info.size = member.size
+    info.mtime = int(member.mtime)
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def padding(size):
+    """The zeros that pad `size` bytes of contents out to a whole block"""
+    return b"\0" * (-size % tarfile.BLOCKSIZE)
+
+
+def archive_size(members):
+    """The size of the tar of `members`"""
+    return sum(len(header(member)) + member.size + len(padding(member.size)) for member in members) + len(
+        END_OF_ARCHIVE
+    )
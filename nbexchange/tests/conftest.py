@@ -10,8 +10,10 @@ from tornado import ioloop
 from traitlets.config.loader import PyFileConfigLoader
 
 import nbexchange.models.users
+from nbexchange import database, dbutil
 from nbexchange.app import NbExchange
 from nbexchange.database import Session
+from nbexchange.tests.utils import capture_statements
 
 here = os.path.abspath(os.path.dirname(__file__))
 root = os.path.join(here, os.pardir, os.pardir)
@@ -38,6 +40,12 @@ def io_loop(request):
     return io_loop
 
 
+@pytest.fixture(scope="session", autouse=True)
+def _database():
+    """The database engine, shared by every test (and every app they start)"""
+    return dbutil.setup_db(NbExchange.class_traits()["db_url"].default_value, log=logger)
+
+
 @pytest.fixture(scope="session")
 def _nbexchange_config():
     """Load the nbexchange configuration
@@ -89,6 +97,18 @@ def db():
     return _db
 
 
+@pytest.fixture
+def count_queries():
+    """Collect the SQL statements the exchange runs
+
+    with count_queries() as statements:
+        r = yield async_requests.get(app.url + "/assignments?course_id=course_2")
+    assert len(statements) == 4
+    """
+    # (the engine is looked up when it's used: starting the app sets it up)
+    return lambda: capture_statements(database.engine)
+
+
 # Docker images
 nbexchange_image = build(path=".")
 container = container(image="{nbexchange_image.id}", ports={"9000/tcp": None})
@@ -0,0 +1,103 @@
+import logging
+import os
+
+from mock import patch
+
+from nbexchange.cache import LRUCache
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.ERROR)
+
+
+def test_cache_get_and_set():
+    cache = LRUCache(maxsize=2, ttl=60)
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # "b" is now the least recently used
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_cache_entries_expire():
+    cache = LRUCache(maxsize=2, ttl=60)
+    with patch("nbexchange.cache.time.monotonic", return_value=1000):
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=5)
+    with patch("nbexchange.cache.time.monotonic", return_value=1010):
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+    with patch("nbexchange.cache.time.monotonic", return_value=1061):
+        assert cache.get("a") is None
+
+
+def test_cache_entry_ttl_cannot_extend_cache_ttl():
+    cache = LRUCache(maxsize=2, ttl=10)
+    with patch("nbexchange.cache.time.monotonic", return_value=1000):
+        cache.set("a", 1, ttl=500)
+    with patch("nbexchange.cache.time.monotonic", return_value=1011):
+        assert cache.get("a") is None
+
+
+def test_cache_disabled():
+    for cache in [LRUCache(maxsize=0, ttl=60), LRUCache(maxsize=10, ttl=0)]:
+        cache.set("a", 1)
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+
+def test_cache_discard_where_and_configure():
+    cache = LRUCache(maxsize=10, ttl=60)
+    cache.set("a", {"id": 1})
+    cache.set("b", {"id": 2})
+    cache.discard_where(lambda value: value["id"] == 1)
+    assert cache.get("a") is None
+    assert cache.get("b") == {"id": 2}
+    cache.configure(maxsize=5, ttl=30)
+    assert len(cache) == 0
+    assert cache.maxsize == 5
+    assert cache.ttl == 30
+
+
+# A value read while the cache was invalidated isn't stored
+def test_cache_set_skipped_if_invalidated_since():
+    cache = LRUCache(maxsize=10, ttl=60)
+    generation = cache.generation
+    cache.set("a", 1, generation=generation)
+    assert cache.get("a") == 1
+    generation = cache.generation
+    cache.discard_where(lambda value: value == 1)
+    cache.set("a", 1, generation=generation)
+    assert cache.get("a") is None
+    cache.set("a", 1, generation=cache.generation)
+    assert cache.get("a") == 1
+
+
+# A shared cache's invalidations, in a forked process, empty it in the others
+def test_cache_shared_with_forked_processes():
+    cache = LRUCache(maxsize=10, ttl=60)
+    cache.share()
+    cache.set("a", 1)
+    cache.set("b", 2)
+    pid = os.fork()
+    if pid == 0:
+        cache.discard_where(lambda value: value == 1)
+        os._exit(0 if cache.get("b") == 2 else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    # (it can't tell which entries the other process's invalidation was about)
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    cache.set("b", 2)
+    assert cache.get("b") == 2
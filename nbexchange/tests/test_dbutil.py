@@ -1,5 +1,228 @@
-from nbexchange import dbutil
+import os
+import time
+from subprocess import check_call
+
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, inspect, select
+from sqlalchemy.pool import NullPool, QueuePool, StaticPool
+
+from nbexchange import database, dbutil
+from nbexchange.app import NbExchange
+from nbexchange.models import Base
+from nbexchange.storage import LocalStorage
 
 
 def test_dbutil():
     dbutil.main()
+
+
+def test_engine_kwargs():
+    # one in-memory database, shared by every thread: no pool to tune
+    kwargs = dbutil.engine_kwargs("sqlite:///:memory:", pool_size=20)
+    assert kwargs["poolclass"] is StaticPool
+    assert "pool_size" not in kwargs
+
+    kwargs = dbutil.engine_kwargs("sqlite:////srv/nbexchange.sqlite", pool_size=20, pool_timeout=5)
+    assert kwargs["poolclass"] is QueuePool
+    assert (kwargs["pool_size"], kwargs["pool_timeout"], kwargs["pool_recycle"]) == (20, 5, -1)
+
+    assert dbutil.engine_kwargs("mysql://u:p@host/db")["pool_recycle"] == 60
+    assert dbutil.engine_kwargs("mysql://u:p@host/db", pool_recycle=300)["pool_recycle"] == 300
+    kwargs = dbutil.engine_kwargs("postgresql://u:p@host/db", pool_size=20, poolclass=NullPool)
+    assert "pool_size" not in kwargs
+    assert kwargs["pool_pre_ping"] is True
+
+    # db_kwargs take priority over the db_pool_* settings
+    kwargs = NbExchange(db_pool_size=20, db_kwargs={"pool_size": 3}).engine_kwargs()
+    assert dbutil.engine_kwargs("postgresql://u:p@host/db", **kwargs)["pool_size"] == 3
+
+
+def test_pool_metrics():
+    checkouts = REGISTRY.get_sample_value("nbexchange_db_pool_checkouts_total")
+    with database.scoped_session() as session:
+        session.execute(select(1))
+        assert REGISTRY.get_sample_value("nbexchange_db_pool_checked_out") >= 1
+    assert REGISTRY.get_sample_value("nbexchange_db_pool_checkouts_total") == checkouts + 1
+    assert REGISTRY.get_sample_value("nbexchange_db_pool_checked_out") == 0
+
+
+def test_sqlite_performance_mode(tmpdir):
+    engine = create_engine("sqlite:///" + os.path.join(str(tmpdir), "nbexchange.sqlite"))
+    dbutil.register_sqlite_performance_mode(engine)
+    try:
+        with engine.connect() as connection:
+            pragmas = {
+                name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+                for name in ("journal_mode", "synchronous", "busy_timeout", "cache_size")
+            }
+        # synchronous=1 is NORMAL
+        assert pragmas == {"journal_mode": "wal", "synchronous": 1, "busy_timeout": 10000, "cache_size": -65536}
+    finally:
+        engine.dispose()
+
+
+def indexes(db_url, table="action"):
+    engine = create_engine(db_url)
+    try:
+        return {index["name"] for index in inspect(engine).get_indexes(table)}
+    finally:
+        engine.dispose()
+
+
+def test_migrate_action_assignment_id_id_index(tmpdir):
+    db_url = "sqlite:///" + os.path.join(str(tmpdir), "nbexchange.sqlite")
+    # A database at the previous revision
+    engine = create_engine(db_url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX ix_action_assignment_id_id")
+    engine.dispose()
+    with dbutil._temp_alembic_ini(db_url) as alembic_ini:
+        check_call(["alembic", "-c", alembic_ini, "stamp", "2540572282f2"])
+        check_call(["alembic", "-c", alembic_ini, "upgrade", "3c1d0a5e7b92"])
+    assert "ix_action_assignment_id_id" in indexes(db_url)
+
+    with dbutil._temp_alembic_ini(db_url) as alembic_ini:
+        check_call(["alembic", "-c", alembic_ini, "downgrade", "2540572282f2"])
+    assert "ix_action_assignment_id_id" not in indexes(db_url)
+
+
+def test_migrate_finder_composite_indexes(tmpdir):
+    db_url = "sqlite:///" + os.path.join(str(tmpdir), "nbexchange.sqlite")
+    new_indexes = {
+        "action": {"ix_action_assignment_id_action_id", "ix_action_assignment_id_location"},
+        "feedback_2": {"ix_feedback_2_notebook_id_student_id_id"},
+    }
+    # A database at the previous revision
+    engine = create_engine(db_url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for names in new_indexes.values():
+            for name in names:
+                connection.exec_driver_sql(f"DROP INDEX {name}")
+    engine.dispose()
+    with dbutil._temp_alembic_ini(db_url) as alembic_ini:
+        check_call(["alembic", "-c", alembic_ini, "stamp", "3c1d0a5e7b92"])
+        check_call(["alembic", "-c", alembic_ini, "upgrade", "8d4f2b6a1c37"])
+    for table, names in new_indexes.items():
+        assert names <= indexes(db_url, table)
+
+    with dbutil._temp_alembic_ini(db_url) as alembic_ini:
+        check_call(["alembic", "-c", alembic_ini, "downgrade", "3c1d0a5e7b92"])
+    for table, names in new_indexes.items():
+        assert not names & indexes(db_url, table)
+
+
+def test_migrate_action_latest(tmpdir):
+    db_url = "sqlite:///" + os.path.join(str(tmpdir), "nbexchange.sqlite")
+    # A database at the previous revision, with some actions
+    engine = create_engine(db_url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE action_latest")
+        connection.exec_driver_sql("INSERT INTO user (id, name, org_id) VALUES (1, '1-kaylee', 1), (2, '1-mal', 1)")
+        connection.exec_driver_sql(
+            "INSERT INTO course (id, org_id, course_code, course_title) VALUES (1, 1, 'course_2', 'A title')"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO assignment (id, assignment_code, active, course_id) VALUES (1, 'assign_a', 1, 1)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO action (id, user_id, assignment_id, action) VALUES "
+            "(1, 1, 1, 'released'), (2, 2, 1, 'fetched'), (3, 2, 1, 'submitted'), (4, 2, 1, 'submitted'), "
+            "(5, 1, 1, 'released')"
+        )
+    engine.dispose()
+    with dbutil._temp_alembic_ini(db_url) as alembic_ini:
+        check_call(["alembic", "-c", alembic_ini, "stamp", "8d4f2b6a1c37"])
+
+    dbutil.upgrade(db_url)
+    engine = create_engine(db_url)
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(
+            "SELECT assignment_id, user_id, action, action_id FROM action_latest ORDER BY action_id"
+        ).all()
+    engine.dispose()
+    assert [tuple(row) for row in rows] == [(1, 2, "fetched", 2), (1, 2, "submitted", 4), (1, 1, "released", 5)]
+
+    with dbutil._temp_alembic_ini(db_url) as alembic_ini:
+        check_call(["alembic", "-c", alembic_ini, "downgrade", "8d4f2b6a1c37"])
+    engine = create_engine(db_url)
+    try:
+        assert "action_latest" not in inspect(engine).get_table_names()
+    finally:
+        engine.dispose()
+
+
+def test_backfill_action_latest(tmpdir):
+    db_url = "sqlite:///" + os.path.join(str(tmpdir), "nbexchange.sqlite")
+    engine = create_engine(db_url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("INSERT INTO user (id, name, org_id) VALUES (1, '1-kaylee', 1)")
+        connection.exec_driver_sql(
+            "INSERT INTO course (id, org_id, course_code, course_title) VALUES (1, 1, 'course_2', 'A title')"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO assignment (id, assignment_code, active, course_id) VALUES (1, 'assign_a', 1, 1)"
+        )
+        # written behind the ORM's back, so not in the summary
+        connection.exec_driver_sql(
+            "INSERT INTO action (id, user_id, assignment_id, action) VALUES "
+            "(1, 1, 1, 'released'), (2, 1, 1, 'fetched'), (3, 1, 1, 'released')"
+        )
+        assert connection.exec_driver_sql("SELECT count(*) FROM action_latest").scalar() == 0
+    engine.dispose()
+
+    assert dbutil.backfill_action_latest(db_url) == 2
+    engine = create_engine(db_url)
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql("SELECT action, action_id FROM action_latest ORDER BY action_id").all()
+    engine.dispose()
+    assert [tuple(row) for row in rows] == [("fetched", 2), ("released", 3)]
+
+
+def test_backfill_action_latest_needs_upgrade(tmpdir, monkeypatch, capsys):
+    db_url = "sqlite:///" + os.path.join(str(tmpdir), "nbexchange.sqlite")
+    # A database from before the summary table
+    engine = create_engine(db_url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE action_latest")
+    engine.dispose()
+
+    with pytest.raises(dbutil.DatabaseSchemaMismatch, match="upgrade-db"):
+        dbutil.backfill_action_latest(db_url)
+
+    tmpdir.join("nbexchange_config.py").write(f"c.NbExchange.db_url = {db_url!r}\n")
+    monkeypatch.chdir(tmpdir)
+    assert dbutil.main(["backfill-latest"]) == 1
+    assert "upgrade-db" in capsys.readouterr().err
+
+
+def test_sweep_blobs(tmpdir):
+    db_url = "sqlite:///" + os.path.join(str(tmpdir), "nbexchange.sqlite")
+    engine = create_engine(db_url)
+    Base.metadata.create_all(engine)
+    storage = LocalStorage(root=str(tmpdir.join("blobs")))
+    released, _ = storage.put(b"released")
+    feedback, _ = storage.put(b"feedback")
+    rejected, _ = storage.put(b"rejected")
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"INSERT INTO action (id, action, location) VALUES (1, 'released', '{released}')")
+        connection.exec_driver_sql(
+            f"INSERT INTO feedback_2 (id, location, timestamp) VALUES (1, '{feedback}', '2024-01-01 00:00:00')"
+        )
+    engine.dispose()
+    # still being recorded, perhaps
+    assert dbutil.sweep_blobs(db_url, storage) == []
+
+    day_ago = time.time() - 25 * 60 * 60
+    for location in [released, feedback, rejected]:
+        os.utime(location, (day_ago, day_ago))
+    assert dbutil.sweep_blobs(db_url, storage, dry_run=True) == [rejected]
+    assert storage.exists(rejected)
+    assert dbutil.sweep_blobs(db_url, storage) == [rejected]
+    assert not storage.exists(rejected)
+    assert storage.exists(released) and storage.exists(feedback)
@@ -1,8 +1,13 @@
 import logging
+import time
 from abc import ABCMeta
+from types import SimpleNamespace
 
+import jwt
 import pytest
+from mock import patch
 
+from nbexchange.handlers.auth.naas_user_handler import NaasUserHandler
 from nbexchange.handlers.auth.user_handler import BaseUserHandler
 
 logger = logging.getLogger(__file__)
@@ -14,3 +19,71 @@ def test_base_abstract_class(app):
     BaseUserHandler.__abstractmethods__ = set()
 
     assert isinstance(BaseUserHandler, ABCMeta)
+
+
+class _FakeRequestHandler:
+    """Just enough of a tornado RequestHandler for the user plugin"""
+
+    def __init__(self, cookies):
+        self.cookies = cookies
+        self.request = SimpleNamespace(cookies=cookies)
+
+    def get_cookie(self, name, default=None):
+        return self.cookies.get(name, default)
+
+
+def _naas_token(**extra):
+    claims = {
+        "username": "1_kiz",
+        "n_fn": "Kiz",
+        "n_cid": "course_2",
+        "n_cnm": "A title",
+        "n_rl": "Student",
+        "n_oid": 1,
+        "n_cust_id": 1,
+    }
+    claims.update(extra)
+    token = jwt.encode(claims, "secret", algorithm="HS256")
+    return token.decode("utf-8") if isinstance(token, bytes) else token
+
+
+def test_naas_user_handler_no_cookie():
+    plugin = NaasUserHandler()
+    assert plugin.get_current_user(_FakeRequestHandler({})) is None
+
+
+def test_naas_user_handler_decodes_token_once():
+    token = _naas_token()
+    with patch.object(NaasUserHandler, "jwt_key", "secret"):
+        plugin = NaasUserHandler()
+        with patch("nbexchange.handlers.auth.naas_user_handler.jwt.decode", wraps=jwt.decode) as decode:
+            first = plugin.get_current_user(_FakeRequestHandler({"noteable_auth": token}))
+            second = plugin.get_current_user(_FakeRequestHandler({"noteable_auth": token}))
+    assert decode.call_count == 1
+    assert first == second
+    assert first["name"] == "1-kiz"
+    assert first["course_id"] == "course_2"
+    # callers get their own copy
+    first["name"] = "changed"
+    assert plugin.get_current_user(_FakeRequestHandler({"noteable_auth": token}))["name"] == "1-kiz"
+
+
+def test_naas_user_handler_honours_token_expiry():
+    token = _naas_token(exp=int(time.time()) + 2)
+    with patch.object(NaasUserHandler, "jwt_key", "secret"):
+        plugin = NaasUserHandler()
+        plugin.get_current_user(_FakeRequestHandler({"noteable_auth": token}))
+    assert plugin.token_cache.get(token) is not None
+    # The cache would keep the entry for 5 minutes, the token only lives for 2 seconds
+    with patch("nbexchange.cache.time.monotonic", return_value=time.monotonic() + 5):
+        assert plugin.token_cache.get(token) is None
+
+
+def test_naas_user_handler_bad_token_not_cached():
+    token = _naas_token()
+    with patch.object(NaasUserHandler, "jwt_key", "not the secret"):
+        plugin = NaasUserHandler()
+        for _ in range(2):
+            with pytest.raises(jwt.DecodeError):
+                plugin.get_current_user(_FakeRequestHandler({"noteable_auth": token}))
+    assert len(plugin.token_cache) == 0
@@ -1,9 +1,26 @@
 import logging
 import re
+import sys
+import threading
+import time
 
 import pytest
+from mock import patch
+from prometheus_client import REGISTRY
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient
 
-from nbexchange.tests.utils import async_requests
+from nbexchange import database
+from nbexchange.app import NbExchange
+from nbexchange.handlers.base import BaseHandler, user_cache
+from nbexchange.models.courses import Course
+from nbexchange.models.users import User
+from nbexchange.tests.utils import (
+    async_requests,
+    get_files_dict,
+    user_kiz_instructor,
+    user_kiz_student,
+)
 
 logger = logging.getLogger(__file__)
 logger.setLevel(logging.ERROR)
@@ -13,6 +30,33 @@ class BaseTestHandlers(object):
     pass
 
 
+@pytest.fixture
+def async_db_app(request, io_loop, _nbexchange_config, tmp_path):
+    """The NbExchange app, using the asyncio engine on a (file) sqlite database"""
+    config = _nbexchange_config.copy()
+    config.NbExchange.db_async = True
+    config.NbExchange.db_url = f"sqlite:///{tmp_path}/async.sqlite"
+    shared_engine = database.engine
+    nbexchange = NbExchange.instance(config=config)
+    nbexchange.initialize([])
+    nbexchange.start(run_loop=False)
+
+    def cleanup():
+        nbexchange.stop()
+        NbExchange.clear_instance()
+        io_loop.run_sync(database.async_engine.dispose)
+        database.async_engine = database.AsyncSession = None
+        # back to the database every other test uses
+        database.engine.dispose()
+        database.engine = shared_engine
+        database.Session.configure(bind=shared_engine)
+        user_cache.clear()
+
+    request.addfinalizer(cleanup)
+    nbexchange.url = f"http://127.0.0.1:{nbexchange.port}{nbexchange.base_url}".rstrip("/")
+    return nbexchange
+
+
 class TestHandlersBasic(BaseTestHandlers):
     # #### basic "does service exist" tests #### #
     # Test that the base endpoint returns a text string (ie the end-point is alive)
@@ -25,3 +69,84 @@ class TestHandlersBasic(BaseTestHandlers):
     def test_base_location_story(self, app):
         # Not "/services/nbexchange/", the tests move it
         assert app.base_storage_location in ["/tmp/exchange/", "/tmp/courses"]
+
+    # Database work runs on the executor, so a slow query doesn't stall other requests
+    @pytest.mark.gen_test(timeout=10)
+    def test_blocking_work_does_not_stall_ioloop(self, app):
+        def slow_find_by_code(*args, **kwargs):
+            time.sleep(1)
+            return None
+
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+            with patch.object(Course, "find_by_code", side_effect=slow_find_by_code):
+                slow = async_requests.get(app.url + "/assignments?course_id=course_2")
+                # wait for the slow request to reach the executor
+                while not REGISTRY.get_sample_value("nbexchange_executor_active_tasks"):
+                    yield gen.sleep(0.01)
+                start = time.monotonic()
+                r = yield AsyncHTTPClient().fetch(app.url + "/")
+                assert time.monotonic() - start < 0.5
+                assert r.code == 200
+                assert not slow.done()
+                r = yield slow
+        assert r.json()["note"] == "Course course_2 does not exist"
+        assert REGISTRY.get_sample_value("nbexchange_executor_active_tasks") == 0
+        assert REGISTRY.get_sample_value("nbexchange_executor_queued_tasks") == 0
+
+    def test_thread_pool_size(self, app):
+        assert app.tornado_settings["executor"]._max_workers == app.thread_pool_size
+
+    # With NbExchange.db_async, the handlers' database work runs on the asyncio engine
+    @pytest.mark.gen_test
+    def test_db_async(self, async_db_app):
+        user_cache.clear()
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+            r = yield async_requests.get(async_db_app.url + "/assignments?course_id=course_2")
+        assert r.status_code == 200
+        response_data = r.json()
+        assert response_data["success"] is True
+        assert response_data["value"] == []
+        assert REGISTRY.get_sample_value("nbexchange_executor_active_tasks") == 0
+
+        # The user was written through the asyncio engine
+        async def find_user():
+            async with database.async_scoped_session() as session:
+                return await User.async_find_by_name(db=session, name="1-kiz")
+
+        user = yield find_user()
+        assert user.name == "1-kiz"
+
+    # The asyncio engine has the same pool settings as the other
+    def test_db_async_pool(self, async_db_app):
+        pool = database.async_engine.pool
+        assert pool.size() == async_db_app.db_pool_size
+        assert pool._timeout == async_db_app.db_pool_timeout
+        assert pool._pre_ping is async_db_app.db_pool_pre_ping
+
+    # ... and file storage, called from inside the database work, stays off the IOLoop
+    @pytest.mark.gen_test
+    def test_db_async_storage(self, async_db_app):
+        storage = async_db_app.tornado_settings["storage"]
+        called_on = []
+
+        def on_thread(method):
+            def call(*args, **kwargs):
+                called_on.append((method.__name__, threading.current_thread()))
+                return method(*args, **kwargs)
+
+            return call
+
+        with patch.multiple(storage, **{name: on_thread(getattr(storage, name)) for name in ("exists", "stat")}):
+            with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+                r = yield async_requests.post(
+                    async_db_app.url + "/assignment?course_id=course_2&assignment_id=assign_a",
+                    files=get_files_dict(sys.argv[0]),
+                )
+            assert r.json()["success"] is True
+            with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+                r = yield async_requests.get(async_db_app.url + "/assignment?course_id=course_2&assignment_id=assign_a")
+            assert r.status_code == 200
+            assert r.headers["Content-Type"] == "application/gzip"
+
+        assert {name for name, _ in called_on} == {"exists", "stat"}
+        assert all(thread is not threading.main_thread() for _, thread in called_on)
@@ -1,3 +1,5 @@
+import datetime
+import hashlib
 import logging
 import re
 import sys
@@ -5,7 +7,10 @@ import sys
 import pytest
 from mock import patch
 
+from nbexchange.database import scoped_session
 from nbexchange.handlers.base import BaseHandler
+from nbexchange.models.actions import Action, AssignmentActions
+from nbexchange.models.users import User
 from nbexchange.tests.utils import (  # noqa: F401 "clear_database"
     async_requests,
     clear_database,
@@ -14,6 +19,7 @@ from nbexchange.tests.utils import (  # noqa: F401 "clear_database"
     user_kiz,
     user_kiz_instructor,
     user_kiz_student,
+    user_zik_student,
 )
 
 logger = logging.getLogger(__file__)
@@ -252,6 +258,16 @@ def test_get_collection_confirm_instructor_does_download(app, clear_database):
     assert r.status_code == 200
     assert r.headers["Content-Type"] == "application/gzip"
     assert int(r.headers["Content-Length"]) > 0
+    assert r.headers["Etag"] == f'"{hashlib.sha256(files["assignment"][1]).hexdigest()}"'
+
+    # The submission hasn't changed, so a re-download isn't needed
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.get(
+            app.url
+            + f"/collection?course_id={collected_data['course_id']}&path={collected_data['path']}&assignment_id={collected_data['assignment_id']}",  # noqa: E501 W503
+            headers={"If-None-Match": r.headers["Etag"]},
+        )
+    assert r.status_code == 304
 
 
 # broken nbex_user throws a 500 error on the server
@@ -433,9 +449,11 @@ def test_get_collection_with_a_blank_feedback_path_injected(app, clear_database)
     from nbexchange.database import scoped_session
 
     with scoped_session() as session:
+        # by the student who submitted, on the same assignment
+        submitted = session.query(nbexchange.models.actions.Action).filter_by(action="submitted").first()
         action = nbexchange.models.actions.Action(
-            user_id=3,
-            assignment_id="assign_a",
+            user_id=submitted.user_id,
+            assignment_id=submitted.assignment_id,
             action="feedback_fetched",
             location=None,
         )
@@ -455,3 +473,48 @@ def test_get_collection_with_a_blank_feedback_path_injected(app, clear_database)
     assert r.status_code == 200
     assert r.headers["Content-Type"] == "application/gzip"
     assert int(r.headers["Content-Length"]) > 0
+
+
+# Identical submissions share a path: user_id picks out whose submission is collected
+@pytest.mark.gen_test
+def test_get_collection_identical_submissions(app, clear_database):  # noqa: F811
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(
+            app.url + "/assignment?course_id=course_2&assignment_id=assign_a",
+            files=files,
+        )
+    for student in [user_kiz_student, user_zik_student]:
+        with patch.object(BaseHandler, "get_current_user", return_value=student):
+            r = yield async_requests.get(app.url + "/assignment?course_id=course_2&assignment_id=assign_a")
+            r = yield async_requests.post(
+                app.url + "/submission?course_id=course_2&assignment_id=assign_a",
+                files=files,
+            )
+
+    # kiz submitted an hour ago
+    with scoped_session() as session:
+        kiz = session.query(User).filter_by(name="1-kiz").first()
+        session.query(Action).filter_by(action=AssignmentActions.submitted, user_id=kiz.id).update(
+            {Action.timestamp: datetime.datetime.utcnow() - datetime.timedelta(hours=1)}
+        )
+
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.get(app.url + "/collections?course_id=course_2&assignment_id=assign_a")
+        submissions = {item["student_id"]: item for item in r.json()["value"]}
+        assert submissions["1-kiz"]["path"] == submissions["1-zik"]["path"]
+
+        last_modified = {}
+        for student_id, item in submissions.items():
+            r = yield async_requests.get(
+                app.url
+                + f"/collection?course_id=course_2&path={item['path']}&assignment_id=assign_a&user_id={student_id}"  # noqa: E501 W503
+            )
+            assert r.status_code == 200
+            last_modified[student_id] = r.headers["Last-Modified"]
+        assert last_modified["1-kiz"] != last_modified["1-zik"]
+
+        # Someone who didn't submit it gets nothing
+        r = yield async_requests.get(
+            app.url + f"/collection?course_id=course_2&path={item['path']}&assignment_id=assign_a&user_id=1-nobody"
+        )
+    assert r.content == b""
@@ -1,10 +1,16 @@
+import hashlib
+import io
+import json
 import logging
 import sys
+import tarfile
 
 import pytest
 from mock import patch
 
+from nbexchange.database import scoped_session
 from nbexchange.handlers.base import BaseHandler
+from nbexchange.models.actions import Action, AssignmentActions
 from nbexchange.tests.utils import (  # noqa: F401 "clear_database"
     async_requests,
     clear_database,
@@ -24,6 +30,24 @@ logger.setLevel(logging.ERROR)
 files = get_files_dict(sys.argv[0])  # ourself :)
 
 
+async def release_and_submit(app, course_id, assignment_id, notebooks):
+    """Release the assignment, then submit it: 3 different versions by 1-kiz, then 2 by 1-brobbere"""
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        await async_requests.post(
+            app.url + f"/assignment?course_id={course_id}&assignment_id={assignment_id}",
+            files=files,
+            data={"notebooks": notebooks},
+        )
+    for user, submissions in [(user_kiz_student, 3), (user_brobbere_student, 2)]:
+        for i in range(submissions):
+            with patch.object(BaseHandler, "get_current_user", return_value=user):
+                r = await async_requests.post(
+                    app.url + f"/submission?course_id={course_id}&assignment_id={assignment_id}",
+                    files={"assignment": ("assignment.tar.gz", f"{user['name']} version {i}".encode())},
+                )
+            assert r.json()["success"] is True
+
+
 # #### POST /collections #### #
 # No method available (501, because we've hard-coded it)
 @pytest.mark.gen_test
@@ -264,6 +288,37 @@ def test_collections_with_one_user_submits_2nd_time(app, clear_database):  # noq
     assert len(response_data["value"]) == 2
 
 
+# latest_only gives one row per student: their most recent submission
+@pytest.mark.gen_test
+def test_collections_latest_only(app, clear_database, count_queries):  # noqa: F811
+    assignment_id_1 = "assign_a"
+    course_id = "course_2"
+    yield release_and_submit(app, course_id, assignment_id_1, notebooks=["notebook_1", "notebook_2"])
+
+    url = app.url + f"/collections?course_id={course_id}&assignment_id={assignment_id_1}"
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.get(url)
+        everything = r.json()["value"]
+        assert len(everything) == 5
+
+        with count_queries() as statements:
+            r = yield async_requests.get(url + "&latest_only=true")
+
+    latest = r.json()["value"]
+    assert sorted(m["student_id"] for m in latest) == ["1-brobbere", "1-kiz"]
+    for model in latest:
+        versions = [m for m in everything if m["student_id"] == model["student_id"]]
+        assert model == versions[-1]
+        assert model["timestamp"] == max(m["timestamp"] for m in versions)
+        assert model["notebooks"] == [{"notebook_id": "notebook_1"}, {"notebook_id": "notebook_2"}]
+    # the course, the assignment, the submissions (with their users), and the notebooks
+    assert len(statements) == 4
+
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.get(url + "&latest_only=true&user_id=1-kiz")
+    assert r.json()["value"] == [m for m in latest if m["student_id"] == "1-kiz"]
+
+
 @pytest.mark.gen_test
 def test_collections_with_named_user(app, clear_database):  # noqa: F811
     assignment_id_1 = "assign_a"
@@ -410,9 +465,11 @@ def test_collections_with_a_blank_feedback_path_injected(app, clear_database):
     from nbexchange.database import scoped_session
 
     with scoped_session() as session:
+        # by the student who submitted, on the same assignment
+        submitted = session.query(Action).filter_by(action=AssignmentActions.submitted).first()
         action = nbexchange.models.actions.Action(
-            user_id=3,
-            assignment_id=1,
+            user_id=submitted.user_id,
+            assignment_id=submitted.assignment_id,
             action=nbexchange.models.actions.AssignmentActions.feedback_fetched.value,
             location=None,
         )
@@ -424,3 +481,71 @@ def test_collections_with_a_blank_feedback_path_injected(app, clear_database):
     response_data = r.json()
     assert response_data["success"] is True
     assert len(response_data["value"]) == 3
+
+
+# #### GET /collections/archive (download the latest submissions, as one tar) #### #
+
+
+# Students can't collect
+@pytest.mark.gen_test
+def test_collections_archive_not_instructor(app, clear_database):  # noqa: F811
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+        r = yield async_requests.get(app.url + "/collections/archive?course_id=course_2&assignment_id=assign_a")
+    assert r.json() == {"success": False, "note": "User not an instructor to course course_2"}
+
+
+# Nothing submitted: an archive of just the (empty) manifest
+@pytest.mark.gen_test
+def test_collections_archive_nothing_submitted(app, clear_database):  # noqa: F811
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.get(app.url + "/collections/archive?course_id=course_2&assignment_id=assign_a")
+    assert r.headers["Content-Type"] == "application/x-tar"
+    with tarfile.open(fileobj=io.BytesIO(r.content)) as archive:
+        assert archive.getnames() == ["manifest.json"]
+        assert json.load(archive.extractfile("manifest.json")) == []
+
+
+@pytest.mark.gen_test
+def test_collections_archive(app, clear_database, count_queries):  # noqa: F811
+    assignment_id_1 = "assign_a"
+    course_id = "course_2"
+    yield release_and_submit(app, course_id, assignment_id_1, notebooks=["notebook_1"])
+
+    url = app.url + f"/collections?course_id={course_id}&assignment_id={assignment_id_1}&latest_only=true"
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.get(url)
+        latest = {m["student_id"]: m for m in r.json()["value"]}
+
+        with count_queries() as statements:
+            r = yield async_requests.get(url.replace("/collections?", "/collections/archive?"))
+
+    assert r.status_code == 200
+    assert r.headers["Content-Type"] == "application/x-tar"
+    assert int(r.headers["Content-Length"]) == len(r.content)
+    with tarfile.open(fileobj=io.BytesIO(r.content)) as archive:
+        assert archive.getnames() == ["manifest.json", "1-kiz.tar.gz", "1-brobbere.tar.gz"]
+        manifest = json.load(archive.extractfile("manifest.json"))
+        assert [entry["student_id"] for entry in manifest] == ["1-kiz", "1-brobbere"]
+        for entry in manifest:
+            assert entry["timestamp"] == latest[entry["student_id"]]["timestamp"]
+            assert entry["full_name"] == latest[entry["student_id"]]["full_name"]
+            content = archive.extractfile(entry["member"]).read()
+            assert entry["checksum"] == hashlib.sha256(content).hexdigest()
+        assert archive.extractfile("1-kiz.tar.gz").read() == b"1-kiz version 2"
+        assert archive.extractfile("1-brobbere.tar.gz").read() == b"1-brobbere version 1"
+
+    # the collections are recorded in a single insert (and one more to the latest-action summary)
+    inserts = [statement for statement in statements if statement.startswith("INSERT")]
+    assert len([statement for statement in inserts if statement.startswith("INSERT INTO action (")]) == 1
+    assert len([statement for statement in inserts if statement.startswith("INSERT INTO action_latest ")]) == 1
+    with scoped_session() as session:
+        collected = session.query(Action).filter(Action.action == AssignmentActions.collected).all()
+        assert sorted(action.checksum for action in collected) == sorted(entry["checksum"] for entry in manifest)
+
+    # or just the students asked for
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.get(
+            app.url + f"/collections/archive?course_id={course_id}&assignment_id={assignment_id_1}&user_id=1-brobbere"
+        )
+    with tarfile.open(fileobj=io.BytesIO(r.content)) as archive:
+        assert archive.getnames() == ["manifest.json", "1-brobbere.tar.gz"]
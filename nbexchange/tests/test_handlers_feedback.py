@@ -1,22 +1,30 @@
 import base64
 import datetime
+import io
+import json
 import sys
+import tarfile
 
 import pytest
 from mock import patch
 from nbgrader.utils import make_unique_key, notebook_hash
 
+from nbexchange.database import scoped_session
 from nbexchange.handlers.base import BaseHandler
+from nbexchange.models.actions import Action, AssignmentActions
+from nbexchange.models.users import User
 from nbexchange.tests.utils import (  # noqa: F401 "clear_database"
     async_requests,
     clear_database,
     get_feedback_dict,
     get_files_dict,
+    user_brobbere_instructor,
     user_brobbere_student,
     user_kiz,
     user_kiz_instructor,
     user_kiz_student,
     user_lkihlman_instructor,
+    user_lkihlman_student,
 )
 
 # set up the file to be uploaded
@@ -731,3 +739,249 @@ def test_feedback_get_correct_assignment_across_courses(app, clear_database):  #
     assert response_data["success"] is True
     assert len(response_data["feedback"]) >= 1
     assert response_data["feedback"][0].get("content") == feedback_base64.decode("utf-8")
+
+
+# The manifest lists the feedback without its contents, and each file is then downloaded on its own (or all in one tar)
+@pytest.mark.gen_test
+def test_feedback_get_manifest_and_download(app, clear_database):  # noqa: F811
+    assignment_id = "assign_a"
+    course_id = "course_2"
+    notebook = "notebook"
+    student = user_kiz_student
+    timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat(" ")
+    checksum = notebook_hash(
+        feedback_filename,
+        make_unique_key(course_id, assignment_id, notebook, student["name"], timestamp),
+    )
+
+    kwargs = {"data": {"notebooks": [notebook]}}
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(
+            app.url + f"/assignment?course_id={course_id}&assignment_id={assignment_id}",
+            files=files,
+            **kwargs,
+        )
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+        r = yield async_requests.post(
+            app.url + f"/submission?course_id={course_id}&assignment_id={assignment_id}",
+            files=files,
+        )
+    url = (
+        f"/feedback?assignment_id={assignment_id}"
+        f"&course_id={course_id}"
+        f"&notebook={notebook}"
+        f"&student={student['name']}"
+        f"&timestamp={timestamp}"
+        f"&checksum={checksum}"
+    )
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(app.url + url, files=feedbacks)
+    assert r.json()["success"] is True
+
+    query = f"assignment_id={assignment_id}&course_id={course_id}"
+    content = open(feedback_filename, "rb").read()
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+        r = yield async_requests.get(app.url + f"/feedback?{query}&manifest=true")
+        [entry] = r.json()["feedback"]
+        assert "content" not in entry
+        assert entry["filename"] == f"{notebook}.html"
+        assert entry["checksum"] == checksum
+
+        r = yield async_requests.get(app.url + f"/feedback/download?{query}&token={entry['token']}")
+        assert r.headers["Content-Type"] == "text/html"
+        assert r.content == content
+        # (not downloaded again)
+        r = yield async_requests.get(
+            app.url + f"/feedback/download?{query}&token={entry['token']}",
+            headers={"If-Modified-Since": r.headers["Last-Modified"]},
+        )
+        assert r.status_code == 304
+
+        r = yield async_requests.get(app.url + f"/feedback/archive?{query}")
+        assert r.headers["Content-Type"] == "application/x-tar"
+        with tarfile.open(fileobj=io.BytesIO(r.content)) as archive:
+            [archived] = json.load(archive.extractfile("manifest.json"))
+            released = datetime.datetime.strptime(entry["timestamp"].strip(), "%Y-%m-%d %H:%M:%S.%f")
+            # no spaces or colons, to be extracted anywhere
+            assert archived["member"] == f"{released.strftime('%Y-%m-%dT%H-%M-%S.%f')}/{notebook}.html"
+            assert archive.extractfile(archived["member"]).read() == content
+
+    # The token is no good to anyone else, even the course's instructors
+    for user in [user_brobbere_student, user_brobbere_instructor]:
+        with patch.object(BaseHandler, "get_current_user", return_value=user):
+            r = yield async_requests.get(app.url + f"/feedback/download?{query}&token={entry['token']}")
+        assert r.json() == {"success": False, "note": "Feedback not found"}
+    # nor on another course
+    with patch.object(BaseHandler, "get_current_user", return_value=user_lkihlman_student):
+        r = yield async_requests.get(
+            app.url + f"/feedback/download?assignment_id={assignment_id}&course_id=course_1&token={entry['token']}"
+        )
+    assert r.status_code == 404
+
+    # Downloads are recorded, listing the manifest is not
+    with scoped_session() as session:
+        fetched = session.query(Action).filter(Action.action == AssignmentActions.feedback_fetched).count()
+    assert fetched == 2
+
+
+# Many feedback files, in one request
+@pytest.mark.gen_test
+def test_feedback_post_batch(app, clear_database, count_queries):  # noqa: F811
+    assignment_id = "assign_a"
+    course_id = "course_2"
+    notebooks = ["notebook_1", "notebook_2"]
+    timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat(" ")
+
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(
+            app.url + f"/assignment?course_id={course_id}&assignment_id={assignment_id}",
+            files=files,
+            data={"notebooks": notebooks},
+        )
+    for student in [user_kiz_student, user_brobbere_student]:
+        with patch.object(BaseHandler, "get_current_user", return_value=student):
+            r = yield async_requests.post(
+                app.url + f"/submission?course_id={course_id}&assignment_id={assignment_id}",
+                files=files,
+            )
+
+    released = [
+        {"notebook": notebook, "student": student["name"], "timestamp": timestamp, "checksum": f"{student['name']}"}
+        for student in [user_kiz_student, user_brobbere_student]
+        for notebook in notebooks
+    ]
+    url = app.url + f"/feedback/batch?course_id={course_id}&assignment_id={assignment_id}"
+
+    # Nothing is recorded if anything can't be found
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(
+            url,
+            data={"manifest": [json.dumps(dict(entry, student="nobody")) for entry in released]},
+            files=[("feedback", ("feedback.html", b"x")) for _ in released],
+        )
+    assert r.json() == {
+        "success": False,
+        "note": "Could not find requested resources: notebooks [], students ['nobody']",
+    }
+
+    # Every file needs a manifest entry
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(
+            url,
+            data={"manifest": [json.dumps(entry) for entry in released[1:]]},
+            files=[("feedback", ("feedback.html", b"x")) for _ in released],
+        )
+    assert r.json()["success"] is False
+
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        with count_queries() as statements:
+            r = yield async_requests.post(
+                url,
+                data={"manifest": [json.dumps(entry) for entry in released]},
+                files=[
+                    ("feedback", ("feedback.html", f"{entry['student']} {entry['notebook']}".encode()))
+                    for entry in released
+                ],
+            )
+    assert r.json() == {"success": True, "note": "Feedback released (4 files)"}
+    # the feedback, the actions, and the latest-action summary, in one insert each
+    assert len([statement for statement in statements if statement.startswith("INSERT")]) == 3
+
+    with patch.object(BaseHandler, "get_current_user", return_value=user_brobbere_student):
+        r = yield async_requests.get(app.url + f"/feedback/archive?course_id={course_id}&assignment_id={assignment_id}")
+    with tarfile.open(fileobj=io.BytesIO(r.content)) as archive:
+        manifest = json.load(archive.extractfile("manifest.json"))
+        assert sorted(entry["filename"] for entry in manifest) == ["notebook_1.html", "notebook_2.html"]
+        for entry in manifest:
+            content = archive.extractfile(entry["member"]).read()
+            assert content == f"1-brobbere {entry['filename'][:-len('.html')]}".encode()
+            assert entry["checksum"] == "1-brobbere"
+
+
+# A student is found in the course's organisation, not another with the same name elsewhere
+@pytest.mark.gen_test
+def test_feedback_post_batch_org(app, clear_database):  # noqa: F811
+    assignment_id = "assign_a"
+    course_id = "course_2"
+    timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat(" ")
+
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(
+            app.url + f"/assignment?course_id={course_id}&assignment_id={assignment_id}",
+            files=files,
+            data={"notebooks": ["notebook"]},
+        )
+    with patch.object(BaseHandler, "get_current_user", return_value=user_brobbere_student):
+        r = yield async_requests.post(
+            app.url + f"/submission?course_id={course_id}&assignment_id={assignment_id}",
+            files=files,
+        )
+    with scoped_session() as session:
+        session.add(User(name=user_brobbere_student["name"], org_id=2))
+
+    released = {"notebook": "notebook", "student": "1-brobbere", "timestamp": timestamp, "checksum": "1-brobbere"}
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(
+            app.url + f"/feedback/batch?course_id={course_id}&assignment_id={assignment_id}",
+            data={"manifest": [json.dumps(released)]},
+            files=[("feedback", ("feedback.html", b"feedback"))],
+        )
+    assert r.json()["success"] is True
+
+    with patch.object(BaseHandler, "get_current_user", return_value=user_brobbere_student):
+        r = yield async_requests.get(
+            app.url + f"/feedback?course_id={course_id}&assignment_id={assignment_id}&manifest=true"
+        )
+    assert [entry["checksum"] for entry in r.json()["feedback"]] == ["1-brobbere"]
+
+
+# However many notebooks have feedback, fetching it is the same few queries
+@pytest.mark.gen_test
+def test_feedback_get_query_count(app, clear_database, count_queries):  # noqa: F811
+    assignment_id = "assign_a"
+    course_id = "course_2"
+    notebooks = [f"notebook_{i}" for i in range(20)]
+    timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat(" ")
+
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(
+            app.url + f"/assignment?course_id={course_id}&assignment_id={assignment_id}",
+            files=files,
+            data={"notebooks": notebooks},
+        )
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+        r = yield async_requests.post(
+            app.url + f"/submission?course_id={course_id}&assignment_id={assignment_id}",
+            files=files,
+        )
+    released = [
+        {"notebook": notebook, "student": user_kiz_student["name"], "timestamp": timestamp, "checksum": notebook}
+        for notebook in notebooks
+    ]
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(
+            app.url + f"/feedback/batch?course_id={course_id}&assignment_id={assignment_id}",
+            data={"manifest": [json.dumps(entry) for entry in released]},
+            files=[("feedback", ("feedback.html", notebook.encode())) for notebook in notebooks],
+        )
+    assert r.json()["success"] is True
+
+    query = f"course_id={course_id}&assignment_id={assignment_id}"
+    for url in [f"/feedback?{query}", f"/feedback?{query}&manifest=true", f"/feedback/archive?{query}"]:
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+            with count_queries() as statements:
+                r = yield async_requests.get(app.url + url)
+        assert r.status_code == 200
+        selects = [statement for statement in statements if statement.startswith("SELECT")]
+        inserts = [statement for statement in statements if statement.startswith("INSERT")]
+        # the course, the assignment, and the feedback (with its notebooks)
+        assert len(selects) == 3
+        # all the fetches, in one insert, plus one to the latest-action summary
+        # (nothing is fetched by the manifest)
+        assert len(inserts) == (0 if "manifest" in url else 2)
+
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+        r = yield async_requests.get(app.url + f"/feedback?{query}")
+    feedback = r.json()["feedback"]
+    assert [f["filename"] for f in feedback] == [f"{notebook}.html" for notebook in notebooks]
+    assert [base64.b64decode(f["content"]) for f in feedback] == [notebook.encode() for notebook in notebooks]
@@ -1,10 +1,15 @@
+import datetime
+import hashlib
 import logging
+import os
 import sys
 
 import pytest
 from mock import patch
 
+from nbexchange.database import scoped_session
 from nbexchange.handlers.base import BaseHandler
+from nbexchange.models.actions import Action, AssignmentActions
 from nbexchange.tests.utils import (  # noqa: F401 "clear_database"
     async_requests,
     clear_database,
@@ -19,6 +24,8 @@ logger.setLevel(logging.ERROR)
 
 # set up the file to be uploaded as part of the testing later
 files = get_files_dict(sys.argv[0])  # ourself :)
+# ... and a different one, for re-releases
+changed_files = {"assignment": ("assignment.tar.gz", files["assignment"][1] + b"changed")}
 
 #################################
 #
@@ -36,6 +43,12 @@ files = get_files_dict(sys.argv[0])  # ourself :)
 # #### GET /assignment (download/fetch assignment)  ##### #
 
 
+def fetches():
+    """How many fetches have been recorded"""
+    with scoped_session() as session:
+        return session.query(Action).filter(Action.action == AssignmentActions.fetched).count()
+
+
 # require authenticated user (404 because the bounce to login fails)
 @pytest.mark.gen_test
 def test_fetch_requires_auth_user(app):
@@ -194,7 +207,7 @@ def test_fetch_after_rerelease_gets_different_file(app, clear_database):  # noqa
     with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
         r = yield async_requests.post(
             app.url + "/assignment?course_id=course_2&assignment_id=assign_a",
-            files=files,
+            files=changed_files,
         )
     with patch.object(BaseHandler, "get_current_user", return_value=user_brobbere_student):
         r = yield async_requests.get(app.url + "/assignment?&course_id=course_2&assignment_id=assign_a")
@@ -217,3 +230,142 @@ def test_fetch_after_rerelease_gets_different_file(app, clear_database):  # noqa
     assert paths[2] == paths[3]  # First fetch = third release
     assert paths[4] == paths[5]  # Second fetch = fourth release
     assert paths[3] != paths[5]  # First fetch is not the same as the second fetch
+
+
+# Releases are sent a block at a time, with a Content-Length
+@pytest.mark.gen_test
+def test_fetch_streams_release(app, clear_database):  # noqa: F811
+    release = {"assignment": ("assignment.tar.gz", os.urandom(10 * 1024))}
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(
+            app.url + "/assignment?course_id=course_2&assignment_id=assign_a",
+            files=release,
+        )
+    with patch.object(BaseHandler, "get_current_user", return_value=user_brobbere_student):
+        with patch.object(BaseHandler, "download_chunk_size", 1024):
+            with patch.object(BaseHandler, "flush", autospec=True, side_effect=BaseHandler.flush) as flush:
+                r = yield async_requests.get(app.url + "/assignment?course_id=course_2&assignment_id=assign_a")
+    assert r.status_code == 200
+    assert r.headers["Content-Type"] == "application/gzip"
+    assert r.headers["Content-Length"] == str(10 * 1024)
+    assert "Transfer-Encoding" not in r.headers
+    assert r.content == release["assignment"][1]
+    assert flush.call_count >= 10
+
+
+# Releases have a strong ETag (their sha256), and conditional requests get a 304
+@pytest.mark.gen_test
+def test_fetch_conditional(app, clear_database):  # noqa: F811
+    content = os.urandom(4096)
+    url = app.url + "/assignment?course_id=course_2&assignment_id=assign_a"
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(url, files={"assignment": ("assignment.tar.gz", content)})
+    with patch.object(BaseHandler, "get_current_user", return_value=user_brobbere_student):
+        r = yield async_requests.get(url)
+        etag = r.headers["Etag"]
+        assert etag == f'"{hashlib.sha256(content).hexdigest()}"'
+        assert r.headers["Accept-Ranges"] == "bytes"
+        last_modified = r.headers["Last-Modified"]
+
+        r = yield async_requests.get(url, headers={"If-None-Match": etag})
+        assert r.status_code == 304
+        assert r.content == b""
+        r = yield async_requests.get(url, headers={"If-Modified-Since": last_modified})
+        assert r.status_code == 304
+        r = yield async_requests.get(url, headers={"If-None-Match": '"something-else"'})
+        assert r.status_code == 200
+        assert r.content == content
+
+
+# Identical releases share one stored file: Last-Modified is when the release was made, not when the file was stored
+@pytest.mark.gen_test
+def test_fetch_conditional_rerelease(app, clear_database):  # noqa: F811
+    content = os.urandom(4096)
+    url = app.url + "/assignment?course_id=course_2&assignment_id=assign_a"
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(url, files={"assignment": ("assignment.tar.gz", content)})
+    # (an hour ago)
+    with scoped_session() as session:
+        session.query(Action).update({Action.timestamp: datetime.datetime.utcnow() - datetime.timedelta(hours=1)})
+    with patch.object(BaseHandler, "get_current_user", return_value=user_brobbere_student):
+        r = yield async_requests.get(url)
+    last_modified = r.headers["Last-Modified"]
+
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(url, files={"assignment": ("assignment.tar.gz", content)})
+    with patch.object(BaseHandler, "get_current_user", return_value=user_brobbere_student):
+        r = yield async_requests.get(url, headers={"If-Modified-Since": last_modified})
+    assert r.status_code == 200
+    assert r.content == content
+    assert r.headers["Last-Modified"] != last_modified
+
+
+# Range requests get just the bytes asked for
+@pytest.mark.gen_test
+def test_fetch_range(app, clear_database):  # noqa: F811
+    content = os.urandom(4096)
+    url = app.url + "/assignment?course_id=course_2&assignment_id=assign_a"
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(url, files={"assignment": ("assignment.tar.gz", content)})
+    with patch.object(BaseHandler, "get_current_user", return_value=user_brobbere_student):
+        r = yield async_requests.get(url, headers={"Range": "bytes=1000-"})
+        assert r.status_code == 206
+        assert r.headers["Content-Range"] == "bytes 1000-4095/4096"
+        assert r.content == content[1000:]
+        etag = r.headers["Etag"]
+
+        r = yield async_requests.get(url, headers={"Range": "bytes=10-19", "If-Range": etag})
+        assert r.status_code == 206
+        assert r.content == content[10:20]
+        r = yield async_requests.get(url, headers={"Range": "bytes=-96"})
+        assert r.status_code == 206
+        assert r.content == content[-96:]
+
+        # A stale If-Range gets the whole (new) file
+        r = yield async_requests.get(url, headers={"Range": "bytes=10-19", "If-Range": '"something-else"'})
+        assert r.status_code == 200
+        assert r.content == content
+
+        r = yield async_requests.get(url, headers={"Range": "bytes=5000-"})
+        assert r.status_code == 416
+        assert r.headers["Content-Range"] == "bytes */4096"
+
+
+# Only a download from the start is a fetch: revalidating (a 304), or resuming (a later Range), is not another
+@pytest.mark.gen_test
+def test_fetch_recorded_once(app, clear_database):  # noqa: F811
+    content = os.urandom(4096)
+    url = app.url + "/assignment?course_id=course_2&assignment_id=assign_a"
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(url, files={"assignment": ("assignment.tar.gz", content)})
+    with patch.object(BaseHandler, "get_current_user", return_value=user_brobbere_student):
+        r = yield async_requests.get(url, headers={"Range": "bytes=0-999"})
+        assert r.status_code == 206
+        assert fetches() == 1
+        r = yield async_requests.get(url, headers={"Range": "bytes=1000-", "If-Range": r.headers["Etag"]})
+        assert r.status_code == 206
+        r = yield async_requests.get(url, headers={"If-None-Match": r.headers["Etag"]})
+        assert r.status_code == 304
+        r = yield async_requests.get(url, headers={"If-Modified-Since": r.headers["Last-Modified"]})
+        assert r.status_code == 304
+        assert fetches() == 1
+
+        r = yield async_requests.get(url)
+        assert r.status_code == 200
+        assert fetches() == 2
+
+
+# Releases made before checksums were recorded get one on their first download
+@pytest.mark.gen_test
+def test_fetch_backfills_checksum(app, db, clear_database):  # noqa: F811
+    content = os.urandom(4096)
+    url = app.url + "/assignment?course_id=course_2&assignment_id=assign_a"
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(url, files={"assignment": ("assignment.tar.gz", content)})
+    db.query(Action).update({Action.checksum: None})
+    db.commit()
+    with patch.object(BaseHandler, "get_current_user", return_value=user_brobbere_student):
+        r = yield async_requests.get(url)
+    assert r.headers["Etag"] == f'"{hashlib.sha256(content).hexdigest()}"'
+    db.expire_all()
+    assert {action.checksum for action in db.query(Action)} == {hashlib.sha256(content).hexdigest()}
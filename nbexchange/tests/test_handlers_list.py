@@ -1,15 +1,58 @@
+import datetime
+import json
 import logging
+import sys
 
 import pytest
 from mock import patch
 
-from nbexchange.handlers.base import BaseHandler
+from nbexchange.handlers.base import BaseHandler, user_cache
+from nbexchange.models.actions import Action, AssignmentActions
+from nbexchange.models.assignments import Assignment
+from nbexchange.models.courses import Course
+from nbexchange.models.feedback import Feedback
+from nbexchange.models.notebooks import Notebook
+from nbexchange.models.subscriptions import Subscription
+from nbexchange.models.users import User
 from nbexchange.tests.test_handlers_base import BaseTestHandlers
-from nbexchange.tests.utils import async_requests, user_kiz, user_kiz_instructor
+from nbexchange.tests.utils import (  # noqa: F401 "clear_database"
+    async_requests,
+    clear_database,
+    get_files_dict,
+    user_brobbere_instructor,
+    user_kiz,
+    user_kiz_instructor,
+    user_kiz_student,
+    user_zik_student,
+)
 
 logger = logging.getLogger(__file__)
 logger.setLevel(logging.ERROR)
 
+# set up the file to be uploaded as part of the testing later
+files = get_files_dict(sys.argv[0])  # ourself :)
+
+
+def seed_course(db, assignments, notebooks, submissions, releases=1, first=0):
+    """Give course_2 `assignments` assignments (assign_`first`...), each released `releases` times and
+    submitted `submissions` times by 1-kiz, with feedback for each notebook
+
+    1-kiz & course_2 must already exist
+    """
+    course = db.query(Course).filter_by(course_code="course_2").one()
+    student = db.query(User).filter_by(name="1-kiz").one()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for a in range(first, first + assignments):
+        assignment = Assignment(assignment_code=f"assign_{a}", course_id=course.id)
+        assignment.notebooks = [Notebook(name=f"notebook_{n}") for n in range(notebooks)]
+        db.add(assignment)
+        db.flush()
+        for action, count in [(AssignmentActions.released, releases), (AssignmentActions.submitted, submissions)]:
+            db.add_all([Action(user_id=student.id, assignment_id=assignment.id, action=action) for _ in range(count)])
+        for notebook in assignment.notebooks:
+            db.add(Feedback(notebook_id=notebook.id, student_id=student.id, timestamp=now))
+    db.commit()
+
 
 class TestHandlersFetch(BaseTestHandlers):
     """GET /assignments (list assignments)"""
@@ -60,3 +103,223 @@ class TestHandlersFetch(BaseTestHandlers):
         assert (
             "Both current_course ('None') and current_role ('None') must have values. User was '1-kiz'" in caplog.text
         )
+
+    # The second call for the same identity does not go to the database for the user
+    @pytest.mark.gen_test
+    def test_assignments_user_cached(self, app, clear_database):  # noqa: F811
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+            r = yield async_requests.get(app.url + "/assignments?course_id=course_2")
+        assert r.json()["success"] is True
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+            with patch.object(User, "upsert", wraps=User.upsert) as upsert:
+                r = yield async_requests.get(app.url + "/assignments?course_id=course_2")
+        assert r.json()["success"] is True
+        assert upsert.call_count == 0
+
+    # A new subscription for the user drops their cached entries
+    @pytest.mark.gen_test
+    def test_assignments_user_cache_invalidated(self, app, clear_database):  # noqa: F811
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+            r = yield async_requests.get(app.url + "/assignments?course_id=course_2")
+        assert r.json()["success"] is True
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+            r = yield async_requests.get(app.url + "/assignments?course_id=course_2")
+        assert r.json()["success"] is True
+        assert len(user_cache) == 1
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+            with patch.object(User, "upsert", wraps=User.upsert) as upsert:
+                r = yield async_requests.get(app.url + "/assignments?course_id=course_2")
+        assert r.json()["success"] is True
+        assert upsert.call_count == 1
+
+    # A user read while their cached entries are being dropped isn't cached: it may be stale
+    @pytest.mark.gen_test
+    def test_assignments_user_cache_not_set_if_invalidated(self, app, clear_database):  # noqa: F811
+        find_roles_for_user = Subscription.find_roles_for_user
+
+        def invalidated_while_reading(*args, **kwargs):
+            user_cache.clear()  # (as another request, changing the user's subscriptions, would)
+            return find_roles_for_user(*args, **kwargs)
+
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+            with patch.object(Subscription, "find_roles_for_user", side_effect=invalidated_while_reading):
+                r = yield async_requests.get(app.url + "/assignments?course_id=course_2")
+            assert r.json()["success"] is True
+            assert len(user_cache) == 0
+            r = yield async_requests.get(app.url + "/assignments?course_id=course_2")
+        assert r.json()["success"] is True
+        assert len(user_cache) == 1
+
+    # Resolving the user costs the same number of queries however many courses they're on
+    @pytest.mark.gen_test
+    def test_assignments_user_sync_query_count(self, app, clear_database, count_queries):  # noqa: F811
+        for course in ["course_a", "course_b", "course_c", "course_d"]:
+            with patch.object(
+                BaseHandler, "get_current_user", return_value=dict(user_kiz_instructor, course_id=course)
+            ):
+                r = yield async_requests.get(app.url + f"/assignments?course_id={course}")
+            assert r.json()["success"] is True
+
+        with count_queries() as statements:
+            with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+                # Stop the handler once the user is resolved
+                with patch.object(Course, "find_by_code", return_value=None):
+                    r = yield async_requests.get(app.url + "/assignments?course_id=course_2")
+        assert r.json()["note"] == "Course course_2 does not exist"
+        assert r.json()["success"] is False
+        # user, course & subscription upserts, and one query for all 5 subscriptions
+        assert len(statements) == 4
+
+    # Listing costs the same number of queries however many assignments, notebooks & submissions there are
+    @pytest.mark.gen_test
+    def test_assignments_query_count(self, app, db, clear_database, count_queries):  # noqa: F811
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+            r = yield async_requests.get(app.url + "/assignments?course_id=course_2")
+        assert r.json()["success"] is True
+
+        # 50 assignments, each with 5 notebooks, released then submitted 20 times, with feedback on each notebook
+        seed_course(db, assignments=50, notebooks=5, submissions=20)
+
+        with count_queries() as statements:
+            with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+                r = yield async_requests.get(app.url + "/assignments?course_id=course_2")
+        response_data = r.json()
+        assert response_data["success"] is True
+        assert len(response_data["value"]) == 50 * 21
+        submitted = [model for model in response_data["value"] if model["status"] == "submitted"]
+        assert len(submitted) == 50 * 20
+        assert all(len(model["notebooks"]) == 5 for model in submitted)
+        assert all(notebook["has_exchange_feedback"] for model in submitted for notebook in model["notebooks"])
+        # the course, the actions (with their assignments), the notebooks, and the latest feedback
+        assert len(statements) == 4
+
+    # The listing can be filtered, & paged, by the exchange
+    @pytest.mark.gen_test
+    def test_assignments_filters(self, app, db, clear_database):  # noqa: F811
+        url = app.url + "/assignments?course_id=course_2"
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+            r = yield async_requests.get(url)
+            seed_course(db, assignments=3, notebooks=2, submissions=4, releases=2)
+
+            r = yield async_requests.get(url)
+            everything = r.json()["value"]
+            assert len(everything) == 3 * 6
+            assert "next_after_id" not in r.json()
+
+            r = yield async_requests.get(url + "&status=released")
+            assert [m["status"] for m in r.json()["value"]] == ["released"] * 6
+            r = yield async_requests.get(url + "&status=released,submitted")
+            assert len(r.json()["value"]) == 3 * 6
+            r = yield async_requests.get(url + "&status=released&status=fetched")
+            assert len(r.json()["value"]) == 6
+
+            r = yield async_requests.get(url + "&assignment_id=assign_1")
+            assert {m["assignment_id"] for m in r.json()["value"]} == {"assign_1"}
+            assert len(r.json()["value"]) == 6
+
+            # the latest release & submission of each assignment
+            r = yield async_requests.get(url + "&latest_only=true")
+            latest = r.json()["value"]
+            assert len(latest) == 3 * 2
+            for model in latest:
+                same = [
+                    m["action_id"]
+                    for m in everything
+                    if (m["assignment_id"], m["status"]) == (model["assignment_id"], model["status"])
+                ]
+                assert model["action_id"] == max(same)
+
+            # page through everything, two at a time
+            paged, after_id = [], None
+            while True:
+                r = yield async_requests.get(url + "&limit=2" + (f"&after_id={after_id}" if after_id else ""))
+                page = r.json()
+                assert len(page["value"]) <= 2
+                paged.extend(page["value"])
+                after_id = page["next_after_id"]
+                if after_id is None:
+                    break
+            assert [m["action_id"] for m in paged] == sorted(m["action_id"] for m in everything)
+
+            r = yield async_requests.get(url + f"&after_id={paged[-3]['action_id']}")
+            assert [m["action_id"] for m in r.json()["value"]] == [m["action_id"] for m in paged[-2:]]
+            assert r.json()["next_after_id"] is None
+
+    @pytest.mark.gen_test
+    def test_assignments_filters_invalid(self, app, clear_database):  # noqa: F811
+        url = app.url + "/assignments?course_id=course_2"
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+            for params, note in [
+                ("&status=thrown_away", "Unknown status in ['thrown_away']"),
+                ("&limit=0", "limit must be at least 1"),
+                ("&limit=lots", "limit must be a whole number"),
+                ("&after_id=-1", "after_id must be at least 0"),
+            ]:
+                r = yield async_requests.get(url + params)
+                assert r.json() == {"success": False, "note": note, "value": []}
+
+    # Polling with `since` only returns what has changed
+    @pytest.mark.gen_test
+    def test_assignments_since(self, app, db, clear_database):  # noqa: F811
+        url = app.url + "/assignments?course_id=course_2"
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+            r = yield async_requests.get(url)
+            assert r.json()["high_water_mark"] is None
+            seed_course(db, assignments=2, notebooks=1, submissions=2)
+
+            r = yield async_requests.get(url)
+            everything = r.json()["value"]
+            high_water_mark = r.json()["high_water_mark"]
+            assert high_water_mark == max(m["action_id"] for m in everything)
+
+            # nothing new
+            r = yield async_requests.get(url + f"&since={high_water_mark}")
+            assert r.json()["value"] == []
+            assert r.json()["high_water_mark"] == high_water_mark
+
+            seed_course(db, assignments=1, notebooks=1, submissions=1, first=2)
+            r = yield async_requests.get(url + f"&since={high_water_mark}")
+            changes = r.json()["value"]
+            assert [m["assignment_id"] for m in changes] == ["assign_2", "assign_2"]
+            assert all(m["action_id"] > high_water_mark for m in changes)
+            assert r.json()["high_water_mark"] == changes[-1]["action_id"]
+
+            r = yield async_requests.get(url + f"&since={high_water_mark}&status=submitted")
+            assert [m["status"] for m in r.json()["value"]] == ["submitted"]
+
+            r = yield async_requests.get(url + "&since=1&after_id=1")
+            assert r.json()["note"] == "Only one of after_id and since can be given"
+
+    # Feedback is recorded as the instructor's action, but a student polling with `since` sees their own arrive
+    @pytest.mark.gen_test
+    def test_assignments_since_feedback(self, app, clear_database):  # noqa: F811
+        url = app.url + "/assignments?course_id=course_2"
+        assignment = "course_id=course_2&assignment_id=assign_a"
+        with patch.object(BaseHandler, "get_current_user", return_value=user_brobbere_instructor):
+            r = yield async_requests.post(
+                app.url + f"/assignment?{assignment}", files=files, data={"notebooks": ["nb"]}
+            )
+        for student in [user_kiz_student, user_zik_student]:
+            with patch.object(BaseHandler, "get_current_user", return_value=student):
+                r = yield async_requests.post(app.url + f"/submission?{assignment}", files=files)
+        with patch.object(BaseHandler, "get_current_user", return_value=user_zik_student):
+            r = yield async_requests.get(url)
+        high_water_mark = r.json()["high_water_mark"]
+
+        released = {"notebook": "nb", "student": "1-zik", "timestamp": "2024-01-01 00:00:00", "checksum": "1-zik"}
+        with patch.object(BaseHandler, "get_current_user", return_value=user_brobbere_instructor):
+            r = yield async_requests.post(
+                app.url + f"/feedback/batch?{assignment}",
+                data={"manifest": [json.dumps(released)]},
+                files=[("feedback", ("feedback.html", b"feedback"))],
+            )
+        assert r.json()["success"] is True
+
+        with patch.object(BaseHandler, "get_current_user", return_value=user_zik_student):
+            r = yield async_requests.get(url + f"&since={high_water_mark}")
+        assert [m["status"] for m in r.json()["value"]] == ["feedback_released"]
+        assert r.json()["high_water_mark"] > high_water_mark
+        # not someone else's
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+            r = yield async_requests.get(url + f"&since={high_water_mark}")
+        assert r.json()["value"] == []
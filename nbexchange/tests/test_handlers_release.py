@@ -1,8 +1,10 @@
+import hashlib
 import logging
+import os
 import sys
 
 import pytest
-from mock import patch
+from mock import PropertyMock, patch
 
 from nbexchange.handlers.base import BaseHandler
 from nbexchange.tests.utils import (  # noqa: F401 "clear_database"
@@ -159,23 +161,16 @@ def test_post_picks_first_instance_of_param_gets_it_right(app, clear_database):
     assert response_data["note"] == "Released"
 
 
-# Confirm 3 releases lists 3 actions, with 3 different locations
+# Confirm 3 different releases lists 3 actions, with 3 different locations
 # @pytest.mark.skip
 @pytest.mark.gen_test
 def test_post_location_different_each_time(app, clear_database):  # noqa: F811
     with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
-        r = yield async_requests.post(
-            app.url + "/assignment?course_id=course_2&assignment_id=assign_a",
-            files=files,
-        )
-        r = yield async_requests.post(
-            app.url + "/assignment?course_id=course_2&assignment_id=assign_a",
-            files=files,
-        )
-        r = yield async_requests.post(
-            app.url + "/assignment?course_id=course_2&assignment_id=assign_a",
-            files=files,
-        )
+        for version in [b"1", b"2", b"3"]:
+            r = yield async_requests.post(
+                app.url + "/assignment?course_id=course_2&assignment_id=assign_a",
+                files={"assignment": ("assignment.tar.gz", files["assignment"][1] + version)},
+            )
         r = yield async_requests.get(app.url + "/assignments?course_id=course_2")
     assert r.status_code == 200
     response_data = r.json()
@@ -191,6 +186,27 @@ def test_post_location_different_each_time(app, clear_database):  # noqa: F811
     assert actions == ["released", "released", "released"]
 
 
+# Files are stored by their contents: re-releasing the same file records another release, but stores nothing new
+@pytest.mark.gen_test
+def test_post_identical_release_stored_once(app, clear_database):  # noqa: F811
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        for _ in range(3):
+            r = yield async_requests.post(
+                app.url + "/assignment?course_id=course_2&assignment_id=assign_a",
+                files=files,
+            )
+        r = yield async_requests.get(app.url + "/assignments?course_id=course_2")
+    releases = r.json()["value"]
+    assert [release["status"] for release in releases] == ["released", "released", "released"]
+    paths = {release["path"] for release in releases}
+    assert len(paths) == 1
+    [path] = paths
+    digest = hashlib.sha256(files["assignment"][1]).hexdigest()
+    assert path == os.path.join(app.base_storage_location, "blobs", digest[:2], digest)
+    with open(path, "rb") as handle:
+        assert handle.read() == files["assignment"][1]
+
+
 @pytest.mark.gen_test
 def test_blocks_filesize(app, clear_database):  # noqa: F811
     with patch.object(BaseHandler, "max_buffer_size", return_value=int(50)):
@@ -206,3 +222,60 @@ def test_blocks_filesize(app, clear_database):  # noqa: F811
         response_data["note"]
         == "File upload oversize, and rejected. Please reduce the contents of the assignment, re-generate, and re-release"  # noqa: E501 W503
     )
+
+
+BOUNDARY = "nbexchange-test-boundary"
+
+
+def multipart_body(content, notebooks=()):
+    parts = [f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="notebooks"\r\n\r\n{n}\r\n' for n in notebooks]
+    parts.append(
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="assignment"; filename="assignment.tar.gz"\r\n'
+        "Content-Type: application/gzip\r\n\r\n"
+    )
+    return "".join(parts).encode() + content + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def chunked_body(body, chunk_size=1024):
+    """A generator, so requests sends the body with chunked transfer-encoding (no Content-Length)"""
+    for i in range(0, len(body), chunk_size):
+        yield body[i : i + chunk_size]
+
+
+# Uploads are streamed to disk as they arrive, with the form fields kept alongside
+@pytest.mark.gen_test
+def test_post_release_streamed(app, clear_database):  # noqa: F811
+    content = os.urandom(100 * 1024)
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(
+            app.url + "/assignment?course_id=course_2&assignment_id=assign_streamed",
+            data=chunked_body(multipart_body(content, notebooks=["assignment-0.0.1"])),
+            headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+        )
+        assert r.json() == {"success": True, "note": "Released"}
+        r = yield async_requests.get(app.url + "/assignments?course_id=course_2")
+    [release] = r.json()["value"]
+    assert [notebook["notebook_id"] for notebook in release["notebooks"]] == ["assignment-0.0.1"]
+    with open(release["path"], "rb") as handle:
+        assert handle.read() == content
+
+
+# Without a Content-Length, the size limit is applied as the file arrives - and nothing is kept
+@pytest.mark.gen_test
+def test_blocks_filesize_while_streaming(app, clear_database):  # noqa: F811
+    with patch.object(BaseHandler, "max_buffer_size", new_callable=PropertyMock, return_value=1024):
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+            r = yield async_requests.post(
+                app.url + "/assignment?course_id=course_2&assignment_id=assign_oversize",
+                data=chunked_body(multipart_body(os.urandom(10 * 1024))),
+                headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+            )
+    assert r.status_code == 200
+    response_data = r.json()
+    assert response_data["success"] is False
+    assert (
+        response_data["note"]
+        == "File upload oversize, and rejected. Please reduce the contents of the assignment, re-generate, and re-release"  # noqa: E501 W503
+    )
+    stored = os.path.join(app.base_storage_location, "1", "released", "course_2", "assign_oversize")
+    assert [files for _, _, files in os.walk(stored) if files] == []
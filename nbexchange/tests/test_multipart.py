@@ -0,0 +1,105 @@
+import hashlib
+import logging
+import os
+
+import pytest
+
+from nbexchange.multipart import MAX_FIELD_SIZE, MultipartStreamParser, boundary_for
+from nbexchange.storage import LocalStorage
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.ERROR)
+
+BOUNDARY = b"d1c6e6b2f0a64fbba3b19d3f2a0c7b10"
+
+
+def make_body(fields=(), files=()):
+    body = b""
+    for name, value in fields:
+        body += b"--" + BOUNDARY + b"\r\n"
+        body += f'Content-Disposition: form-data; name="{name}"\r\n\r\n'.encode() + value + b"\r\n"
+    for name, filename, content in files:
+        body += b"--" + BOUNDARY + b"\r\n"
+        body += f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'.encode()
+        body += b"Content-Type: application/gzip\r\n\r\n" + content + b"\r\n"
+    return body + b"--" + BOUNDARY + b"--\r\n"
+
+
+def stored_files(root):
+    return [name for _, _, names in os.walk(root) for name in names]
+
+
+def feed(parser, body, chunk_size):
+    for i in range(0, len(body), chunk_size):
+        parser.feed(body[i : i + chunk_size])
+    parser.close()
+
+
+def test_boundary_for():
+    assert boundary_for("multipart/form-data; boundary=abc") == b"abc"
+    assert boundary_for('multipart/form-data; boundary="abc"') == b"abc"
+    assert boundary_for("application/x-www-form-urlencoded") is None
+    assert boundary_for("multipart/form-data") is None
+
+
+# However the body is split up, the result is the same
+@pytest.mark.parametrize("chunk_size", [1, 7, len(BOUNDARY) + 3, 65536])
+def test_parser_streams_file_to_disk(tmp_path, chunk_size):
+    # the content looks a lot like a delimiter, without being one (nor completing one)
+    content = b"x" * 1000 + b"\r\n--" + BOUNDARY[:-1] + b"x" * 1000
+    body = make_body(
+        fields=[("notebooks", b"assignment-0.0.1"), ("notebooks", b"assignment-0.0.2")],
+        files=[("assignment", "assignment.tar.gz", content)],
+    )
+    store = LocalStorage(root=str(tmp_path))
+    parser = MultipartStreamParser(BOUNDARY, store, max_file_size=len(content))
+    feed(parser, body, chunk_size)
+
+    assert parser.error is None
+    assert parser.complete
+    assert parser.arguments == {"notebooks": [b"assignment-0.0.1", b"assignment-0.0.2"]}
+    [file_info] = parser.files["assignment"]
+    assert file_info["filename"] == "assignment.tar.gz"
+    assert file_info["content_type"] == "application/gzip"
+    assert file_info["size"] == len(content)
+    assert file_info["sha256"] == hashlib.sha256(content).hexdigest()
+    assert file_info["path"] == store.location_for(file_info["sha256"])
+    assert stored_files(tmp_path) == [file_info["sha256"]]
+    with open(file_info["path"], "rb") as handle:
+        assert handle.read() == content
+
+
+def test_parser_oversize_file_is_discarded(tmp_path):
+    body = make_body(files=[("assignment", "assignment.tar.gz", b"x" * 1000)])
+    parser = MultipartStreamParser(BOUNDARY, LocalStorage(root=str(tmp_path)), max_file_size=100)
+    parser.feed(body[:500])
+    # Stops as soon as the limit is passed, and removes what it wrote
+    assert parser.oversize
+    assert parser.error
+    assert stored_files(tmp_path) == []
+    parser.feed(body[500:])
+    parser.close()
+    assert parser.files == {}
+
+
+def test_parser_oversize_field(tmp_path):
+    body = make_body(fields=[("notebooks", b"x" * (MAX_FIELD_SIZE + 1))])
+    parser = MultipartStreamParser(BOUNDARY, LocalStorage(root=str(tmp_path)), max_file_size=100)
+    feed(parser, body, 4096)
+    assert parser.error
+    assert not parser.oversize
+
+
+def test_parser_incomplete_body(tmp_path):
+    body = make_body(files=[("assignment", "assignment.tar.gz", b"x" * 1000)])
+    parser = MultipartStreamParser(BOUNDARY, LocalStorage(root=str(tmp_path)), max_file_size=10000)
+    feed(parser, body[:-50], 100)
+    assert parser.error == "Upload incomplete"
+    assert stored_files(tmp_path) == []
+
+
+def test_parser_not_form_data(tmp_path):
+    body = make_body(files=[("assignment", "assignment.tar.gz", b"x")]).replace(b"form-data", b"attachment")
+    parser = MultipartStreamParser(BOUNDARY, LocalStorage(root=str(tmp_path)), max_file_size=10000)
+    feed(parser, body, 100)
+    assert parser.error
@@ -10,12 +10,17 @@ User -> Course -> Subscription -> Assignment -> Action -> Notebook -> Feedback
 
 """
 
+import asyncio
+
 import pytest
+from sqlalchemy import create_engine
 from sqlalchemy.exc import IntegrityError
 
 # NOTE: All objects & relationships that are built up remain until the end of
 # the test-run.
-from nbexchange.models.actions import Action, AssignmentActions
+from nbexchange import database
+from nbexchange.models import Base
+from nbexchange.models.actions import Action, ActionLatest, AssignmentActions
 from nbexchange.models.assignments import Assignment as AssignmentModel
 from nbexchange.models.courses import Course
 from nbexchange.models.feedback import Feedback
@@ -356,6 +361,45 @@ def test_subscription_find_by_set(db, course_strange, user_johaannes):
     assert found_sub.course_id == course_strange.id
 
 
+def test_upsert_user_course_subscription(db):
+    User.upsert(db, name="mal", org_id=3, full_name="Malcolm")
+    Course.upsert(db, code="serenity", org_id=3, title="Firefly")
+    assert Subscription.upsert(db, user_name="mal", course_code="serenity", org_id=3, role="Student") is True
+    db.commit()
+
+    user = db.query(User).filter(User.name == "mal", User.org_id == 3).one()
+    assert user.full_name == "Malcolm"
+    course = Course.find_by_code(db, code="serenity", org_id=3)
+    assert course.course_title == "Firefly"
+    assert Subscription.find_by_set(db, user.id, course.id, "Student") is not None
+
+    rows = Subscription.find_roles_for_user(db, user_name="mal", org_id=3)
+    assert rows == [(user.id, "serenity", "Student")]
+
+
+def test_upsert_is_idempotent(db):
+    User.upsert(db, name="mal", org_id=3, full_name="Captain Reynolds")
+    Course.upsert(db, code="serenity", org_id=3, title="A different title")
+    assert Subscription.upsert(db, user_name="mal", course_code="serenity", org_id=3, role="Student") is False
+    assert Subscription.upsert(db, user_name="mal", course_code="serenity", org_id=3, role="Instructor") is True
+    db.commit()
+    db.expire_all()
+
+    assert db.query(User).filter(User.name == "mal").count() == 1
+    assert db.query(User).filter(User.name == "mal").one().full_name == "Captain Reynolds"
+    # The title is only set on creation
+    assert Course.find_by_code(db, code="serenity", org_id=3).course_title == "Firefly"
+    roles = sorted(role for _, _, role in Subscription.find_roles_for_user(db, user_name="mal", org_id=3))
+    assert roles == ["Instructor", "Student"]
+
+
+def test_upsert_requires_org_id(db):
+    with pytest.raises(ValueError):
+        User.upsert(db, name="mal", org_id=None)
+    with pytest.raises(ValueError):
+        Course.upsert(db, code="serenity", org_id=None)
+
+
 # ## Assignment tests
 # Remember Users, Courses, and Subscriptions are already in the DB
 
@@ -558,6 +602,49 @@ def test_action_find_by_action_distinguish_actions(db, assignment_tree, user_joh
     assert found_recent_a.id != found_recent_b.id
 
 
+def test_action_latest_follows_actions(db, assignment_tree, user_kaylee):
+    def latest():
+        return (
+            db.query(ActionLatest)
+            .filter_by(assignment_id=assignment_tree.id, user_id=user_kaylee.id, action=AssignmentActions.fetched)
+            .one()
+            .action_id
+        )
+
+    def newest():
+        return (
+            db.query(Action)
+            .filter_by(assignment_id=assignment_tree.id, user_id=user_kaylee.id, action=AssignmentActions.fetched)
+            .order_by(Action.id.desc())
+            .first()
+            .id
+        )
+
+    # added to the session
+    for _ in range(2):
+        db.add(Action(user_id=user_kaylee.id, assignment_id=assignment_tree.id, action=AssignmentActions.fetched))
+        db.commit()
+        assert latest() == newest()
+
+    # bulk inserted
+    Action.insert_many(
+        db,
+        [
+            {"user_id": user_kaylee.id, "assignment_id": assignment_tree.id, "action": AssignmentActions.fetched},
+            {"user_id": user_kaylee.id, "assignment_id": assignment_tree.id, "action": "fetched"},
+        ],
+    )
+    db.commit()
+    assert latest() == newest()
+
+    # and rebuilt from scratch
+    summary = {(row.assignment_id, row.user_id, row.action): row.action_id for row in db.query(ActionLatest)}
+    db.query(ActionLatest).delete()
+    assert ActionLatest.rebuild(db) == len(summary)
+    db.commit()
+    assert {(row.assignment_id, row.user_id, row.action): row.action_id for row in db.query(ActionLatest)} == summary
+
+
 def test_action_relationships(db, user_johaannes):
     found_by_pk = Action.find_by_pk(db, 1)
     assert found_by_pk.user.name == user_johaannes.name
@@ -584,6 +671,18 @@ def test_action_can_restrict_assignment_searches(db, assignment_tree):
     assert found is None
 
 
+def test_action_find_for_course(db, assignment_tree, user_johaannes, user_kaylee):
+    with pytest.raises(TypeError):
+        Action.find_for_course(db, "Strange", user_johaannes.id)
+
+    actions = Action.find_for_course(db, assignment_tree.course_id, user_kaylee.id).all()
+    assert actions
+    for action in actions:
+        assert action.action == AssignmentActions.released or action.user_id == user_kaylee.id
+    keys = [(action.assignment_id, action.id) for action in actions]
+    assert keys == sorted(keys, key=lambda key: (-key[0], key[1]))
+
+
 # ## Notebook tests
 # Remember Users, Courses, Subscriptions, Assignments, and Actions are already in the DB
 
@@ -781,6 +880,22 @@ def test_feedback_find_all_for_student_again(db, assignment_tree, user_johaannes
     assert len(feedback) == 2
 
 
+def test_feedback_find_latest_for_student(db, assignment_tree, user_johaannes, user_kaylee):
+    notebooks = [notebook.id for notebook in assignment_tree.notebooks]
+
+    with pytest.raises(TypeError):
+        Feedback.find_latest_for_student(db, "Johannes", notebooks)
+    assert Feedback.find_latest_for_student(db, user_johaannes.id, []) == {}
+
+    latest = Feedback.find_latest_for_student(db, user_johaannes.id, notebooks)
+    assert latest
+    for notebook_id, feedback in latest.items():
+        assert feedback.student_id == user_johaannes.id
+        assert feedback.id == Feedback.find_notebook_for_student(db, notebook_id, user_johaannes.id).id
+    for notebook_id in set(notebooks) - set(latest):
+        assert Feedback.find_notebook_for_student(db, notebook_id, user_johaannes.id) is None
+
+
 def test_all_the_unicode(db, assignment_a2ovi, user_rur, course_strange):
     # subscribe user to course
     # add assignment to course
@@ -819,3 +934,42 @@ def test_all_the_unicode(db, assignment_a2ovi, user_rur, course_strange):
 
     found = Action.find_most_recent_action(db, assignment_a2ovi.id)
     assert found.user.name == user_rur.name
+
+
+def test_async_db_url():
+    assert database.async_db_url("sqlite:///nbexchange.sqlite") == "sqlite+aiosqlite:///nbexchange.sqlite"
+    assert database.async_db_url("postgresql://u:p@host/db") == "postgresql+asyncpg://u:p@host/db"
+    assert database.async_db_url("postgresql+psycopg2://u:p@host/db") == "postgresql+asyncpg://u:p@host/db"
+    with pytest.raises(ValueError):
+        database.async_db_url("oracle://u:p@host/db")
+
+
+# The async finders run the sync finders on an AsyncSession, so need a real (file) database
+def test_async_finders(tmp_path):
+    url = f"sqlite:///{tmp_path}/async.sqlite"
+    schema = create_engine(url)
+    Base.metadata.create_all(schema)
+    schema.dispose()
+
+    async def check():
+        engine = database.init_async_engine(url)
+        try:
+            async with database.async_scoped_session() as session:
+                session.add(User(name="wash", org_id=2))
+                session.add(Course(course_code="firefly", org_id=2))
+
+            async with database.async_scoped_session() as session:
+                user = await User.async_find_by_name(db=session, name="wash")
+                assert user.name == "wash"
+                course = await Course.async_find_by_code(db=session, code="firefly", org_id=2)
+                assert course.course_code == "firefly"
+                # Queries are materialised, as they can't be iterated outside the session
+                assert await AssignmentModel.async_find_for_course(db=session, course_id=course.id) == []
+                assert await User.async_find_by_name(db=session, name="zoe") is None
+        finally:
+            await engine.dispose()
+
+    try:
+        asyncio.run(check())
+    finally:
+        database.async_engine = database.AsyncSession = None
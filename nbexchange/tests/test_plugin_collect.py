@@ -1,4 +1,5 @@
 import io
+import json
 import logging
 import os
 import tarfile
@@ -108,7 +109,7 @@ def test_collect_normal(plugin_config, tmpdir):
         if "collections" in args[0]:
             assert collections is False
             collections = True
-            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_3}")
+            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_3}&latest_only=true")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Response",
@@ -132,7 +133,7 @@ def test_collect_normal(plugin_config, tmpdir):
             assert collection is False
             collection = True
             assert args[0] == (
-                f"collection?course_id={course_id}&assignment_id={ass_1_3}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_3}%2F1%2F"  # noqa: E501
+                f"collection?course_id={course_id}&assignment_id={ass_1_3}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_3}%2F1%2F&user_id={student_id}"  # noqa: E501
             )
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             with tarfile.open(fileobj=tar_file, mode="w:gz") as tar_handle:
@@ -205,7 +206,7 @@ def test_collect_normal_update(plugin_config, tmpdir):
         if "collections" in args[0]:
             assert collections is False
             collections = True
-            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_2}")
+            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_2}&latest_only=true")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Response",
@@ -229,7 +230,7 @@ def test_collect_normal_update(plugin_config, tmpdir):
             assert collection is False
             collection = True
             assert args[0] == (
-                f"collection?course_id={course_id}&assignment_id={ass_1_2}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_2}%2F1%2F"  # noqa: E501
+                f"collection?course_id={course_id}&assignment_id={ass_1_2}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_2}%2F1%2F&user_id={student_id}"  # noqa: E501
             )
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             with tarfile.open(fileobj=tar_file, mode="w:gz") as tar_handle:
@@ -312,7 +313,7 @@ def test_collect_normal_dont_update(plugin_config, tmpdir):
         if "collections" in args[0]:
             assert collections is False
             collections = True
-            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_4}")
+            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_4}&latest_only=true")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Response",
@@ -336,7 +337,7 @@ def test_collect_normal_dont_update(plugin_config, tmpdir):
             assert collection is False
             collection = True
             assert args[0] == (
-                f"collection?course_id={course_id}&assignment_id={ass_1_4}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_4}%2F1%2F"  # noqa: E501
+                f"collection?course_id={course_id}&assignment_id={ass_1_4}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_4}%2F1%2F&user_id={student_id}"  # noqa: E501
             )
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             with tarfile.open(fileobj=tar_file, mode="w:gz") as tar_handle:
@@ -419,7 +420,7 @@ def test_collect_normal_dont_update_old(plugin_config, tmpdir):
         if "collections" in args[0]:
             assert collections is False
             collections = True
-            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_5}")
+            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_5}&latest_only=true")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Response",
@@ -443,7 +444,7 @@ def test_collect_normal_dont_update_old(plugin_config, tmpdir):
             assert collection is False
             collection = True
             assert args[0] == (
-                f"collection?course_id={course_id}&assignment_id={ass_1_5}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_5}%2F1%2F"  # noqa: E501
+                f"collection?course_id={course_id}&assignment_id={ass_1_5}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_5}%2F1%2F&user_id={student_id}"  # noqa: E501
             )
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             with tarfile.open(fileobj=tar_file, mode="w:gz") as tar_handle:
@@ -501,7 +502,7 @@ def test_collect_normal_several(plugin_config, tmpdir):
         if "collections" in args[0]:
             assert collections is False
             collections = True
-            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_1}")
+            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_1}&latest_only=true")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Response",
@@ -525,7 +526,7 @@ def test_collect_normal_several(plugin_config, tmpdir):
             assert collection is False
             collection = True
             assert args[0] == (
-                f"collection?course_id={course_id}&assignment_id={ass_1_1}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_1}%2F1%2F"  # noqa: E501
+                f"collection?course_id={course_id}&assignment_id={ass_1_1}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_1}%2F1%2F&user_id={student_id}"  # noqa: E501
             )
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             with tarfile.open(fileobj=tar_file, mode="w:gz") as tar_handle:
@@ -591,7 +592,7 @@ def test_collect_normal_gradebook_called(plugin_config, tmpdir):
         if "collections" in args[0]:
             assert collections is False
             collections = True
-            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_3}")
+            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_3}&latest_only=true")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Response",
@@ -616,7 +617,7 @@ def test_collect_normal_gradebook_called(plugin_config, tmpdir):
             assert collection is False
             collection = True
             assert args[0] == (
-                f"collection?course_id={course_id}&assignment_id={ass_1_3}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_3}%2F1%2F"  # noqa: E501
+                f"collection?course_id={course_id}&assignment_id={ass_1_3}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_3}%2F1%2F&user_id={student_id}"  # noqa: E501
             )
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             with tarfile.open(fileobj=tar_file, mode="w:gz") as tar_handle:
@@ -676,7 +677,7 @@ def test_collect_normal_gradebook_called_no_space(plugin_config, tmpdir):
         if "collections" in args[0]:
             assert collections is False
             collections = True
-            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_3}")
+            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_3}&latest_only=true")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Response",
@@ -701,7 +702,7 @@ def test_collect_normal_gradebook_called_no_space(plugin_config, tmpdir):
             assert collection is False
             collection = True
             assert args[0] == (
-                f"collection?course_id={course_id}&assignment_id={ass_1_3}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_3}%2F1%2F"  # noqa: E501
+                f"collection?course_id={course_id}&assignment_id={ass_1_3}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_3}%2F1%2F&user_id={student_id}"  # noqa: E501
             )
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             with tarfile.open(fileobj=tar_file, mode="w:gz") as tar_handle:
@@ -761,7 +762,7 @@ def test_collect_normal_gradebook_called_no_full_name(plugin_config, tmpdir):
         if "collections" in args[0]:
             assert collections is False
             collections = True
-            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_3}")
+            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_3}&latest_only=true")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Response",
@@ -785,7 +786,7 @@ def test_collect_normal_gradebook_called_no_full_name(plugin_config, tmpdir):
             assert collection is False
             collection = True
             assert args[0] == (
-                f"collection?course_id={course_id}&assignment_id={ass_1_3}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_3}%2F1%2F"  # noqa: E501
+                f"collection?course_id={course_id}&assignment_id={ass_1_3}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_3}%2F1%2F&user_id={student_id}"  # noqa: E501
             )
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             with tarfile.open(fileobj=tar_file, mode="w:gz") as tar_handle:
@@ -849,7 +850,7 @@ def test_collect_normal_several_gradebook_called(plugin_config, tmpdir):
         tar_file = io.BytesIO()
         if "collections" in args[0]:
             collections = True
-            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_1}")
+            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_1}&latest_only=true")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Response",
@@ -879,7 +880,7 @@ def test_collect_normal_several_gradebook_called(plugin_config, tmpdir):
         else:
             num = "2" if collection else "1"
             assert args[0] == (
-                f"collection?course_id={course_id}&assignment_id={ass_1_1}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_1}%2F{num}%2F"  # noqa: E501
+                f"collection?course_id={course_id}&assignment_id={ass_1_1}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_1}%2F{num}%2F&user_id={num}"  # noqa: E501
             )
             collection = True
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
@@ -932,7 +933,7 @@ def test_collect_normal_several_full_name_none(plugin_config, tmpdir):
         tar_file = io.BytesIO()
         if "collections" in args[0]:
             collections = True
-            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_1}")
+            assert args[0] == (f"collections?course_id={course_id}&assignment_id={ass_1_1}&latest_only=true")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Response",
@@ -962,7 +963,7 @@ def test_collect_normal_several_full_name_none(plugin_config, tmpdir):
         else:
             num = "2" if collection else "1"
             assert args[0] == (
-                f"collection?course_id={course_id}&assignment_id={ass_1_1}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_1}%2F{num}%2F"  # noqa: E501
+                f"collection?course_id={course_id}&assignment_id={ass_1_1}&path=%2Fsubmitted%2F{course_id}%2F{ass_1_1}%2F{num}%2F&user_id={num}"  # noqa: E501
             )
             collection = True
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
@@ -1156,7 +1157,7 @@ def test_collect_with_unicode(plugin_config, tmpdir):
             assert collections is False
             collections = True
             assert args[0] == (
-                f"collections?course_id={urllib.parse.quote_plus(course_id)}&assignment_id={urllib.parse.quote_plus(assignment_id)}"  # noqa: E501
+                f"collections?course_id={urllib.parse.quote_plus(course_id)}&assignment_id={urllib.parse.quote_plus(assignment_id)}&latest_only=true"  # noqa: E501
             )
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
@@ -1181,7 +1182,7 @@ def test_collect_with_unicode(plugin_config, tmpdir):
             assert collection is False
             collection = True
             assert args[0] == (
-                f"collection?course_id={urllib.parse.quote_plus(course_id)}&assignment_id={urllib.parse.quote_plus(assignment_id)}&path=%2Fsubmitted%2F{urllib.parse.quote_plus(course_id)}%2F{urllib.parse.quote_plus(assignment_id)}%2F1%2F"  # noqa: E501
+                f"collection?course_id={urllib.parse.quote_plus(course_id)}&assignment_id={urllib.parse.quote_plus(assignment_id)}&path=%2Fsubmitted%2F{urllib.parse.quote_plus(course_id)}%2F{urllib.parse.quote_plus(assignment_id)}%2F1%2F&user_id={urllib.parse.quote_plus(student_id)}"  # noqa: E501
             )
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             with tarfile.open(fileobj=tar_file, mode="w:gz") as tar_handle:
@@ -1235,7 +1236,7 @@ def test_collect_with_unicode_R2L_language(plugin_config, tmpdir):
             assert collections is False
             collections = True
             assert args[0] == (
-                f"collections?course_id={urllib.parse.quote_plus(course_id)}&assignment_id={urllib.parse.quote_plus(assignment_id)}"  # noqa: E501
+                f"collections?course_id={urllib.parse.quote_plus(course_id)}&assignment_id={urllib.parse.quote_plus(assignment_id)}&latest_only=true"  # noqa: E501
             )
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
@@ -1260,7 +1261,7 @@ def test_collect_with_unicode_R2L_language(plugin_config, tmpdir):
             assert collection is False
             collection = True
             assert args[0] == (
-                f"collection?course_id={urllib.parse.quote_plus(course_id)}&assignment_id={urllib.parse.quote_plus(assignment_id)}&path=%2Fsubmitted%2F{urllib.parse.quote_plus(course_id)}%2F{urllib.parse.quote_plus(assignment_id)}%2F1%2F"  # noqa: E501
+                f"collection?course_id={urllib.parse.quote_plus(course_id)}&assignment_id={urllib.parse.quote_plus(assignment_id)}&path=%2Fsubmitted%2F{urllib.parse.quote_plus(course_id)}%2F{urllib.parse.quote_plus(assignment_id)}%2F1%2F&user_id={urllib.parse.quote_plus(student_id)}"  # noqa: E501
             )
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             with tarfile.open(fileobj=tar_file, mode="w:gz") as tar_handle:
@@ -1291,3 +1292,137 @@ def test_collect_with_unicode_R2L_language(plugin_config, tmpdir):
                 os.path.basename(notebook1_filename),
             )
         )
+
+
+def _submission(notebook_filename):
+    tar_file = io.BytesIO()
+    with tarfile.open(fileobj=tar_file, mode="w:gz") as tar_handle:
+        tar_handle.add(notebook_filename, arcname=os.path.basename(notebook_filename))
+    return tar_file.getvalue()
+
+
+def _add_member(archive, name, content):
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    archive.addfile(info, io.BytesIO(content))
+
+
+# With use_archive, every submission comes in one request
+@pytest.mark.gen_test
+def test_collect_archive(plugin_config, tmpdir):
+    plugin_config.CourseDirectory.course_id = course_id
+    plugin_config.CourseDirectory.assignment_id = ass_1_1
+    plugin_config.CourseDirectory.submitted_directory = str(tmpdir.mkdir("submitted").realpath())
+    plugin_config.ExchangeCollect.use_archive = True
+    plugin = ExchangeCollect(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
+    students = ["1", "2"]
+    requests = []
+
+    def api_request(*args, **kwargs):
+        requests.append(args[0])
+        if args[0].startswith("collections?"):
+            return type(
+                "Response",
+                (object,),
+                {
+                    "status_code": 200,
+                    "headers": {"content-type": "application/json"},
+                    "json": lambda: {
+                        "success": True,
+                        "value": [
+                            {
+                                "student_id": student,
+                                "path": f"/submitted/{course_id}/{ass_1_1}/{student}/",
+                                "timestamp": "2020-01-01 00:00:00.0 UTC",
+                            }
+                            for student in students
+                        ],
+                    },
+                },
+            )
+        assert args[0] == f"collections/archive?course_id={course_id}&assignment_id={ass_1_1}&user_id=1&user_id=2"
+        assert kwargs["stream"] is True
+        manifest = [
+            {"student_id": student, "timestamp": "2020-01-01 00:00:00.0 UTC", "member": f"{student}.tar.gz"}
+            for student in students
+        ]
+        archive_file = io.BytesIO()
+        with tarfile.open(fileobj=archive_file, mode="w") as archive:
+            _add_member(archive, "manifest.json", json.dumps(manifest).encode())
+            _add_member(archive, "1.tar.gz", _submission(notebook1_filename))
+            _add_member(archive, "2.tar.gz", _submission(notebook2_filename))
+        archive_file.seek(0)
+        return type(
+            "Response",
+            (object,),
+            {"status_code": 200, "headers": {"content-type": "application/x-tar"}, "raw": archive_file},
+        )
+
+    with patch.object(Exchange, "api_request", side_effect=api_request):
+        plugin.start()
+    assert len(requests) == 2
+    for student, notebook_filename in [("1", notebook1_filename), ("2", notebook2_filename)]:
+        assert os.listdir(
+            plugin.coursedir.format_path(plugin_config.CourseDirectory.submitted_directory, student, ass_1_1)
+        ) == [os.path.basename(notebook_filename)]
+
+
+# A submission missing from the archive, or that can't be unpacked, is skipped (and logged), not the whole collection
+@pytest.mark.gen_test
+def test_collect_archive_skips_bad_members(plugin_config, tmpdir, caplog):
+    plugin_config.CourseDirectory.course_id = course_id
+    plugin_config.CourseDirectory.assignment_id = ass_1_1
+    plugin_config.CourseDirectory.submitted_directory = str(tmpdir.mkdir("submitted").realpath())
+    plugin_config.ExchangeCollect.use_archive = True
+    plugin = ExchangeCollect(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
+    students = ["1", "2", "3"]
+
+    def api_request(*args, **kwargs):
+        if args[0].startswith("collections?"):
+            return type(
+                "Response",
+                (object,),
+                {
+                    "status_code": 200,
+                    "headers": {"content-type": "application/json"},
+                    "json": lambda: {
+                        "success": True,
+                        "value": [
+                            {
+                                "student_id": student,
+                                "path": f"/submitted/{course_id}/{ass_1_1}/{student}/",
+                                "timestamp": "2020-01-01 00:00:00.0 UTC",
+                            }
+                            for student in students
+                        ],
+                    },
+                },
+            )
+        # No "3", "2" is broken, and a member that isn't in the manifest
+        manifest = [
+            {"student_id": student, "timestamp": "2020-01-01 00:00:00.0 UTC", "member": f"{student}.tar.gz"}
+            for student in ["1", "2"]
+        ]
+        archive_file = io.BytesIO()
+        with tarfile.open(fileobj=archive_file, mode="w") as archive:
+            _add_member(archive, "manifest.json", json.dumps(manifest).encode())
+            _add_member(archive, "stray.tar.gz", _submission(notebook2_filename))
+            _add_member(archive, "2.tar.gz", b"not a tar file")
+            _add_member(archive, "1.tar.gz", _submission(notebook1_filename))
+        archive_file.seek(0)
+        return type(
+            "Response",
+            (object,),
+            {"status_code": 200, "headers": {"content-type": "application/x-tar"}, "raw": archive_file},
+        )
+
+    with patch.object(Exchange, "api_request", side_effect=api_request):
+        plugin.start()
+    submitted = plugin_config.CourseDirectory.submitted_directory
+    assert os.listdir(plugin.coursedir.format_path(submitted, "1", ass_1_1)) == [os.path.basename(notebook1_filename)]
+    for student in ["2", "3"]:
+        assert not os.path.exists(plugin.coursedir.format_path(submitted, student, ass_1_1))
+    assert "Skipping stray.tar.gz" in caplog.text
+    assert "Unable to unpack the submission of 2" in caplog.text
+    assert "No submission for 2 in the download" not in caplog.text
+    assert "No submission for 3 in the download" in caplog.text
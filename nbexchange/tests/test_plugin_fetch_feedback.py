@@ -1,7 +1,10 @@
+import io
+import json
 import logging
 import os
 import re
 import sys
+import tarfile
 
 import pytest
 from mock import patch
@@ -57,7 +60,7 @@ def test_fetch_feedback_dir_created(plugin_config, tmpdir):
     plugin = ExchangeFetchFeedback(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
     def api_request(*args, **kwargs):
-        assert args[0] == ("feedback?course_id=no_course&assignment_id=assign_1")
+        assert args[0] == ("feedback?course_id=no_course&assignment_id=assign_1&manifest=true")
         return type(
             "Response",
             (object,),
@@ -85,7 +88,7 @@ def test_fetch_feedback_dir_created_with_course_id(plugin_config, tmpdir):
     plugin = ExchangeFetchFeedback(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
     def api_request(*args, **kwargs):
-        assert args[0] == ("feedback?course_id=no_course&assignment_id=assign_1")
+        assert args[0] == ("feedback?course_id=no_course&assignment_id=assign_1&manifest=true")
         return type(
             "Response",
             (object,),
@@ -117,7 +120,7 @@ def test_fetch_feedback_fetch_normal(plugin_config, tmpdir):
     plugin = ExchangeFetchFeedback(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
     def api_request(*args, **kwargs):
-        assert args[0] == ("feedback?course_id=no_course&assignment_id=assign_1")
+        assert args[0] == ("feedback?course_id=no_course&assignment_id=assign_1&manifest=true")
         assert "method" not in kwargs or kwargs.get("method").lower() == "get"
         return type(
             "Response",
@@ -152,7 +155,7 @@ def test_fetch_feedback_fetch_several_normal(plugin_config, tmpdir):
     plugin = ExchangeFetchFeedback(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
     def api_request(*args, **kwargs):
-        assert args[0] == ("feedback?course_id=no_course&assignment_id=assign_1")
+        assert args[0] == ("feedback?course_id=no_course&assignment_id=assign_1&manifest=true")
         assert "method" not in kwargs or kwargs.get("method").lower() == "get"
         return type(
             "Response",
@@ -183,3 +186,59 @@ def test_fetch_feedback_fetch_several_normal(plugin_config, tmpdir):
 
         assert os.path.exists(os.path.join(plugin.dest_path, "2020-01-01 00:00:01 00:00", "test_feedback1.html"))
         assert os.path.exists(os.path.join(plugin.dest_path, "2020-01-01 00:00:00 00:00", "test_feedback2.html"))
+
+
+# Files not in the listing are downloaded in one archive
+@pytest.mark.gen_test
+def test_fetch_feedback_fetch_archive(plugin_config, tmpdir):
+    plugin_config.Exchange.assignment_dir = str(tmpdir.mkdir("feedback_test").realpath())
+    plugin_config.CourseDirectory.course_id = "no_course"
+    plugin_config.CourseDirectory.assignment_id = assignment_id
+
+    plugin = ExchangeFetchFeedback(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
+    manifest = [
+        {
+            "filename": f"test_feedback{i}.html",
+            "timestamp": f"2020-01-01 00:00:0{i} 00:00",
+            "checksum": "abc",
+            "token": str(i),
+            "member": f"2020-01-01 00:00:0{i} 00:00/test_feedback{i}.html",
+        }
+        for i in range(2)
+    ]
+
+    def add_member(archive, name, content):
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        archive.addfile(info, io.BytesIO(content))
+
+    def api_request(*args, **kwargs):
+        if args[0].startswith("feedback?"):
+            return type(
+                "Response",
+                (object,),
+                {
+                    "status_code": 200,
+                    "headers": {"content-type": "text/json"},
+                    "json": lambda: {"success": True, "feedback": [dict(f, member=None) for f in manifest]},
+                },
+            )
+        assert args[0] == "feedback/archive?course_id=no_course&assignment_id=assign_1"
+        assert kwargs["stream"] is True
+        archive_file = io.BytesIO()
+        with tarfile.open(fileobj=archive_file, mode="w") as archive:
+            add_member(archive, "manifest.json", json.dumps(manifest).encode())
+            for f in manifest:
+                add_member(archive, f["member"], f"feedback {f['token']}".encode())
+        archive_file.seek(0)
+        return type(
+            "Response",
+            (object,),
+            {"status_code": 200, "headers": {"content-type": "application/x-tar"}, "raw": archive_file},
+        )
+
+    with patch.object(Exchange, "api_request", side_effect=api_request):
+        plugin.start()
+    for f in manifest:
+        with open(os.path.join(plugin.dest_path, f["timestamp"], f["filename"])) as handle:
+            assert handle.read() == f"feedback {f['token']}"
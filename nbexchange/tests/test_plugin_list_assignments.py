@@ -29,7 +29,7 @@ def test_list_acknowledges_multi_marker_feature_flag(plugin_config, tmpdir, monk
     plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
     def api_request(*args, **kwargs):
-        assert args[0] == ("assignments?course_id=no_course")
+        assert args[0] == ("assignments?course_id=no_course&status=submitted")
         assert "method" not in kwargs or kwargs.get("method").lower() == "get"
         return type(
             "Request",
@@ -81,7 +81,7 @@ def test_list_normal(plugin_config, tmpdir):
     plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
     def api_request(*args, **kwargs):
-        assert args[0] == ("assignments?course_id=no_course")
+        assert args[0] == ("assignments?course_id=no_course&status=released")
         assert "method" not in kwargs or kwargs.get("method").lower() == "get"
         return type(
             "Request",
@@ -144,7 +144,7 @@ def test_list_normal_multiple(plugin_config, tmpdir):
     plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
     def api_request(*args, **kwargs):
-        assert args[0] == ("assignments?course_id=no_course")
+        assert args[0] == ("assignments?course_id=no_course&status=released")
         assert "method" not in kwargs or kwargs.get("method").lower() == "get"
         return type(
             "Request",
@@ -241,7 +241,7 @@ def test_list_normal_multiple_released(plugin_config, tmpdir):
         plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
         def api_request(*args, **kwargs):
-            assert args[0] == ("assignments?course_id=no_course")
+            assert args[0] == ("assignments?course_id=no_course&status=released")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Request",
@@ -355,7 +355,7 @@ def test_list_normal_multiple_released_duplicates(plugin_config, tmpdir):
         plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
         def api_request(*args, **kwargs):
-            assert args[0] == ("assignments?course_id=no_course")
+            assert args[0] == ("assignments?course_id=no_course&status=released")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Request",
@@ -472,7 +472,7 @@ def test_list_fetched(plugin_config, tmpdir):
         plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
         def api_request(*args, **kwargs):
-            assert args[0] == ("assignments?course_id=no_course")
+            assert args[0] == ("assignments?course_id=no_course&status=released")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Request",
@@ -564,7 +564,7 @@ def test_list_fetched_with_path_includes_course(plugin_config, tmpdir):
         plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
         def api_request(*args, **kwargs):
-            assert args[0] == ("assignments?course_id=no_course")
+            assert args[0] == ("assignments?course_id=no_course&status=released")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Request",
@@ -652,7 +652,7 @@ def test_list_fetched_rerelease_ignored(plugin_config, tmpdir):
         plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
         def api_request(*args, **kwargs):
-            assert args[0] == ("assignments?course_id=no_course")
+            assert args[0] == ("assignments?course_id=no_course&status=released")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Request",
@@ -756,7 +756,7 @@ def test_list_multiple_fetch(plugin_config, tmpdir):
         plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
         def api_request(*args, **kwargs):
-            assert args[0] == ("assignments?course_id=no_course")
+            assert args[0] == ("assignments?course_id=no_course&status=released")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Request",
@@ -860,7 +860,7 @@ def test_list_fetch_without_release_ignored(plugin_config, tmpdir):
         plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
         def api_request(*args, **kwargs):
-            assert args[0] == ("assignments?course_id=no_course")
+            assert args[0] == ("assignments?course_id=no_course&status=released")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Request",
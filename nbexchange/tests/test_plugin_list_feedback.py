@@ -43,7 +43,7 @@ def test_list_no_submitted_records(plugin_config, tmpdir):
     plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
     def api_request(*args, **kwargs):
-        assert args[0] == ("assignments?course_id=no_course")
+        assert args[0] == ("assignments?course_id=no_course&status=submitted")
         assert "method" not in kwargs or kwargs.get("method").lower() == "get"
         return type(
             "Request",
@@ -105,7 +105,7 @@ def test_list_submit_one(plugin_config, tmpdir):
     plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
     def api_request(*args, **kwargs):
-        assert args[0] == ("assignments?course_id=no_course")
+        assert args[0] == ("assignments?course_id=no_course&status=submitted")
         assert "method" not in kwargs or kwargs.get("method").lower() == "get"
         return type(
             "Request",
@@ -183,7 +183,7 @@ def test_list_submit_several_submissions(plugin_config, tmpdir):
     plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
     def api_request(*args, **kwargs):
-        assert args[0] == ("assignments?course_id=no_course")
+        assert args[0] == ("assignments?course_id=no_course&status=submitted")
         assert "method" not in kwargs or kwargs.get("method").lower() == "get"
         return type(
             "Request",
@@ -337,7 +337,7 @@ def test_list_submit_multipule_students(plugin_config, tmpdir):
     plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
     def api_request(*args, **kwargs):
-        assert args[0] == ("assignments?course_id=no_course")
+        assert args[0] == ("assignments?course_id=no_course&status=submitted")
         assert "method" not in kwargs or kwargs.get("method").lower() == "get"
         return type(
             "Request",
@@ -507,7 +507,7 @@ def test_list_submit_multiple_assignments(plugin_config, tmpdir):
     plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
     def api_request(*args, **kwargs):
-        assert args[0] == ("assignments?course_id=no_course")
+        assert args[0] == ("assignments?course_id=no_course&status=submitted")
         assert "method" not in kwargs or kwargs.get("method").lower() == "get"
         return type(
             "Request",
@@ -691,7 +691,7 @@ def test_list_feedback_available(plugin_config, tmpdir):
         plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
         def api_request(*args, **kwargs):
-            assert args[0] == ("assignments?course_id=no_course")
+            assert args[0] == ("assignments?course_id=no_course&status=submitted")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Request",
@@ -786,7 +786,7 @@ def test_list_feedback_available_with_path_includes_course(plugin_config, tmpdir
         plugin = ExchangeList(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
         def api_request(*args, **kwargs):
-            assert args[0] == ("assignments?course_id=no_course")
+            assert args[0] == ("assignments?course_id=no_course&status=submitted")
             assert "method" not in kwargs or kwargs.get("method").lower() == "get"
             return type(
                 "Request",
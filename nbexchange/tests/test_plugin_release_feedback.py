@@ -1,3 +1,4 @@
+import json
 import logging
 import os
 import re
@@ -103,6 +104,7 @@ def test_release_feedback_fetch_normal(plugin_config, tmpdir):
         unique_key,
     )
 
+    plugin_config.ExchangeReleaseFeedback.feedback_batch_size = 0
     plugin = ExchangeReleaseFeedback(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
 
     def api_request(*args, **kwargs):
@@ -175,6 +177,7 @@ def test_release_feedback_fetch_several_normal(plugin_config, tmpdir):
         unique_key2,
     )
 
+    plugin_config.ExchangeReleaseFeedback.feedback_batch_size = 0
     plugin = ExchangeReleaseFeedback(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
     seen_feedback1 = False
     seen_feedback2 = False
@@ -292,3 +295,88 @@ def test_release_feedback_fetch_fail(plugin_config, tmpdir):
         with pytest.raises(ExchangeError) as e_info:
             plugin.start()
         assert str(e_info.value) == "failure note"
+
+
+def make_feedback(feedback_directory, submitted_directory, students, notebooks):
+    """Feedback for each of the students' notebooks, as nbgrader generates it"""
+    for student in students:
+        os.makedirs(os.path.join(feedback_directory, student, assignment_id), exist_ok=True)
+        os.makedirs(os.path.join(submitted_directory, student, assignment_id), exist_ok=True)
+        for notebook in notebooks:
+            copyfile(feedback1_filename, os.path.join(feedback_directory, student, assignment_id, f"{notebook}.html"))
+            copyfile(notebook1_filename, os.path.join(submitted_directory, student, assignment_id, f"{notebook}.ipynb"))
+        with open(os.path.join(feedback_directory, student, assignment_id, "timestamp.txt"), "w") as fp:
+            fp.write("2020-01-01 00:00:00.0 UTC")
+
+
+# All the feedback goes in batches of feedback_batch_size
+@pytest.mark.gen_test
+def test_release_feedback_batches(plugin_config, tmpdir):
+    feedback_directory = str(tmpdir.mkdir("feedback_test").realpath())
+    submitted_directory = str(tmpdir.mkdir("submitted_test").realpath())
+    plugin_config.CourseDirectory.root = "/"
+    plugin_config.CourseDirectory.feedback_directory = feedback_directory
+    plugin_config.CourseDirectory.submitted_directory = submitted_directory
+    plugin_config.CourseDirectory.assignment_id = assignment_id
+    plugin_config.ExchangeReleaseFeedback.feedback_batch_size = 4
+    make_feedback(feedback_directory, submitted_directory, ["1", "2", "3"], ["feedback1", "feedback2"])
+
+    plugin = ExchangeReleaseFeedback(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
+    batches = []
+
+    def api_request(*args, **kwargs):
+        assert args[0] == f"feedback/batch?course_id=no_course&assignment_id={assignment_id}"
+        assert kwargs.get("method").lower() == "post"
+        manifest = [json.loads(entry) for entry in kwargs["data"]["manifest"]]
+        assert len(manifest) == len(kwargs["files"])
+        assert all(name == "feedback" for name, _ in kwargs["files"])
+        batches.append(manifest)
+        return type(
+            "Request",
+            (object,),
+            {"status_code": 200, "json": (lambda: {"success": True})},
+        )
+
+    with patch.object(Exchange, "api_request", side_effect=api_request):
+        plugin.start()
+    assert [len(batch) for batch in batches] == [4, 2]
+    released = sorted((entry["student"], entry["notebook"]) for batch in batches for entry in batch)
+    assert released == [(s, n) for s in ["1", "2", "3"] for n in ["feedback1", "feedback2"]]
+    for entry in batches[0]:
+        assert entry["timestamp"] == "2020-01-01 00:00:00.000000 UTC"
+        unique_key = make_unique_key(
+            "no_course", assignment_id, entry["notebook"], entry["student"], "2020-01-01 00:00:00.0 UTC"
+        )
+        assert entry["checksum"] == notebook_hash(
+            os.path.join(submitted_directory, entry["student"], assignment_id, f"{entry['notebook']}.ipynb"),
+            unique_key,
+        )
+
+
+# An exchange without feedback/batch gets each file on its own
+@pytest.mark.gen_test
+def test_release_feedback_batches_not_supported(plugin_config, tmpdir):
+    feedback_directory = str(tmpdir.mkdir("feedback_test").realpath())
+    submitted_directory = str(tmpdir.mkdir("submitted_test").realpath())
+    plugin_config.CourseDirectory.root = "/"
+    plugin_config.CourseDirectory.feedback_directory = feedback_directory
+    plugin_config.CourseDirectory.submitted_directory = submitted_directory
+    plugin_config.CourseDirectory.assignment_id = assignment_id
+    make_feedback(feedback_directory, submitted_directory, ["1", "2"], ["feedback1"])
+
+    plugin = ExchangeReleaseFeedback(coursedir=CourseDirectory(config=plugin_config), config=plugin_config)
+    requests = []
+
+    def api_request(*args, **kwargs):
+        requests.append(args[0])
+        status_code = 404 if args[0].startswith("feedback/batch") else 200
+        return type(
+            "Request",
+            (object,),
+            {"status_code": status_code, "json": (lambda: {"success": True})},
+        )
+
+    with patch.object(Exchange, "api_request", side_effect=api_request):
+        plugin.start()
+    assert requests[0].startswith("feedback/batch?")
+    assert sorted(re.search(r"&student=(\w+)", url).group(1) for url in requests[1:]) == ["1", "2"]
@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from nbexchange.app import NbExchange
+
+# Multiprocess mode is chosen when prometheus_client is imported, so needs a fresh interpreter
+WORKERS = textwrap.dedent(
+    """
+    import os
+
+    from prometheus_client import generate_latest
+
+    from nbexchange import metrics
+
+    pid = os.fork()
+    metrics.DB_POOL_CHECKOUTS.inc()
+    metrics.EXECUTOR_ACTIVE.inc()
+    if pid == 0:
+        # a worker that has stopped
+        metrics.mark_process_dead()
+        os._exit(0)
+    os.waitpid(pid, 0)
+    print(generate_latest(metrics.registry()).decode())
+    """
+)
+
+
+def test_metrics_from_every_worker(tmp_path):
+    published = subprocess.run(
+        [sys.executable, "-c", WORKERS],
+        env=dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path)),
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    # counted by both
+    assert "nbexchange_db_pool_checkouts_total 2.0" in published
+    # but only the worker still running is busy
+    assert "nbexchange_executor_active_tasks 1.0" in published
+
+
+def test_workers_need_a_shared_database(monkeypatch, tmp_path):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    with pytest.raises(SystemExit):
+        NbExchange(num_processes=2, db_url="sqlite:///:memory:").fork_workers()
+
+
+def test_workers_need_multiprocess_metrics(monkeypatch, tmp_path):
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    with pytest.raises(SystemExit):
+        NbExchange(num_processes=2, db_url=f"sqlite:///{tmp_path}/nbexchange.sqlite").fork_workers()
+
+
+def test_workers_cannot_use_replicas(monkeypatch, tmp_path):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    app = NbExchange(
+        num_processes=2,
+        db_url=f"sqlite:///{tmp_path}/nbexchange.sqlite",
+        db_replica_urls=[f"sqlite:///{tmp_path}/replica.sqlite"],
+    )
+    with pytest.raises(SystemExit):
+        app.fork_workers()
@@ -0,0 +1,115 @@
+"""The most-used finders are answered from an index, not a table scan
+
+SQLite always runs. Postgres runs when NBEX_TEST_POSTGRES_URL names a database the tests
+may create (and drop) the exchange tables in.
+"""
+
+import os
+import re
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from nbexchange.models import Base
+from nbexchange.models.actions import Action, AssignmentActions
+from nbexchange.models.assignments import Assignment
+from nbexchange.models.feedback import Feedback
+from nbexchange.tests.utils import capture_statements
+
+POSTGRES_URL = os.environ.get("NBEX_TEST_POSTGRES_URL")
+
+
+@pytest.fixture(
+    params=[
+        "sqlite",
+        pytest.param(
+            "postgresql", marks=pytest.mark.skipif(not POSTGRES_URL, reason="NBEX_TEST_POSTGRES_URL is not set")
+        ),
+    ]
+)
+def engine(request, tmpdir):
+    if request.param == "sqlite":
+        engine = create_engine("sqlite:///" + os.path.join(str(tmpdir), "nbexchange.sqlite"))
+    else:
+        engine = create_engine(POSTGRES_URL)
+    Base.metadata.create_all(engine)
+    yield engine
+    if request.param == "postgresql":
+        Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+def query_plan(engine, finder):
+    """The plan for the (last) query `finder(session)` makes, as text"""
+    with capture_statements(engine, parameters=True) as statements:
+        with Session(bind=engine) as session:
+            finder(session)
+    statement, parameters = statements[-1]
+
+    with engine.connect() as connection:
+        if engine.dialect.name == "sqlite":
+            rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+            return "\n".join(row[3] for row in rows)
+        # The tables are empty: make the planner show what it would do with real ones
+        connection.exec_driver_sql("SET enable_seqscan = off")
+        rows = connection.exec_driver_sql("EXPLAIN " + statement, parameters)
+        return "\n".join(row[0] for row in rows)
+
+
+def assert_uses_index(plan, index):
+    if re.search(r"SEARCH \w+ USING (COVERING )?INDEX " + index + r"\b", plan):
+        return
+    if re.search(r"Index (Only )?Scan (Backward )?using " + index + r"\b", plan):
+        return
+    raise AssertionError(f"{index} is not used by:\n{plan}")
+
+
+def primary_key(engine, table):
+    """The name of `table`'s primary key index"""
+    if engine.dialect.name == "sqlite":
+        return f"sqlite_autoindex_{table}_1"
+    return f"{table}_pkey"
+
+
+def test_most_recent_action_of_a_kind(engine):
+    plan = query_plan(
+        engine,
+        lambda db: Action.find_most_recent_action(db, assignment_id=1, action=AssignmentActions.released),
+    )
+    assert_uses_index(plan, primary_key(engine, "action_latest"))
+
+
+def test_most_recent_action_at_a_location(engine):
+    plan = query_plan(
+        engine,
+        lambda db: Action.find_most_recent_action(
+            db, assignment_id=1, action=AssignmentActions.submitted, location="/submitted/1/abc/1/x.tar.gz"
+        ),
+    )
+    assert re.search("ix_action_assignment_id_(action_id|location)", plan), plan
+
+
+def test_submissions(engine):
+    plan = query_plan(engine, lambda db: Action.find_submissions(db, assignment_id=1).all())
+    assert_uses_index(plan, "ix_action_assignment_id_action_id")
+
+
+def test_latest_submissions(engine):
+    plan = query_plan(engine, lambda db: Action.find_submissions(db, assignment_id=1, latest_only=True).all())
+    assert_uses_index(plan, primary_key(engine, "action_latest"))
+
+
+def test_assignment_for_a_submission(engine):
+    plan = query_plan(
+        engine,
+        lambda db: Assignment.find_for_course(
+            db, course_id=1, action=AssignmentActions.submitted, path="/submitted/1/abc/1/x.tar.gz"
+        ).all(),
+    )
+    assert_uses_index(plan, "ix_action_assignment_id_location")
+
+
+def test_feedback_for_a_notebook(engine):
+    plan = query_plan(engine, lambda db: Feedback.find_notebook_for_student(db, notebook_id=1, student_id=1))
+    assert_uses_index(plan, "ix_feedback_2_notebook_id_student_id_id")
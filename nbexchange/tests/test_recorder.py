@@ -0,0 +1,115 @@
+import logging
+import sys
+
+import pytest
+from mock import patch
+from sqlalchemy import exc
+
+from nbexchange.database import scoped_session
+from nbexchange.handlers.base import BaseHandler
+from nbexchange.models.actions import Action, AssignmentActions
+from nbexchange.recorder import ActionRecorder
+from nbexchange.tests.utils import (  # noqa: F401 "clear_database"
+    async_requests,
+    clear_database,
+    get_files_dict,
+    user_kiz_instructor,
+    user_kiz_student,
+)
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.ERROR)
+
+# set up the file to be uploaded as part of the testing later
+files = get_files_dict(sys.argv[0])  # ourself :)
+
+
+def fetched_actions():
+    """The timestamps of the fetches recorded"""
+    with scoped_session() as session:
+        return [
+            action.timestamp
+            for action in session.query(Action).filter(Action.action == AssignmentActions.fetched).order_by(Action.id)
+        ]
+
+
+def test_recorder_bounded():
+    recorder = ActionRecorder(maxsize=3)
+    assert recorder.record([{"user_id": 1}, {"user_id": 2}])
+    # all or nothing
+    assert not recorder.record([{"user_id": 3}, {"user_id": 4}])
+    assert len(recorder) == 2
+    assert recorder.record([{"user_id": 3}])
+    assert len(recorder) == 3
+
+
+def test_recorder_keeps_what_it_cannot_write():
+    recorder = ActionRecorder(maxsize=10, batch_size=2, max_retries=1)
+    recorder.record([{"user_id": 1}, {"user_id": 2}, {"user_id": 3}])
+    locked = exc.OperationalError("INSERT INTO action", {}, Exception("database is locked"))
+    with patch("nbexchange.recorder.scoped_session", side_effect=locked):
+        assert recorder.flush() == 0
+        assert len(recorder) == 3
+        assert [action["user_id"] for _, action, _ in recorder._pending] == [1, 2, 3]
+        # but not forever
+        assert recorder.flush() == 0
+        assert recorder.flush() == 0
+    assert [action["user_id"] for _, action, _ in recorder._pending] == [3]
+
+
+# An action that can never be written doesn't hold up the ones queued behind it
+@pytest.mark.gen_test
+def test_recorder_drops_what_can_never_be_written(app, clear_database):  # noqa: F811
+    url = app.url + "/assignment?course_id=course_2&assignment_id=assign_a"
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        yield async_requests.post(url, files=files)
+    with scoped_session() as session:
+        released = session.query(Action).one()
+        user_id, assignment_id = released.user_id, released.assignment_id
+
+    recorder = ActionRecorder(maxsize=10)
+    fetched = {"user_id": user_id, "action": AssignmentActions.fetched}
+    # eg the assignment has been deleted since
+    recorder.record([dict(fetched, assignment_id=assignment_id + 1), dict(fetched, assignment_id=assignment_id)])
+    assert recorder.flush() == 1
+    assert len(recorder) == 0
+    assert len(fetched_actions()) == 1
+
+
+# The fetch is recorded after the download, by the recorder
+@pytest.mark.gen_test
+def test_fetch_recorded_write_behind(app, clear_database):  # noqa: F811
+    recorder = ActionRecorder(maxsize=100, batch_size=2, executor=app.tornado_settings["executor"])
+    url = app.url + "/assignment?course_id=course_2&assignment_id=assign_a"
+    with patch.dict(app.tornado_application.settings, {"action_recorder": recorder}):
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+            r = yield async_requests.post(url, files=files)
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+            for _ in range(3):
+                r = yield async_requests.get(url)
+                assert r.status_code == 200
+
+    assert fetched_actions() == []
+    assert len(recorder) == 3
+    queued = [action["timestamp"] for _, action, _ in recorder._pending]
+
+    yield recorder.flush_async()
+    assert len(recorder) == 0
+    fetched = fetched_actions()
+    assert len(fetched) == 3
+    # timestamped when they happened, not when they were written
+    assert fetched == queued
+
+
+# If the queue is full, the fetch is recorded with the request
+@pytest.mark.gen_test
+def test_fetch_recorded_when_queue_full(app, clear_database):  # noqa: F811
+    recorder = ActionRecorder(maxsize=0)
+    url = app.url + "/assignment?course_id=course_2&assignment_id=assign_a"
+    with patch.dict(app.tornado_application.settings, {"action_recorder": recorder}):
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+            r = yield async_requests.post(url, files=files)
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+            r = yield async_requests.get(url)
+    assert r.status_code == 200
+    assert len(fetched_actions()) == 1
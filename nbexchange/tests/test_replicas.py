@@ -0,0 +1,117 @@
+import logging
+import sys
+
+import pytest
+from mock import patch
+
+from nbexchange import replicas
+from nbexchange.app import NbExchange
+from nbexchange.handlers.base import BaseHandler
+from nbexchange.models import Base
+from nbexchange.replicas import ReplicaSet
+from nbexchange.tests.utils import (  # noqa: F401 "clear_database"
+    async_requests,
+    clear_database,
+    get_files_dict,
+    user_kiz_instructor,
+    user_kiz_student,
+)
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.ERROR)
+
+# set up the file to be uploaded as part of the testing later
+files = get_files_dict(sys.argv[0])  # ourself :)
+
+
+@pytest.fixture
+def replica_set(tmp_path):
+    """One (empty) replica, and a read-your-writes window longer than any test"""
+    replica_set = ReplicaSet([f"sqlite:///{tmp_path}/replica.sqlite"])
+    Base.metadata.create_all(replica_set.replicas[0].engine)
+    replicas.recent_writers.configure(maxsize=100, ttl=600)
+    yield replica_set
+    replicas.recent_writers.configure(maxsize=0, ttl=0)
+    replica_set.dispose()
+
+
+def test_replicas_round_robin(tmp_path):
+    replica_set = ReplicaSet([f"sqlite:///{tmp_path}/{name}.sqlite" for name in ("a", "b", "c")])
+    a, b, c = replica_set.replicas
+    assert [replica_set.choose() for _ in range(4)] == [a, b, c, a]
+    b.healthy = False
+    assert {replica_set.choose() for _ in range(4)} == {a, c}
+    a.healthy = c.healthy = False
+    assert replica_set.choose() is None
+
+
+def test_replicas_health_check(tmp_path):
+    replica_set = ReplicaSet([f"sqlite:///{tmp_path}/a.sqlite", f"sqlite:///{tmp_path}/missing/b.sqlite"])
+    assert replica_set.check() == 1
+    assert [replica.healthy for replica in replica_set.replicas] == [True, False]
+    # back in rotation once it passes
+    (tmp_path / "missing").mkdir()
+    assert replica_set.check() == 2
+
+
+# The listing is read from the replica - unless the user has just written something
+@pytest.mark.gen_test
+def test_listing_read_from_replica(app, clear_database, replica_set):  # noqa: F811
+    listing = app.url + "/assignments?course_id=course_2"
+    with patch.dict(app.tornado_application.settings, {"db_replicas": replica_set}):
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+            r = yield async_requests.post(
+                app.url + "/assignment?course_id=course_2&assignment_id=assign_a", files=files
+            )
+            assert r.json()["success"] is True
+            # the instructor has just released: they see it
+            r = yield async_requests.get(listing)
+            assert [assignment["status"] for assignment in r.json()["value"]] == ["released"]
+
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_student):
+            # the student's first request adds them to the course: a write
+            r = yield async_requests.get(listing)
+            assert [assignment["status"] for assignment in r.json()["value"]] == ["released"]
+
+            # later, reads go to the replica (which, here, never catches up)
+            replicas.recent_writers.clear()
+            r = yield async_requests.get(listing)
+            assert r.json()["value"] == []
+
+            # until they do something
+            r = yield async_requests.post(
+                app.url + "/submission?course_id=course_2&assignment_id=assign_a", files=files
+            )
+            assert r.json()["success"] is True
+            r = yield async_requests.get(listing)
+            assert [assignment["status"] for assignment in r.json()["value"]] == ["released", "submitted"]
+
+
+# A replica that fails is taken out of rotation, and the read goes to the primary
+@pytest.mark.gen_test
+def test_listing_falls_back_to_primary(app, clear_database, replica_set, tmp_path):  # noqa: F811
+    broken = ReplicaSet([f"sqlite:///{tmp_path}/missing/replica.sqlite"])
+    listing = app.url + "/assignments?course_id=course_2"
+    with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+        r = yield async_requests.post(app.url + "/assignment?course_id=course_2&assignment_id=assign_a", files=files)
+        replicas.recent_writers.clear()
+        with patch.dict(app.tornado_application.settings, {"db_replicas": broken}):
+            r = yield async_requests.get(listing)
+    assert [assignment["status"] for assignment in r.json()["value"]] == ["released"]
+    assert broken.replicas[0].healthy is False
+    broken.dispose()
+
+
+def test_stop_stops_health_checks(io_loop, _nbexchange_config, tmp_path):
+    config = _nbexchange_config.copy()
+    config.NbExchange.db_replica_urls = [f"sqlite:///{tmp_path}/replica.sqlite"]
+    app = NbExchange.instance(config=config)
+    try:
+        app.initialize([])
+        app.start(run_loop=False)
+        checker = app._replica_checker
+        assert checker.is_running()
+        app.stop()
+        assert not checker.is_running()
+    finally:
+        NbExchange.clear_instance()
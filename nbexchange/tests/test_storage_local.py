@@ -0,0 +1,93 @@
+import hashlib
+import logging
+import os
+
+import pytest
+
+from nbexchange.storage import LocalStorage
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.ERROR)
+
+
+def stored_files(root):
+    return sorted(name for _, _, names in os.walk(root) for name in names)
+
+
+def test_put_stores_by_digest(tmp_path):
+    store = LocalStorage(root=str(tmp_path))
+    path, digest = store.put(b"feedback")
+    assert digest == hashlib.sha256(b"feedback").hexdigest()
+    assert path == os.path.join(str(tmp_path), digest[:2], digest)
+    with open(path, "rb") as handle:
+        assert handle.read() == b"feedback"
+
+
+def test_put_identical_data_stored_once(tmp_path):
+    store = LocalStorage(root=str(tmp_path))
+    first, _ = store.put(b"feedback")
+    modified = os.stat(first).st_mtime_ns
+    second, _ = store.put(b"feedback")
+    assert first == second
+    assert os.stat(second).st_mtime_ns == modified
+    other, _ = store.put(b"other feedback")
+    assert other != first
+    assert len(stored_files(tmp_path)) == 2
+
+
+def test_writer_dedups_on_commit(tmp_path):
+    store = LocalStorage(root=str(tmp_path))
+    paths = []
+    for _ in range(2):
+        writer = store.writer()
+        writer.write(b"sub")
+        writer.write(b"mission")
+        paths.append(writer.commit())
+        assert writer.size == len(b"submission")
+        assert writer.digest == hashlib.sha256(b"submission").hexdigest()
+    assert paths[0] == paths[1]
+    # nothing left in the temporary area
+    assert stored_files(tmp_path) == [hashlib.sha256(b"submission").hexdigest()]
+
+
+def test_writer_abort(tmp_path):
+    store = LocalStorage(root=str(tmp_path))
+    writer = store.writer()
+    writer.write(b"half a submiss")
+    writer.abort()
+    assert stored_files(tmp_path) == []
+
+
+def test_stat_get_and_delete(tmp_path):
+    store = LocalStorage(root=str(tmp_path))
+    path, digest = store.put(b"0123456789")
+    assert store.exists(path)
+    assert store.stat(path).size == 10
+    assert store.read(path) == b"0123456789"
+    assert store.checksum(path) == digest
+    handle = store.get(path, start=4)
+    assert handle.read(3) == b"456"
+    handle.close()
+    store.delete(path)
+    assert not store.exists(path)
+    with pytest.raises(FileNotFoundError):
+        store.stat(path)
+
+
+def test_reads_legacy_locations(tmp_path):
+    # Files stored before content-addressing live outside the root
+    legacy = tmp_path / "1" / "submitted" / "course" / "assignment.tar.gz"
+    legacy.parent.mkdir(parents=True)
+    legacy.write_bytes(b"old submission")
+    store = LocalStorage(root=str(tmp_path / "blobs"))
+    assert store.read(str(legacy)) == b"old submission"
+
+
+def test_locations(tmp_path):
+    store = LocalStorage(root=str(tmp_path))
+    path, _ = store.put(b"feedback")
+    writer = store.writer()
+    writer.write(b"half a submiss")
+    # (not the partly written file)
+    assert [(location, stored.size) for location, stored in store.locations()] == [(path, len(b"feedback"))]
+    writer.abort()
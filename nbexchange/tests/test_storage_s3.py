@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import os
+
+import boto3
+import pytest
+from mock import patch
+from moto import mock_aws
+
+from nbexchange.handlers.base import BaseHandler
+from nbexchange.storage.s3 import MIN_PART_SIZE, S3Storage
+from nbexchange.tests.utils import (  # noqa: F401 "clear_database"
+    async_requests,
+    clear_database,
+    user_brobbere_student,
+    user_kiz_instructor,
+)
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.ERROR)
+
+BUCKET = "nbexchange-test"
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def storage(s3):
+    return S3Storage(bucket=BUCKET, region_name="us-east-1", part_size=MIN_PART_SIZE)
+
+
+def stored_keys(s3):
+    return sorted(item["Key"] for item in s3.list_objects_v2(Bucket=BUCKET).get("Contents", []))
+
+
+def test_put_stores_by_digest(s3, storage):
+    location, digest = storage.put(b"feedback")
+    assert digest == hashlib.sha256(b"feedback").hexdigest()
+    assert location == f"s3://{BUCKET}/nbexchange/blobs/{digest[:2]}/{digest}"
+    assert storage.read(location) == b"feedback"
+    assert storage.stat(location).size == len(b"feedback")
+    assert storage.put(b"feedback") == (location, digest)
+    assert stored_keys(s3) == [f"nbexchange/blobs/{digest[:2]}/{digest}"]
+
+
+def test_writer_multipart_upload(s3, storage):
+    content = os.urandom(2 * MIN_PART_SIZE + 1024)
+    locations = []
+    for _ in range(2):
+        writer = storage.writer()
+        for start in range(0, len(content), 1024 * 1024):
+            writer.write(content[start : start + 1024 * 1024])  # noqa: E203
+        # parts are uploaded as they fill, not held until the end
+        assert writer._parts
+        locations.append(writer.commit())
+        assert writer.size == len(content)
+        assert writer.digest == hashlib.sha256(content).hexdigest()
+    assert locations[0] == locations[1]
+    # only the blob is left: no temporary objects or uploads
+    assert stored_keys(s3) == [storage.key_for(hashlib.sha256(content).hexdigest())]
+    assert not s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads")
+    assert storage.checksum(locations[0]) == hashlib.sha256(content).hexdigest()
+
+
+def test_writer_abort(s3, storage):
+    writer = storage.writer()
+    writer.write(os.urandom(MIN_PART_SIZE + 1))
+    writer.abort()
+    assert stored_keys(s3) == []
+    assert not s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads")
+
+
+def test_get_range_and_delete(s3, storage):
+    location, _ = storage.put(b"0123456789")
+    handle = storage.get(location, start=4)
+    assert handle.read() == b"456789"
+    handle.close()
+    storage.delete(location)
+    assert not storage.exists(location)
+    with pytest.raises(FileNotFoundError):
+        storage.stat(location)
+    with pytest.raises(FileNotFoundError):
+        storage.get(location)
+
+
+def test_part_size_minimum():
+    with pytest.raises(Exception):
+        S3Storage(bucket=BUCKET, part_size=1024)
+
+
+# Release & fetch an assignment, with the files kept in the bucket
+@pytest.mark.gen_test
+def test_release_and_fetch(app, s3, clear_database):  # noqa: F811
+    storage = S3Storage(bucket=BUCKET, region_name="us-east-1")
+    content = os.urandom(4096)
+    url = app.url + "/assignment?course_id=course_2&assignment_id=assign_a"
+    with patch.dict(app.tornado_application.settings, {"storage": storage}):
+        with patch.object(BaseHandler, "get_current_user", return_value=user_kiz_instructor):
+            r = yield async_requests.post(url, files={"assignment": ("assignment.tar.gz", content)})
+        assert r.json()["success"] is True
+        with patch.object(BaseHandler, "get_current_user", return_value=user_brobbere_student):
+            r = yield async_requests.get(url)
+            assert r.content == content
+            assert r.headers["Etag"] == f'"{hashlib.sha256(content).hexdigest()}"'
+            r = yield async_requests.get(url, headers={"Range": "bytes=10-19"})
+            assert r.status_code == 206
+            assert r.content == content[10:20]
+    assert stored_keys(s3) == [storage.key_for(hashlib.sha256(content).hexdigest())]
+
+
+def test_locations(s3, storage):
+    location, _ = storage.put(b"feedback")
+    # (not the temporary objects, nor anything else in the bucket)
+    s3.put_object(Bucket=BUCKET, Key="nbexchange/tmp/upload", Body=b"half")
+    s3.put_object(Bucket=BUCKET, Key="other", Body=b"other")
+    assert [(found, stored.size) for found, stored in storage.locations()] == [(location, len(b"feedback"))]
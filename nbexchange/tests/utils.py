@@ -2,12 +2,14 @@ import asyncio
 import base64
 import io
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import partial
 
 import pytest
 import requests
+from sqlalchemy import event
 
-from nbexchange.models.actions import Action
+from nbexchange.models.actions import Action, ActionLatest
 from nbexchange.models.assignments import Assignment as AssignmentModel
 from nbexchange.models.courses import Course
 from nbexchange.models.feedback import Feedback
@@ -119,6 +121,25 @@ def get_feedback_file(filename):
     return files
 
 
+@contextmanager
+def capture_statements(engine, parameters=False):
+    """Collect the SQL statements run on `engine` (as `(statement, parameters)` pairs, with `parameters`)
+
+    with capture_statements(engine) as statements:
+        ...
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, params, context, executemany):
+        statements.append((statement, params) if parameters else statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
 class _AsyncRequests:
     """Wrapper around requests to return a Future from request methods
     A single thread is allocated to avoid blocking the IOLoop thread.
@@ -152,10 +173,12 @@ def clear_database(db):
 
     requires the db handler
     """
+    # dependants first: foreign keys are enforced
+    db.query(ActionLatest).delete()
     db.query(Action).delete()
-    db.query(AssignmentModel).delete()
-    db.query(Course).delete()
     db.query(Feedback).delete()
     db.query(Notebook).delete()
+    db.query(AssignmentModel).delete()
     db.query(Subscription).delete()
+    db.query(Course).delete()
     db.query(User).delete()